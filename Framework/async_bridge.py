@@ -0,0 +1,73 @@
+import sys
+import greenlet
+from tracing import span
+
+class _BridgeGreenlet(greenlet.greenlet):
+    """Runs synchronous code on behalf of a coroutine"""
+
+    def __init__(self, fn, driver):
+        super().__init__(fn, driver)
+        self.driver = driver
+
+def in_bridge():
+    """True when called from code started by run_bridged"""
+    return isinstance(greenlet.getcurrent(), _BridgeGreenlet)
+
+def await_(awaitable):
+    """Wait for an awaitable from synchronous code started by run_bridged"""
+    current = greenlet.getcurrent()
+    if not isinstance(current, _BridgeGreenlet):
+        raise RuntimeError("await_() called outside run_bridged()")
+    # Hand the awaitable to the coroutine driving us and resume with its result
+    return current.driver.switch(awaitable)
+
+async def run_bridged(fn, *args, **kwargs):
+    """Run synchronous fn from a coroutine, letting it await through await_().
+
+    This is the same greenlet technique SQLAlchemy uses for its asyncio support: fn runs
+    in its own greenlet and every await_() switches back here so the awaitable runs on
+    the event loop. The existing synchronous handlers can therefore run unchanged while
+    their database and Bot API calls use asyncio drivers.
+    """
+    context = _BridgeGreenlet(fn, greenlet.getcurrent())
+    result = context.switch(*args, **kwargs)
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*sys.exc_info())
+        else:
+            result = context.switch(value)
+    return result
+
+class Bridged:
+    """Synchronous facade over a sync object and its async twin.
+
+    Method calls made under run_bridged go to the async object and are awaited through
+    await_(); calls from anywhere else (background threads, startup code) go to the sync
+    object. Plain attributes always come from the sync object.
+
+    With span_prefix set, bridged calls are recorded as spans of the current trace:
+    the awaitable runs on the event loop, outside the trace that started it.
+    """
+
+    def __init__(self, sync_obj, async_obj, span_prefix=None):
+        self._sync = sync_obj
+        self._async = async_obj
+        self._span_prefix = span_prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._sync, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if in_bridge():
+                if self._span_prefix:
+                    with span(self._span_prefix + name):
+                        return await_(getattr(self._async, name)(*args, **kwargs))
+                return await_(getattr(self._async, name)(*args, **kwargs))
+            return getattr(self._sync, name)(*args, **kwargs)
+
+        call.__name__ = name
+        return call
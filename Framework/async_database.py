@@ -0,0 +1,105 @@
+import copy
+import logging
+from contextlib import contextmanager
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database import Database
+from state_store import UsersTableStateStore, KeyValueStateStore
+
+logger = logging.getLogger(__name__)
+
+# asyncio drivers for the database URLs Database accepts
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg'
+}
+
+class _SessionBoundDatabase(Database):
+    """A view of a Database whose session_scope hands out one given session.
+
+    Commit, rollback and the after-commit work are left to whoever owns the session.
+    """
+
+    def __init__(self, db, session):
+        self.__dict__.update(db.__dict__)
+        self._bound_session = session
+
+        # The database-backed state stores query through their db, so point them at this view
+        if isinstance(db.state_store, (UsersTableStateStore, KeyValueStateStore)):
+            self.state_store = copy.copy(db.state_store)
+            self.state_store.db = self
+
+    @contextmanager
+    def session_scope(self):
+        yield self._bound_session
+
+class AsyncDatabase:
+    """Runs Database methods on an asyncio driver (aiosqlite or asyncpg).
+
+    Every public Database method is available as a coroutine with the same name and
+    arguments. AsyncSession.run_sync gives the method a regular Session driven by the
+    async driver, so the SQL, the caches and the after-commit hooks are the ones the
+    wrapped Database uses. Schema creation, the wallet index and the caches stay with
+    the wrapped Database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+        url = make_url(str(db.engine.url))
+        backend = url.drivername.split('+')[0]
+        if backend not in ASYNC_DRIVERS:
+            raise ValueError(f"No asyncio driver configured for {backend} databases")
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+
+        if db.is_sqlite:
+            self.engine = create_async_engine(url)
+        else:
+            self.engine = create_async_engine(
+                url,
+                pool_size=10,
+                max_overflow=20,
+                pool_timeout=30,
+                pool_recycle=1800,
+                pool_pre_ping=True
+            )
+        self.Session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        logger.info(f"Async database engine ready ({url.drivername})")
+
+    def __getattr__(self, name):
+        method = getattr(Database, name, None)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(lambda db: getattr(db, name)(*args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        setattr(self, name, call)
+        return call
+
+    async def run(self, func):
+        """Call func(db) in one transaction, where db is the wrapped Database bound to an async session"""
+        async with self.Session() as session:
+            try:
+                result = await session.run_sync(lambda sync_session: func(_SessionBoundDatabase(self.db, sync_session)))
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Database error: {e}")
+                raise
+
+            # Same post-commit work as Database.session_scope
+            info = session.sync_session.info
+            for telegram_id in info.pop('invalidate_users', ()):
+                self.db.invalidate_user(telegram_id)
+            for callback in info.pop('after_commit', ()):
+                callback()
+            return result
+
+    async def dispose(self):
+        """Close all pooled connections"""
+        await self.engine.dispose()
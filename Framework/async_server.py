@@ -0,0 +1,292 @@
+import logging
+import time
+import jwt
+from quart import Quart, Response, g, request, jsonify, send_from_directory, redirect
+from quart_cors import cors
+from config import BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, PORT, UPDATE_DEDUP_ENABLED, UPDATE_DEDUP_BACKEND, UPDATE_DEDUP_TTL, UPDATE_DEDUP_MAX_SIZE, METRICS_ENABLED, JWT_SECRET, WEBSITE_URL
+import telegram_api
+from telegram_api import AsyncTelegramClient
+from async_database import AsyncDatabase
+from async_bridge import Bridged, run_bridged
+from update_dedup import UpdateDeduplicator
+from log_setup import log_payload
+from database import get_db, set_db
+from login_tokens import redeem_login_token
+from jwt_cache import verify_jwt_token
+import metrics
+
+# The bot handlers, payment processing and background workers live in combined_server
+import combined_server
+from combined_server import LANDING_PAGE_BUILD_DIR, PREMIUM_PAGE_BUILD_DIR, static_assets, build_file_exists
+
+logger = logging.getLogger(__name__)
+
+app = cors(Quart(__name__, static_folder=None))
+
+# Async drivers for the database and the Bot API
+sync_db = get_db()
+async_db = AsyncDatabase(sync_db)
+telegram = AsyncTelegramClient(BOT_TOKEN)
+
+# Every module's `db` resolves to the process-wide instance, so swapping that in routes
+# the shared handlers through the async drivers inside run_bridged, while the
+# notification and broadcast threads keep using the sync ones
+db = Bridged(sync_db, async_db, span_prefix='db.')
+set_db(db)
+telegram_api.set_client(Bridged(telegram_api.get_client(), telegram, span_prefix='telegram.'))
+
+# Remembers recent update_ids so Telegram redeliveries are dropped
+update_deduplicator = None
+if UPDATE_DEDUP_ENABLED:
+    update_deduplicator = UpdateDeduplicator(
+        ttl=UPDATE_DEDUP_TTL,
+        max_size=UPDATE_DEDUP_MAX_SIZE,
+        db=db if UPDATE_DEDUP_BACKEND == 'database' else None
+    )
+
+@app.after_serving
+async def shutdown():
+    """Close the async connection pools"""
+    await telegram.close()
+    await async_db.dispose()
+
+if METRICS_ENABLED:
+    @app.before_request
+    async def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    async def observe_request(response):
+        """Time every request by its URL rule for /metrics"""
+        start = getattr(g, 'metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, str(response.status_code))
+        return response
+
+async def send_build_file(build_dir, path):
+    """Send a file from a React build, from memory when combined_server indexed it"""
+    assets = static_assets.get(build_dir)
+    asset = assets.get(path) if assets else None
+    if asset is None or asset.data is None:
+        response = await send_from_directory(build_dir, path)
+        if asset is not None:
+            response.headers['Cache-Control'] = asset.cache_control
+        return response
+
+    status, headers, body = assets.respond(
+        asset,
+        request.headers.get('Accept-Encoding', ''),
+        request.headers.get('If-None-Match', '')
+    )
+    return Response(body or b'', status=status, headers=headers)
+
+# --- Routes ---
+
+@app.route('/telegram_webhook', methods=['POST'])
+async def telegram_webhook():
+    """Handle webhook requests from Telegram"""
+    try:
+        update = await request.get_json()
+    except Exception as e:
+        logger.error(f"Error reading Telegram update: {e}", exc_info=True)
+        return '', 500
+
+    # Short-circuit redeliveries before doing any DB or API work
+    update_id = update.get('update_id') if isinstance(update, dict) else None
+    reserved = False
+    try:
+        if update_deduplicator and update_id is not None:
+            if await run_bridged(update_deduplicator.is_duplicate, update_id):
+                return '', 200
+            reserved = True
+
+        await run_bridged(combined_server.process_update, update)
+        return '', 200
+    except Exception as e:
+        logger.error(f"Error processing Telegram update: {e}", exc_info=True)
+        # Let Telegram's redelivery through
+        if reserved:
+            await run_bridged(update_deduplicator.forget, update_id)
+        return '', 500
+
+@app.route('/payment_webhook', methods=['POST'])
+async def payment_webhook():
+    """Handle payment webhook from Solana payment processor"""
+    try:
+        data = await request.get_json()
+        log_payload(logger, "Received webhook data", data)
+
+        await run_bridged(combined_server.process_payment_webhook, data)
+        return jsonify({'status': 'success'}), 200
+    except Exception as e:
+        logger.error(f"Error processing webhook: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/auth', methods=['GET'])
+async def authenticate():
+    """Handle authentication requests from the website"""
+    token = request.args.get('token')
+
+    if not token:
+        return jsonify({'success': False, 'error': 'No token provided'}), 400
+
+    # Verify token
+    user = await run_bridged(redeem_login_token, token)
+
+    if not user:
+        return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
+
+    # Generate JWT for the website
+    payload = {
+        'telegram_id': user['telegram_id'],
+        'username': user['username'],
+        'is_premium': user['is_premium'],
+        'exp': int(time.time()) + 86400  # 24 hour expiration
+    }
+
+    jwt_token = jwt.encode(payload, JWT_SECRET, algorithm='HS256')
+
+    # Redirect to premium or landing page based on premium status
+    if user['is_premium']:
+        redirect_url = f"{WEBSITE_URL}/premium/login?token={jwt_token}"
+    else:
+        redirect_url = f"{WEBSITE_URL}/login?token={jwt_token}"
+
+    return redirect(redirect_url)
+
+@app.route('/verify_jwt', methods=['POST'])
+async def verify_jwt():
+    """Verify a JWT token from the website"""
+    try:
+        auth_header = request.headers.get('Authorization')
+
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'error': 'No token provided'}), 401
+
+        token = auth_header.split(' ')[1]
+
+        # Decode and verify JWT. The user is loaded with it, and both are cached per token;
+        # a premium change drops the cached entry, so downgrades still take effect
+        _, user = await run_bridged(verify_jwt_token, token)
+        if not user or not user['is_premium']:
+            return jsonify({'success': False, 'error': 'User is not premium'}), 403
+
+        return jsonify({
+            'success': True,
+            'user': {
+                'telegram_id': user['telegram_id'],
+                'username': user['username'],
+                'is_premium': user['is_premium']
+            }
+        })
+    except jwt.ExpiredSignatureError:
+        return jsonify({'success': False, 'error': 'Token expired'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'success': False, 'error': 'Invalid token'}), 401
+    except Exception as e:
+        logger.error(f"Error verifying JWT: {e}")
+        return jsonify({'success': False, 'error': 'Server error'}), 500
+
+@app.route('/verify_token_direct', methods=['GET'])
+async def verify_token_direct():
+    """Verify an authentication token directly"""
+    token = request.args.get('token')
+    if not token:
+        return jsonify({'valid': False, 'error': 'No token provided'}), 400
+
+    # Verify the token
+    user = await run_bridged(redeem_login_token, token)
+    if user:
+        return jsonify({
+            'valid': True,
+            'user': {
+                'id': user['telegram_id'],
+                'username': user['username'],
+                'is_premium': user['is_premium']
+            }
+        })
+    else:
+        return jsonify({'valid': False, 'error': 'Invalid or expired token'}), 401
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Latency histograms and payment counters in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        return "Not found", 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Simple health check endpoint"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/ping', methods=['GET'])
+async def ping():
+    """Simple ping endpoint to check if server is running"""
+    return jsonify({'status': 'ok', 'message': 'Server is running'})
+
+@app.route('/', defaults={'path': ''})
+@app.route('/<path:path>')
+async def serve_react(path):
+    """Serve the appropriate React app based on authentication"""
+    # Skip API endpoints
+    if path.startswith('telegram_webhook') or path.startswith('payment_webhook') or path.startswith('verify_token') or path.startswith('api/'):
+        return "Not found", 404
+
+    # Check if user is authenticated and premium by looking for JWT in Authorization header
+    is_premium = False
+    auth_header = request.headers.get('Authorization')
+
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+        try:
+            _, user = await run_bridged(verify_jwt_token, token)
+            is_premium = bool(user and user['is_premium'])
+        except jwt.InvalidTokenError:
+            # Token invalid or expired, user is not authenticated
+            is_premium = False
+
+    # Determine which React app to serve
+    build_dir = PREMIUM_PAGE_BUILD_DIR if is_premium or path.startswith('premium/') else LANDING_PAGE_BUILD_DIR
+
+    # If explicitly requesting premium content but not premium user, redirect to landing
+    if path.startswith('premium/') and not is_premium:
+        return redirect('/')
+
+    # If path starts with 'premium/' and user is premium, strip 'premium/' prefix
+    if path.startswith('premium/') and is_premium:
+        path = path[8:]
+
+    # Static files and other existing build files are served as they are
+    if path and build_file_exists(build_dir, path):
+        return await send_build_file(build_dir, path)
+
+    # For all other routes, serve the index.html from the appropriate build directory
+    if build_file_exists(build_dir, 'index.html'):
+        return await send_build_file(build_dir, 'index.html')
+    else:
+        logger.error(f"index.html not found in {build_dir}")
+        return "React app not built. Run 'npm run build' in the appropriate React app directory.", 500
+
+@app.route('/premium/static/<path:path>')
+async def serve_premium_static(path):
+    """Serve static files from the premium React build directory"""
+    return await send_build_file(PREMIUM_PAGE_BUILD_DIR, f"static/{path}")
+
+@app.route('/static/<path:path>')
+async def serve_static(path):
+    """Serve static files from the landing page React build directory"""
+    return await send_build_file(LANDING_PAGE_BUILD_DIR, f"static/{path}")
+
+if __name__ == '__main__':
+    # Set the webhook from config
+    webhook_url = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+
+    logger.info(f"Setting webhook to {webhook_url}")
+    response = telegram_api.get_client().set_webhook(webhook_url)
+    logger.info(f"Webhook set response: {response}")
+
+    # For production, serve with: hypercorn async_server:app --bind 0.0.0.0:$PORT
+    logger.info(f"Starting async server on port {PORT}")
+    app.run(host='0.0.0.0', port=PORT)
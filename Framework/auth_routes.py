@@ -2,12 +2,13 @@ import jwt
 import time
 import logging
 from flask import request, jsonify, redirect
-from config import JWT_SECRET, WEBSITE_URL, AUTH_TOKEN_EXPIRY
-from database import Database
+from config import JWT_SECRET, WEBSITE_URL
+from database import db
+from jwt_cache import verify_jwt_token
+from login_tokens import issue_login_token, redeem_login_token
 
 # Set up logging
 logger = logging.getLogger(__name__)
-db = Database('translucent_bot.db')
 
 def setup_auth_routes(app):
     """Set up authentication routes on the given Flask app"""
@@ -21,7 +22,7 @@ def setup_auth_routes(app):
             return jsonify({'success': False, 'error': 'No token provided'}), 400
         
         # Verify token
-        user = db.verify_auth_token(token)
+        user = redeem_login_token(token)
         
         if not user:
             return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
@@ -55,11 +56,9 @@ def setup_auth_routes(app):
             
             token = auth_header.split(' ')[1]
             
-            # Decode and verify JWT
-            payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-            
-            # Check if user is still premium (in case they were downgraded)
-            user = db.get_user(payload['telegram_id'])
+            # Decode and verify JWT. The user is loaded with it, and both are cached per token;
+            # a premium change drops the cached entry, so downgrades still take effect
+            _, user = verify_jwt_token(token)
             if not user or not user['is_premium']:
                 return jsonify({'success': False, 'error': 'User is not premium'}), 403
             
@@ -84,10 +83,6 @@ def setup_auth_routes(app):
         """Simple health check endpoint"""
         return jsonify({'status': 'ok'})
     
-    # Clean expired tokens on startup
-    cleaned = db.clean_expired_tokens()
-    logger.info(f"Cleaned {cleaned} expired tokens")
-
     @app.route('/generate_auth_token', methods=['GET'])
     def generate_auth_token():
         """Generate an authentication token for Telegram login"""
@@ -103,7 +98,7 @@ def setup_auth_routes(app):
             return jsonify({'error': 'User not found'}), 404
         
         # Generate token
-        token_data = db.generate_auth_token(int(user_id), AUTH_TOKEN_EXPIRY)
+        token_data = issue_login_token(int(user_id))
         
         if not token_data:
             return jsonify({'error': 'Failed to generate token'}), 500
@@ -121,7 +116,7 @@ def setup_auth_routes(app):
             return jsonify({'valid': False, 'error': 'Missing token parameter'}), 400
         
         # Verify token
-        user = db.verify_auth_token(token)
+        user = redeem_login_token(token)
         
         if not user:
             return jsonify({'valid': False, 'error': 'Invalid or expired token'}), 401
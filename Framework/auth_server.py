@@ -4,19 +4,19 @@ import time
 import logging
 from flask import Flask, request, jsonify, redirect
 from flask_cors import CORS
-from config import BOT_TOKEN, JWT_SECRET, WEBSITE_URL
-from database import Database
+from config import BOT_TOKEN, JWT_SECRET, WEBSITE_URL, TOKEN_SWEEP_ENABLED, TOKEN_SWEEP_INTERVAL, TOKEN_SWEEP_BATCH_SIZE, TOKEN_SWEEP_MAX_BATCHES
+from log_setup import configure_logging
+from database import db, migrate
+from jwt_cache import verify_jwt_token
+from login_tokens import redeem_login_token
+from token_sweeper import TokenSweeper
 
 # Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
-db = Database('translucent_bot.db')
 
 @app.route('/auth', methods=['GET'])
 def authenticate():
@@ -27,7 +27,7 @@ def authenticate():
         return jsonify({'success': False, 'error': 'No token provided'}), 400
     
     # Verify token
-    user = db.verify_auth_token(token)
+    user = redeem_login_token(token)
     
     if not user:
         return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
@@ -57,11 +57,9 @@ def verify_jwt():
         
         token = auth_header.split(' ')[1]
         
-        # Decode and verify JWT
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        
-        # Check if user is still premium (in case they were downgraded)
-        user = db.get_user(payload['telegram_id'])
+        # Decode and verify JWT. The user is loaded with it, and both are cached per token;
+        # a premium change drops the cached entry, so downgrades still take effect
+        _, user = verify_jwt_token(token)
         if not user or not user['is_premium']:
             return jsonify({'success': False, 'error': 'User is not premium'}), 403
         
@@ -87,9 +85,16 @@ def health_check():
     return jsonify({'status': 'ok'})
 
 if __name__ == '__main__':
-    # Clean expired tokens on startup
-    cleaned = db.clean_expired_tokens()
-    logger.info(f"Cleaned {cleaned} expired tokens")
+    migrate()
+
+    # Delete expired login tokens in the background
+    if TOKEN_SWEEP_ENABLED:
+        TokenSweeper(
+            db,
+            interval=TOKEN_SWEEP_INTERVAL,
+            batch_size=TOKEN_SWEEP_BATCH_SIZE,
+            max_batches=TOKEN_SWEEP_MAX_BATCHES
+        ).start()
     
     # Run the Flask app
     port = int(os.environ.get('AUTH_PORT', 5002))
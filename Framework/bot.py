@@ -1,64 +1,48 @@
-import requests
 import time
-import json
 import logging
-from config import BOT_TOKEN, DATABASE_PATH
-from database import Database
+from config import BOT_TOKEN
+from log_setup import configure_logging
+from database import get_db
+from telegram_api import TelegramClient
+from callback_router import CallbackRouter
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes, filters, MessageHandler
 
 # Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 class TelegramBot:
     def __init__(self, token):
         self.token = token
-        self.api_url = f"https://api.telegram.org/bot{token}/"
+        self.client = TelegramClient(token)
         self.offset = 0
-        self.db = Database(DATABASE_PATH)
+        self.db = get_db()
+        
+        # Route inline keyboard callback_data to handlers
+        self.callback_router = CallbackRouter()
+        self.callback_router.add_exact('wallet_menu', self.handle_wallet_menu)
+        self.callback_router.add_exact('add_wallet', self.handle_add_wallet)
+        self.callback_router.add_exact('back_to_start', self.handle_back_to_start)
+        self.callback_router.add_exact('pay_now', self.handle_pay_now)
+        self.callback_router.add_exact('check_payment', self.handle_check_payment)
+        self.callback_router.add_exact('referral_menu', self.handle_referral_menu)
         
     def get_updates(self):
         """Get updates from Telegram API"""
-        params = {
-            'offset': self.offset,
-            'timeout': 30,
-            'allowed_updates': ['message', 'callback_query']
-        }
-        response = requests.get(self.api_url + 'getUpdates', params=params)
-        return response.json()
+        return self.client.get_updates(
+            offset=self.offset,
+            timeout=30,
+            allowed_updates=['message', 'callback_query']
+        )
     
     def send_message(self, chat_id, text, reply_markup=None):
         """Send message to user"""
-        params = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': 'HTML'
-        }
-        
-        if reply_markup:
-            params['reply_markup'] = json.dumps(reply_markup)
-            
-        response = requests.post(self.api_url + 'sendMessage', params=params)
-        return response.json()
+        return self.client.send_message(chat_id, text, reply_markup)
     
     def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
         """Edit message text"""
-        params = {
-            'chat_id': chat_id,
-            'message_id': message_id,
-            'text': text,
-            'parse_mode': 'HTML'
-        }
-        
-        if reply_markup:
-            params['reply_markup'] = json.dumps(reply_markup)
-            
-        response = requests.post(self.api_url + 'editMessageText', params=params)
-        return response.json()
+        return self.client.edit_message_text(chat_id, message_id, text, reply_markup)
     
     def handle_message(self, message):
         """Handle incoming message"""
@@ -96,21 +80,14 @@ class TelegramBot:
         data = callback_query['data']
         
         # Answer callback query to stop loading animation
-        requests.post(self.api_url + 'answerCallbackQuery', {'callback_query_id': query_id})
-        
-        # Handle different callback data
-        if data == 'wallet_menu':
-            self.handle_wallet_menu(chat_id, message_id, user_id)
-        elif data == 'add_wallet':
-            self.handle_add_wallet(chat_id, message_id, user_id)
-        elif data == 'back_to_start':
-            self.handle_start_command(chat_id, user_id, message_id)
-        elif data == 'pay_now':
-            self.handle_pay_now(chat_id, message_id, user_id)
-        elif data == 'check_payment':
-            self.handle_check_payment(chat_id, message_id, user_id)
-        elif data == 'referral_menu':
-            self.handle_referral_menu(chat_id, message_id, user_id)
+        self.client.answer_callback_query(query_id)
+        
+        # Route the callback data to its handler
+        self.callback_router.dispatch(data, chat_id, message_id, user_id)
+    
+    def handle_back_to_start(self, chat_id, message_id, user_id):
+        """Handle back to start menu button click"""
+        self.handle_start_command(chat_id, user_id, message_id)
     
     def handle_start_command(self, chat_id, user_id, message_id=None):
         """Handle /start command"""
@@ -232,6 +209,54 @@ class TelegramBot:
         
         self.edit_message_text(chat_id, message_id, text, keyboard)
     
+    def handle_check_payment(self, chat_id, message_id, user_id):
+        """Handle check payment status button click"""
+        from config import REQUIRED_PAYMENT
+        
+        user = self.db.get_user(user_id)
+        
+        if user and user['is_premium']:
+            payments = self.db.get_user_payments(user_id)
+            latest_payment = max(payments, key=lambda payment: payment['payment_date']) if payments else None
+        
+            if latest_payment:
+                text = (
+                    f"✅ Payment received!\n\n"
+                    f"Amount: {latest_payment['amount']} SOL\n"
+                    f"Transaction ID: {latest_payment['transaction_id'][:6]}...{latest_payment['transaction_id'][-4:]}\n"
+                    f"Date: {latest_payment['payment_date']}\n\n"
+                    f"You now have lifetime access to Translucent! Thank you for your payment."
+                )
+            else:
+                text = (
+                    f"✅ You have premium access to Translucent.\n\n"
+                    f"No payment details found in the database."
+                )
+        
+            keyboard = {
+                'inline_keyboard': [
+                    [{'text': '🏠 Main Menu', 'callback_data': 'back_to_start'}]
+                ]
+            }
+        else:
+            remaining = REQUIRED_PAYMENT - (user['paid_amount'] if user else 0)
+        
+            text = (
+                f"🔄 Checking payment status...\n\n"
+                f"❌ No payment detected yet.\n\n"
+                f"Please send {remaining} SOL to complete your payment.\n\n"
+                f"If you've already sent the payment, please wait a few minutes for it to be processed."
+            )
+        
+            keyboard = {
+                'inline_keyboard': [
+                    [{'text': '🔄 Check Again', 'callback_data': 'check_payment'}],
+                    [{'text': '🔙 Back to Payment Instructions', 'callback_data': 'pay_now'}]
+                ]
+            }
+        
+        self.edit_message_text(chat_id, message_id, text, keyboard)
+    
     def handle_referral_command(self, chat_id, user_id):
         """Handle /referral command"""
         referral_code = self.db.get_referral_code(user_id)
@@ -0,0 +1,222 @@
+import datetime
+import html
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from notifier import TokenBucket
+from telegram_api import get_client
+
+logger = logging.getLogger(__name__)
+
+class BroadcastEngine:
+    """Sends an admin's message to every user who hasn't blocked the bot.
+
+    Recipients are read from the users table in keyset-paginated pages (users.id > last
+    checkpoint) and sent through a thread pool that shares one token bucket. After each
+    page the broadcast row is checkpointed, so a crashed or restarted broadcast resumes
+    from the last finished page; at most one page can be delivered twice. Users Telegram
+    reports as having blocked the bot are flagged and skipped from then on. While a page
+    is still being sent (a long retry_after can hold it for minutes) the checkpoint is
+    refreshed every stale_after / 3 seconds, so no other process takes the broadcast over.
+
+    The admin's text is sent as plain text: it is HTML-escaped, because the Bot API
+    client sends with parse_mode HTML and a stray < or & would fail every recipient.
+
+    rate caps the broadcast itself. Pass the notification queue's limiter to also take each
+    send from its global bucket, so broadcasts and notifications share one budget.
+    """
+
+    def __init__(self, db, client=None, rate=25, senders=8, page_size=200, max_attempts=3,
+                 stale_after=120, on_finish=None, limiter=None):
+        self.db = db
+        self.client = client
+        self.limiter = limiter
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self.on_finish = on_finish
+        self._bucket = TokenBucket(rate)
+        self._bucket_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=senders, thread_name_prefix='broadcast-sender')
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self, text, created_by=None):
+        """Create a broadcast and start sending it in the background. Returns its ID"""
+        broadcast_id = self.db.create_broadcast(text, created_by)
+        self._launch(broadcast_id)
+        logger.info(f"Started broadcast {broadcast_id} for admin {created_by}")
+        return broadcast_id
+
+    def resume(self):
+        """Resume broadcasts left unfinished by a crash or restart"""
+        stale_before = datetime.datetime.now() - datetime.timedelta(seconds=self.stale_after)
+        try:
+            claimed = self.db.claim_resumable_broadcasts(stale_before)
+        except Exception as e:
+            logger.error(f"Error resuming broadcasts: {e}", exc_info=True)
+            return []
+        for broadcast_id in claimed:
+            logger.info(f"Resuming broadcast {broadcast_id}")
+            self._launch(broadcast_id)
+        return claimed
+
+    def cancel(self, broadcast_id):
+        """Stop a broadcast after the page in progress"""
+        with self._lock:
+            progress = self._active.get(broadcast_id)
+            if progress:
+                progress['cancelled'] = True
+                return True
+        # Not running here; another process will see the status at its next checkpoint
+        return self.db.set_broadcast_status(broadcast_id, 'cancelled')
+
+    def interrupt_all(self):
+        """Mark running broadcasts as interrupted so the next process resumes them right away"""
+        with self._lock:
+            active = list(self._active.values())
+            for progress in active:
+                progress['interrupted'] = True
+        for progress in active:
+            self.db.set_broadcast_status(progress['id'], 'interrupted')
+
+    def progress(self, broadcast_id):
+        """Live counters for a broadcast running here, otherwise its last checkpoint"""
+        with self._lock:
+            progress = self._active.get(broadcast_id)
+            if progress:
+                return dict(progress)
+        return self.db.get_broadcast(broadcast_id)
+
+    def stats(self):
+        """Live counters of every broadcast running in this process"""
+        with self._lock:
+            return {broadcast_id: dict(progress) for broadcast_id, progress in self._active.items()}
+
+    def _launch(self, broadcast_id):
+        thread = threading.Thread(target=self._run, args=(broadcast_id,), name=f'broadcast-{broadcast_id}', daemon=True)
+        thread.start()
+
+    def _run(self, broadcast_id):
+        broadcast = self.db.get_broadcast(broadcast_id)
+        progress = {
+            'id': broadcast_id,
+            'status': 'running',
+            'last_user_id': broadcast['last_user_id'] or 0,
+            'sent': broadcast['sent'] or 0,
+            'failed': broadcast['failed'] or 0,
+            'blocked': broadcast['blocked'] or 0,
+            'cancelled': False,
+            'interrupted': False
+        }
+        with self._lock:
+            self._active[broadcast_id] = progress
+        text = html.escape(broadcast['text'], quote=False)
+
+        try:
+            while True:
+                if progress['cancelled'] or self.db.get_broadcast(broadcast_id)['status'] == 'cancelled':
+                    status = 'cancelled'
+                    break
+                if progress['interrupted']:
+                    status = 'interrupted'
+                    break
+
+                page = self.db.get_broadcast_recipients(progress['last_user_id'], self.page_size)
+                if not page:
+                    status = 'completed'
+                    break
+
+                outcomes = self._send_page(progress, page, text)
+                blocked = [telegram_id for (_, telegram_id), outcome in zip(page, outcomes) if outcome == 'blocked']
+                if blocked:
+                    self.db.set_users_blocked(blocked)
+
+                with self._lock:
+                    for outcome in outcomes:
+                        progress[outcome] += 1
+                    progress['last_user_id'] = page[-1][0]
+
+                # A cancel from another process survives the checkpoint and ends the run here
+                if self._checkpoint(progress, 'running') == 'cancelled':
+                    status = 'cancelled'
+                    break
+        except Exception as e:
+            # Leave it 'running'; once the checkpoint goes stale another start resumes it
+            logger.error(f"Broadcast {broadcast_id} stopped: {e}", exc_info=True)
+            status = None
+        finally:
+            with self._lock:
+                self._active.pop(broadcast_id, None)
+
+        if status:
+            self._checkpoint(progress, status)
+            progress['status'] = status
+            logger.info(f"Broadcast {broadcast_id} {status}: {progress['sent']} sent, {progress['failed']} failed, {progress['blocked']} blocked")
+            if self.on_finish:
+                try:
+                    self.on_finish(broadcast, progress)
+                except Exception as e:
+                    logger.error(f"Error in broadcast finish callback: {e}")
+
+    def _send_page(self, progress, page, text):
+        """Send one page of (users.id, telegram_id) recipients. Returns their outcomes in order"""
+        futures = [self._pool.submit(self._send, telegram_id, text) for _, telegram_id in page]
+        while wait(futures, timeout=self.stale_after / 3).not_done:
+            # Heartbeat with the last finished page's progress
+            if self._checkpoint(progress, 'running') == 'cancelled':
+                progress['cancelled'] = True
+        return [future.result() for future in futures]
+
+    def _checkpoint(self, progress, status):
+        """Save progress; returns the status stored, which stays 'cancelled' once cancelled"""
+        return self.db.save_broadcast_progress(
+            progress['id'], progress['last_user_id'],
+            progress['sent'], progress['failed'], progress['blocked'],
+            status=status
+        )
+
+    def _acquire(self):
+        """Wait for a send slot from the senders' bucket, then from the shared limiter"""
+        while True:
+            with self._bucket_lock:
+                wait = self._bucket.wait_time(time.monotonic())
+                if wait == 0:
+                    self._bucket.take()
+                    break
+            time.sleep(wait)
+        while self.limiter:
+            wait = self.limiter.reserve_global(time.monotonic())
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def _send(self, chat_id, text):
+        """Send to one recipient. Returns 'sent', 'blocked' or 'failed'"""
+        client = self.client or get_client()
+        attempts = 0
+        while attempts < self.max_attempts:
+            self._acquire()
+            result = client.send_message(chat_id, text)
+            if result.get('ok'):
+                return 'sent'
+
+            error_code = result.get('error_code')
+            if error_code == 429:
+                # Flood limits apply to the whole bot, so hold every sender. Not counted as an attempt
+                retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+                until = time.monotonic() + retry_after
+                with self._bucket_lock:
+                    self._bucket.block(until)
+                if self.limiter:
+                    self.limiter.block_global(until)
+                continue
+
+            attempts += 1
+            if error_code == 403:
+                return 'blocked'
+            if error_code is not None and 400 <= error_code < 500:
+                return 'failed'
+            time.sleep(min(2 ** attempts, 30))
+        return 'failed'
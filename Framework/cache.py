@@ -0,0 +1,122 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after a time-to-live.
+
+    pop and clear stamp the key with a new generation. A reader that takes generation()
+    before loading a value and passes it to set as since won't cache the value if the key
+    was invalidated in between, so a slow read can't put back a row that is already stale.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        # Generation each key was last invalidated at, bounded like the entries; keys
+        # dropped from it count as invalidated at _invalidated_floor
+        self._invalidated = OrderedDict()
+        self._invalidated_floor = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def _lookup(self, key, now):
+        """Return the live value for key, dropping it if expired. Caller holds the lock"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._data[key]
+            self._stats['expirations'] += 1
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key, value, ttl, now):
+        """Insert or replace an entry, evicting the least recently used. Caller holds the lock"""
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _invalidate(self, key):
+        """Stamp key with a new generation. Caller holds the lock"""
+        self._generation += 1
+        self._invalidated[key] = self._generation
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_size:
+            _, generation = self._invalidated.popitem(last=False)
+            self._invalidated_floor = max(self._invalidated_floor, generation)
+
+    def generation(self):
+        """Token to pass to set as since, taken before reading the value to be cached"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key, default=None):
+        """Get a cached value, or default if missing or expired"""
+        with self._lock:
+            value = self._lookup(key, time.monotonic())
+            if value is _MISSING:
+                self._stats['misses'] += 1
+                return default
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None, since=None):
+        """Cache a value, optionally with its own ttl in seconds.
+
+        With since, skip it if the key was invalidated after that generation. Returns True if cached
+        """
+        with self._lock:
+            if since is not None and self._invalidated.get(key, self._invalidated_floor) > since:
+                return False
+            self._store(key, value, ttl, time.monotonic())
+            return True
+
+    def add(self, key, value=True, ttl=None):
+        """Cache a value only if the key isn't already live. Returns True if it was added"""
+        with self._lock:
+            now = time.monotonic()
+            if self._lookup(key, now) is not _MISSING:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def pop(self, key, default=None):
+        """Remove a key and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            self._invalidate(key)
+            return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self._invalidated.clear()
+            self._invalidated_floor = self._generation
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key, time.monotonic()) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Hit/miss and eviction counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['size'] = len(self._data)
+        stats['max_size'] = self.max_size
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,110 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _PrefixNode:
+    """Node in the prefix trie"""
+    __slots__ = ('children', 'prefix', 'handler')
+
+    def __init__(self):
+        self.children = {}
+        self.prefix = None
+        self.handler = None
+
+class CallbackRouter:
+    """Routes callback_data to handlers with an exact-match table and a prefix trie.
+
+    Exact routes are looked up first. Otherwise the longest registered prefix wins
+    and its handler receives the rest of the callback data as a final argument.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = _PrefixNode()
+        self._timing_hooks = []
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def add_exact(self, data, handler):
+        """Register a handler for an exact callback_data value"""
+        self._exact[data] = handler
+        return handler
+
+    def add_prefix(self, prefix, handler):
+        """Register a handler for every callback_data value starting with prefix"""
+        node = self._prefixes
+        for char in prefix:
+            node = node.children.setdefault(char, _PrefixNode())
+        node.prefix = prefix
+        node.handler = handler
+        return handler
+
+    def exact(self, data):
+        """Decorator form of add_exact"""
+        return lambda handler: self.add_exact(data, handler)
+
+    def prefix(self, prefix):
+        """Decorator form of add_prefix"""
+        return lambda handler: self.add_prefix(prefix, handler)
+
+    def add_timing_hook(self, hook):
+        """Call hook(route, elapsed_seconds) after every dispatched callback"""
+        self._timing_hooks.append(hook)
+        return hook
+
+    def resolve(self, data):
+        """Find the route for callback data. Returns (route, handler, extra_args) or None"""
+        handler = self._exact.get(data)
+        if handler:
+            return data, handler, ()
+
+        # Walk the trie, remembering the longest prefix that has a handler
+        match = None
+        node = self._prefixes
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.handler:
+                match = node
+
+        if match:
+            return f"{match.prefix}*", match.handler, (data[len(match.prefix):],)
+        return None
+
+    def dispatch(self, data, *args):
+        """Run the handler for callback data. Returns False if no route matched"""
+        route = self.resolve(data)
+        if not route:
+            return False
+
+        name, handler, extra = route
+        start = time.perf_counter()
+        try:
+            handler(*args, *extra)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record(name, elapsed)
+            for hook in self._timing_hooks:
+                try:
+                    hook(name, elapsed)
+                except Exception as e:
+                    logger.error(f"Error in callback timing hook: {e}")
+        return True
+
+    def _record(self, name, elapsed):
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, {'calls': 0, 'total_time': 0.0, 'max_time': 0.0})
+            stats['calls'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def stats(self):
+        """Per-route call counts and timings, hottest routes first"""
+        with self._stats_lock:
+            routes = {name: dict(stats) for name, stats in self._stats.items()}
+        for stats in routes.values():
+            stats['avg_time'] = stats['total_time'] / stats['calls']
+        return dict(sorted(routes.items(), key=lambda item: item[1]['total_time'], reverse=True))
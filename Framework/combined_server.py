@@ -1,14 +1,29 @@
-import requests
+import atexit
+import hmac
 import logging
-import json
 import re
+import threading
 import time
 import os
 import datetime
 import jwt
-from flask import Flask, request, jsonify, send_from_directory, redirect
-from config import BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, PAYMENT_WEBHOOK_PATH, PORT, DEPOSIT_ADDRESS, REQUIRED_PAYMENT, COMMISSION_PERCENTAGE, ADMIN_IDS, AUTH_TOKEN_EXPIRY, AUTH_SERVER_URL, WEBSITE_URL
-from database import Database
+from flask import Flask, Response, request, jsonify, send_from_directory, redirect
+from config import WEBHOOK_HOST, WEBHOOK_PATH, PAYMENT_WEBHOOK_PATH, PORT, WEBHOOK_ASYNC_MODE, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_SUBMIT_TIMEOUT, WEBHOOK_DRAIN_TIMEOUT, UPDATE_DEDUP_ENABLED, UPDATE_DEDUP_BACKEND, UPDATE_DEDUP_TTL, UPDATE_DEDUP_MAX_SIZE, PAYMENT_BATCH_MODE, NOTIFY_QUEUE_ENABLED, NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_RATE, NOTIFY_WORKERS, NOTIFY_MAX_ATTEMPTS, NOTIFY_RETRY_BASE_DELAY, NOTIFY_RETRY_MAX_DELAY, BROADCAST_RATE, BROADCAST_SENDERS, BROADCAST_PAGE_SIZE, BROADCAST_RESUME_ON_START, TOKEN_SWEEP_ENABLED, TOKEN_SWEEP_INTERVAL, TOKEN_SWEEP_BATCH_SIZE, TOKEN_SWEEP_MAX_BATCHES, METRICS_ENABLED, STATIC_CACHE_ENABLED, STATIC_CACHE_MAX_FILE_SIZE, STATIC_CACHE_MAX_TOTAL_SIZE, DEPOSIT_ADDRESS, REQUIRED_PAYMENT, ADMIN_IDS, STATS_TOKEN, AUTH_TOKEN_EXPIRY, AUTH_SERVER_URL, WEBSITE_URL
+from database import db, migrate
+from login_tokens import issue_login_token, redeem_login_token, login_token_stats
+from jwt_cache import verify_jwt_token, jwt_cache_stats
+from telegram_api import get_client
+from update_queue import LaneDispatcher
+from callback_router import CallbackRouter
+from update_dedup import UpdateDeduplicator
+from notifier import NotificationQueue
+from broadcast import BroadcastEngine
+from payments import process_transactions, process_each_transaction
+from static_assets import StaticAssets
+from log_setup import configure_logging, log_payload, logging_stats
+import metrics
+from tracing import start_trace, tracing_stats
+from token_sweeper import TokenSweeper
 from flask_cors import CORS
 from auth_routes import setup_auth_routes
 from dotenv import load_dotenv
@@ -19,12 +34,13 @@ from keyboards.referral_keyboards import get_referral_keyboard, get_referral_sta
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+if __name__ == '__main__':
+    # Development runs bring the schema up to date before anything touches it
+    migrate()
+
 # Define paths to React build directories
 LANDING_PAGE_BUILD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Webs', 'landing', 'build')
 PREMIUM_PAGE_BUILD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Webs', 'premium', 'build')
@@ -34,20 +50,92 @@ print(f"Directory exists: {os.path.exists(LANDING_PAGE_BUILD_DIR)}")
 print(f"Looking for Premium Page build files in: {PREMIUM_PAGE_BUILD_DIR}")
 print(f"Directory exists: {os.path.exists(PREMIUM_PAGE_BUILD_DIR)}")
 
-# Now create the Flask app with the static_folder parameter for the landing page
-# We'll handle premium page static files separately
-app = Flask(__name__, static_folder=os.path.join(LANDING_PAGE_BUILD_DIR, 'static'))
-db = Database('translucent_bot.db')
+# Static files of both builds are served by serve_static / serve_premium_static, so
+# Flask's own static route is left out; it would shadow serve_static
+app = Flask(__name__, static_folder=None)
+
+# Both React builds are indexed once and served from memory with ETags and compressed variants
+static_assets = {}
+if STATIC_CACHE_ENABLED:
+    static_assets = {
+        build_dir: StaticAssets(build_dir, max_file_size=STATIC_CACHE_MAX_FILE_SIZE, max_total_size=STATIC_CACHE_MAX_TOTAL_SIZE)
+        for build_dir in (LANDING_PAGE_BUILD_DIR, PREMIUM_PAGE_BUILD_DIR)
+    }
+
+def build_file_exists(build_dir, path):
+    """Whether a React build contains path. The startup index is authoritative when enabled"""
+    if build_dir in static_assets:
+        return static_assets[build_dir].get(path) is not None
+    return os.path.exists(os.path.join(build_dir, path))
+
+def send_build_file(build_dir, path):
+    """Send a file from a React build, from memory when it was indexed"""
+    assets = static_assets.get(build_dir)
+    asset = assets.get(path) if assets else None
+    if asset is None or asset.data is None:
+        response = send_from_directory(build_dir, path)
+        if asset is not None:
+            response.headers['Cache-Control'] = asset.cache_control
+        return response
+
+    status, headers, body = assets.respond(
+        asset,
+        request.headers.get('Accept-Encoding', ''),
+        request.headers.get('If-None-Match', '')
+    )
+    return Response(body or b'', status=status, headers=headers)
 
 # Enable CORS for the app
 CORS(app)
 
+# Time every request by route for /metrics
+if METRICS_ENABLED:
+    metrics.instrument_flask(app)
+
 # Setup authentication routes
 setup_auth_routes(app)
 
 # Use webhook URL from config
 webhook_url = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 
+# Routes inline keyboard callback_data to the handlers registered below
+callback_router = CallbackRouter()
+if METRICS_ENABLED:
+    callback_router.add_timing_hook(lambda route, elapsed: metrics.CALLBACK_SECONDS.observe(elapsed, route))
+
+# Remembers recent update_ids so Telegram redeliveries are dropped
+update_deduplicator = None
+if UPDATE_DEDUP_ENABLED:
+    update_deduplicator = UpdateDeduplicator(
+        ttl=UPDATE_DEDUP_TTL,
+        max_size=UPDATE_DEDUP_MAX_SIZE,
+        db=db if UPDATE_DEDUP_BACKEND == 'database' else None
+    )
+
+# Rate-limited outbound queue for payment and referral notifications
+notifier = None
+if NOTIFY_QUEUE_ENABLED:
+    notifier = NotificationQueue(
+        db,
+        global_rate=NOTIFY_GLOBAL_RATE,
+        per_chat_rate=NOTIFY_PER_CHAT_RATE,
+        workers=NOTIFY_WORKERS,
+        max_attempts=NOTIFY_MAX_ATTEMPTS,
+        base_delay=NOTIFY_RETRY_BASE_DELAY,
+        max_delay=NOTIFY_RETRY_MAX_DELAY
+    )
+
+# Deletes expired and used login tokens in the background
+token_sweeper = None
+if TOKEN_SWEEP_ENABLED:
+    token_sweeper = TokenSweeper(
+        db,
+        interval=TOKEN_SWEEP_INTERVAL,
+        batch_size=TOKEN_SWEEP_BATCH_SIZE,
+        max_batches=TOKEN_SWEEP_MAX_BATCHES
+    )
+    token_sweeper.start()
+
 # Add this helper function after the imports
 def convert_keyboard_to_dict(keyboard_markup):
     """Convert keyboard to raw dictionary format if needed"""
@@ -77,25 +165,7 @@ def convert_keyboard_to_dict(keyboard_markup):
 
 def send_message(chat_id, text, reply_markup=None):
     """Send a message to a chat"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    
-    if reply_markup:
-        payload['reply_markup'] = json.dumps(convert_keyboard_to_dict(reply_markup))
-    
-    try:
-        response = requests.post(url, json=payload)
-        if not response.ok:
-            logger.error(f"Error sending message: {response.text}")
-        
-        return response.json()
-    except Exception as e:
-        logger.error(f"Exception sending message: {e}")
-        return {"ok": False, "error": str(e)}
+    return get_client().send_message(chat_id, text, convert_keyboard_to_dict(reply_markup))
 
 def handle_start_command(chat_id, user_id, username=None, start_param=None):
     """Handle /start command"""
@@ -135,7 +205,7 @@ def handle_start_command(chat_id, user_id, username=None, start_param=None):
         # Special case for web_auth parameter
         if start_param == 'web_auth':
             # Generate auth token and send link with button
-            auth_token = db.generate_auth_token(user_id, AUTH_TOKEN_EXPIRY)
+            auth_token = issue_login_token(user_id)
             if auth_token:
                 auth_url = f"{WEBHOOK_HOST}?token={auth_token['token']}"
                 keyboard = {
@@ -158,6 +228,10 @@ def handle_start_command(chat_id, user_id, username=None, start_param=None):
         user = db.get_user(user_id)
         is_premium = user and user['is_premium']
         
+        # Talking to the bot again means they unblocked it
+        if user and user.get('is_blocked'):
+            db.set_users_blocked([user_id], blocked=False)
+        
         # Show appropriate welcome message based on premium status only
         if is_premium:
             # User is premium, show premium welcome with new format
@@ -200,32 +274,52 @@ def handle_start_command(chat_id, user_id, username=None, start_param=None):
 
 def answer_callback_query(query_id, text=None, show_alert=False):
     """Answer a callback query to stop the loading animation"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/answerCallbackQuery"
-    payload = {'callback_query_id': query_id}
-    
-    if text:
-        payload['text'] = text
-        payload['show_alert'] = show_alert
-        
-    response = requests.post(url, json=payload)
-    return response.json()
+    return get_client().answer_callback_query(query_id, text, show_alert)
 
 def edit_message(chat_id, message_id, text, reply_markup=None):
     """Edit a message"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/editMessageText"
-    payload = {
-        'chat_id': chat_id,
-        'message_id': message_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
+    return get_client().edit_message_text(chat_id, message_id, text, convert_keyboard_to_dict(reply_markup))
+
+@callback_router.exact('back_to_start')
+def handle_back_to_start(chat_id, message_id, user_id):
+    """Handle back to start menu button click"""
+    # Get user info
+    user = db.get_user(user_id)
+    is_premium = user and user['is_premium']
+    
+    # Show appropriate welcome message based on premium status
+    if is_premium:
+        text = (
+            "⭐👁️ <b>Translucent Lifetime Access</b>\n\n"
+            "🎯 The only trading database for finding wallets to track and copy trade across 5 networks\n"
+            "[ SOL, ETH, BASE, TRON, BSC ]\n\n"
+            "🌐 Twitter/X: <a href='https://twitter.com/translucentrade'>@translucentrade</a>\n"
+            "🟢 Trade on all chains via <a href='https://t.me/gmgnaibot?start=i_iuGhO47u'>GMGN.ai</a>\n"
+            "✏️ Contact the developer: <a href='https://x.com/toursoflife'>@toursoflife</a>\n\n"
+            "👁️ To access the website and login, please click the button below. Links expire, and are not intended to be shared for security reasons\n\n"
+            "💰 The referral program is available. Click the button below to setup/manage your referrals\n\n"
+            "Thank you for using Translucent"
+        )
+    else:
+        text = (
+            "👁️ <b>Welcome to Translucent</b>\n\n"
+            "🎯 The only trading database for finding wallets to track and copy trade across 5 networks\n"
+            "[ SOL, ETH, BASE, TRON, BSC ]\n\n"
+            "🌐 Twitter/X: <a href='https://twitter.com/translucentrade'>@translucentrade</a>\n"
+            "🟢 Trade on all chains via <a href='https://t.me/gmgnaibot?start=i_iuGhO47u'>GMGN.ai</a>\n"
+            "✏️ Contact the developer: <a href='https://x.com/toursoflife'>@toursoflife</a>\n\n"
+            "👁️ <b>How to access the website</b>\n\n"
+            "We offer lifetime access for 0.5 solana. Link the wallet you are paying from and then click pay now. Web access will be granted automatically\n\n"
+            "💰 The referral program is available to everybody. Visit the referral program by clicking the button below"
+        )
     
-    if reply_markup:
-        payload['reply_markup'] = json.dumps(convert_keyboard_to_dict(reply_markup))
+    # Create keyboard based on premium status
+    keyboard = get_start_keyboard(is_premium)
     
-    response = requests.post(url, json=payload)
-    return response.json()
+    # Edit the message with the new text and keyboard
+    edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('wallet_menu')
 def handle_wallet_menu(chat_id, message_id, user_id):
     """Handle wallet menu button click"""
     # Get user's wallets
@@ -241,6 +335,7 @@ def handle_wallet_menu(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('add_wallet')
 def handle_add_wallet(chat_id, message_id, user_id):
     """Handle add wallet button click"""
     text = (
@@ -306,6 +401,7 @@ def validate_solana_address(address):
     # Solana addresses are base58 encoded and typically 32-44 characters
     return bool(re.match(r'^[1-9A-HJ-NP-Za-km-z]{32,44}$', address))
 
+@callback_router.exact('pay_now')
 def handle_pay_now(chat_id, message_id, user_id):
     """Handle pay now button click"""
     # Get user information
@@ -360,6 +456,7 @@ def handle_pay_now(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('check_payment')
 def handle_check_payment(chat_id, message_id, user_id):
     """Handle check payment status button click"""
     # Get user info
@@ -405,6 +502,7 @@ def handle_check_payment(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('referral_menu')
 def handle_referral_menu(chat_id, message_id, user_id):
     """Handle referral menu button click"""
     # Similar to handle_referral_command but edit message instead
@@ -441,6 +539,7 @@ def handle_referral_menu(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('remove_wallet')
 def handle_remove_wallet(chat_id, message_id, user_id):
     """Handle remove wallet button click"""
     # Get user's wallets
@@ -472,6 +571,7 @@ def handle_remove_wallet(chat_id, message_id, user_id):
     text = "Select a wallet to remove:"
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.prefix('remove_wallet_')
 def handle_remove_specific_wallet(chat_id, message_id, user_id, wallet_address):
     """Handle removing a specific wallet"""
     # Remove the wallet from the database
@@ -488,6 +588,7 @@ def handle_remove_specific_wallet(chat_id, message_id, user_id, wallet_address):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('create_referral')
 def handle_create_referral(chat_id, message_id, user_id):
     """Handle create referral link button click"""
     text = (
@@ -566,6 +667,7 @@ def validate_referral_code(code):
     """Validate referral code"""
     return re.match(r'^[a-zA-Z0-9_]{3,15}$', code) is not None
 
+@callback_router.exact('change_payout_wallet')
 def handle_change_payout_wallet(chat_id, message_id, user_id):
     """Handle change payout wallet button click"""
     # Get current payout wallet
@@ -635,6 +737,7 @@ def handle_payout_wallet_input(chat_id, user_id, text, message_id=None):
         else:
             send_message(chat_id, error_text)
 
+@callback_router.exact('view_detailed_stats')
 def handle_view_detailed_stats(chat_id, message_id, user_id):
     """Handle view detailed stats button click"""
     # Get referral data
@@ -677,6 +780,7 @@ def handle_view_detailed_stats(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('access_website')
 def handle_access_website(chat_id, message_id, user_id):
     """Handle website access button click"""
     # Check if user is premium
@@ -700,7 +804,7 @@ def handle_access_website(chat_id, message_id, user_id):
         return
     
     # Generate authentication token
-    token_data = db.generate_auth_token(user_id, expiry_minutes=AUTH_TOKEN_EXPIRY)
+    token_data = issue_login_token(user_id)
     
     if not token_data:
         text = (
@@ -720,8 +824,7 @@ def handle_access_website(chat_id, message_id, user_id):
     # Create authentication URL
     auth_url = f"{AUTH_SERVER_URL}/auth?token={token_data['token']}"
     
-    # Calculate expiration time in minutes
-    expires_in = int((token_data['expires_at'] - time.time()) / 60)
+    expires_in = AUTH_TOKEN_EXPIRY
     
     text = (
         "🌐 <b>Website Access</b> 🌐\n\n"
@@ -744,7 +847,7 @@ def handle_web_command(chat_id, user_id):
     """Handle /web command to provide website access"""
     try:
         # Generate auth token
-        auth_token = db.generate_auth_token(user_id, AUTH_TOKEN_EXPIRY)
+        auth_token = issue_login_token(user_id)
         
         if auth_token:
             # Create authentication URL
@@ -775,10 +878,11 @@ def handle_web_command(chat_id, user_id):
         logger.error(f"Error in handle_web_command: {e}")
         send_message(chat_id, "An error occurred. Please try again later.")
 
+@callback_router.exact('website_login')
 def handle_website_login(chat_id, message_id, user_id):
     """Handle website login button click"""
     # Generate auth token
-    auth_token = db.generate_auth_token(user_id, AUTH_TOKEN_EXPIRY)
+    auth_token = issue_login_token(user_id)
     
     if auth_token:
         # Create authentication URL using the ngrok URL
@@ -959,173 +1063,222 @@ def handle_debug_schema(chat_id, user_id):
     finally:
         conn.close()
 
-# --- Payment Processing Functions ---
+# --- Broadcasts ---
 
-def process_transaction(transaction):
-    """Process a single transaction"""
-    try:
-        # Log the entire transaction for debugging
-        logger.info(f"Processing transaction: {json.dumps(transaction, indent=2)}")
-        
-        # Extract transaction details
-        if 'signature' not in transaction:
-            logger.error("Transaction missing signature")
-            return
-            
-        transaction_id = transaction['signature']
-        logger.info(f"Transaction ID: {transaction_id}")
-        
-        # Check for native transfers
-        if 'nativeTransfers' not in transaction or not transaction['nativeTransfers']:
-            logger.info(f"No native transfers in transaction {transaction_id}")
-            return
-            
-        # Log our deposit address for comparison
-        logger.info(f"Our deposit address: {DEPOSIT_ADDRESS}")
-        
-        # Look for transfers to our deposit address
-        for transfer in transaction['nativeTransfers']:
-            to_address = transfer.get('toUserAccount')
-            from_address = transfer.get('fromUserAccount')
-            amount_lamports = transfer.get('amount', 0)
-            
-            logger.info(f"Transfer: {amount_lamports} lamports from {from_address} to {to_address}")
-            
-            # Convert lamports to SOL (1 SOL = 1,000,000,000 lamports)
-            amount_sol = amount_lamports / 1_000_000_000
-            
-            # Check if this is a payment to our deposit address
-            if to_address == DEPOSIT_ADDRESS:
-                logger.info(f"✅ Payment detected: {amount_sol} SOL from {from_address} to {to_address}")
-                
-                # Find the user who owns this wallet
-                user_id = db.get_user_by_wallet(from_address)
-                logger.info(f"Looking up user for wallet {from_address}: user_id = {user_id}")
-                
-                if not user_id:
-                    logger.warning(f"Wallet {from_address} not associated with any user")
-                    continue
-                
-                # Record the payment
-                success = db.add_payment(user_id, transaction_id, amount_sol)
-                logger.info(f"Payment recorded: {success}")
-                
-                if not success:
-                    logger.error(f"Failed to record payment for user {user_id}")
-                    continue
-                
-                # Get user's total paid amount
-                user = db.get_user(user_id)
-                paid_amount = user['paid_amount'] if user else 0
-                logger.info(f"User {user_id} total paid amount: {paid_amount}")
-                
-                # Check if payment is sufficient for premium access
-                if paid_amount >= REQUIRED_PAYMENT:
-                    logger.info(f"User {user_id} has paid enough for premium access")
-                    
-                    # Set user to premium - IMPORTANT: Do this BEFORE processing referral
-                    premium_success = db.set_premium_status(user_id, True)
-                    logger.info(f"Set premium status for user {user_id}: {premium_success}")
-                    
-                    # Process referral if exists - this happens in the background
-                    referrer_id = db.convert_referral(user_id, amount_sol, COMMISSION_PERCENTAGE)
-                    logger.info(f"Processed referral for user {user_id}, referrer: {referrer_id}")
-                    
-                    # Send notification to user - same for all users
-                    send_telegram_message(user_id, 
-                        "🎉 <b>Payment Confirmed!</b> 🎉\n\n"
-                        f"We have received your payment of {amount_sol:.3f} solana\n\n"
-                        f"Enter /start to begin accessing Translucent's features"
-                    )
-                    
-                    # Send notification to referrer if exists
-                    if referrer_id:
-                        referral_stats = db.get_referral_stats(referrer_id)
-                        commission_amount = amount_sol * (COMMISSION_PERCENTAGE/100)
-                        send_telegram_message(referrer_id,
-                            "🎉 <b>Referral Converted!</b> 🎉\n\n"
-                            f"You earned {commission_amount:.3f} SOL in commission.\n\n"
-                            f"Total commission earned: {referral_stats['total_commission']:.3f} SOL"
-                        )
-                else:
-                    # Payment is partial, send notification about remaining amount
-                    remaining = REQUIRED_PAYMENT - paid_amount
-                    send_telegram_message(user_id,
-                        "💰 <b>Partial Payment Received</b> 💰\n\n"
-                        f"• Amount received: {amount_sol:.3f} SOL\n"
-                        f"• Total paid so far: {paid_amount:.3f} SOL\n"
-                        f"• Remaining amount: {remaining:.3f} SOL\n\n"
-                        "Please complete the payment to gain full access."
-                    )
-            else:
-                logger.info(f"❌ Not a payment to our deposit address: {to_address} != {DEPOSIT_ADDRESS}")
-    except Exception as e:
-        logger.error(f"Error processing transaction: {e}", exc_info=True)
+def notify_broadcast_finished(broadcast, progress):
+    """Tell the admin who started a broadcast how it ended"""
+    if broadcast['created_by']:
+        send_message(
+            broadcast['created_by'],
+            f"📣 <b>Broadcast #{broadcast['id']} {progress['status']}</b>\n\n"
+            f"• Sent: {progress['sent']}\n"
+            f"• Failed: {progress['failed']}\n"
+            f"• Blocked: {progress['blocked']}"
+        )
+
+broadcast_engine = BroadcastEngine(
+    db,
+    rate=BROADCAST_RATE,
+    senders=BROADCAST_SENDERS,
+    page_size=BROADCAST_PAGE_SIZE,
+    on_finish=notify_broadcast_finished,
+    limiter=notifier.limiter if notifier else None
+)
+atexit.register(broadcast_engine.interrupt_all)
+if BROADCAST_RESUME_ON_START:
+    # In the background so importing the app doesn't touch the database
+    threading.Thread(target=broadcast_engine.resume, name='broadcast-resume', daemon=True).start()
+
+def handle_broadcast(chat_id, user_id, text):
+    """Start a broadcast to all users (admin only)"""
+    if user_id not in ADMIN_IDS:
+        send_message(chat_id, "⛔ You don't have permission to use this command.")
+        return
+    
+    if not text:
+        send_message(chat_id, "Usage: /broadcast <message>")
+        return
+    
+    broadcast_id = broadcast_engine.start(text, user_id)
+    send_message(
+        chat_id,
+        f"📣 Broadcast #{broadcast_id} started.\n\n"
+        f"Use /broadcast_status {broadcast_id} to follow it or /broadcast_cancel {broadcast_id} to stop it."
+    )
+
+def handle_broadcast_status(chat_id, user_id, broadcast_id=None):
+    """Show progress of a broadcast, the latest one by default (admin only)"""
+    if user_id not in ADMIN_IDS:
+        send_message(chat_id, "⛔ You don't have permission to use this command.")
+        return
+    
+    if broadcast_id is None:
+        latest = db.get_latest_broadcast()
+        broadcast_id = latest['id'] if latest else None
+    progress = broadcast_engine.progress(broadcast_id) if broadcast_id is not None else None
+    if not progress:
+        send_message(chat_id, "❌ Broadcast not found.")
+        return
+    
+    send_message(
+        chat_id,
+        f"📣 <b>Broadcast #{broadcast_id}</b> ({progress['status']})\n\n"
+        f"• Sent: {progress['sent']}\n"
+        f"• Failed: {progress['failed']}\n"
+        f"• Blocked: {progress['blocked']}"
+    )
+
+def handle_broadcast_cancel(chat_id, user_id, broadcast_id):
+    """Stop a running broadcast (admin only)"""
+    if user_id not in ADMIN_IDS:
+        send_message(chat_id, "⛔ You don't have permission to use this command.")
+        return
+    
+    if broadcast_id is None:
+        send_message(chat_id, "Usage: /broadcast_cancel <id>")
+        return
+    
+    if broadcast_engine.cancel(broadcast_id):
+        send_message(chat_id, f"🛑 Broadcast #{broadcast_id} will stop after the current batch.")
+    else:
+        send_message(chat_id, "❌ Broadcast not found.")
+
+def parse_broadcast_id(text):
+    """Get the numeric argument of a /broadcast_status or /broadcast_cancel command"""
+    parts = text.split()
+    return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+# --- Payment Processing Functions ---
 
 def send_telegram_message(chat_id, text):
     """Send a message to a user via Telegram API"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    logger.info(f"Sending Telegram message to {chat_id}: {text}")
-    response = requests.post(url, data=payload)
-    if response.status_code != 200:
-        logger.error(f"Failed to send Telegram message: {response.text}")
-    else:
-        logger.info(f"Telegram message sent successfully: {response.json()}")
+    if notifier:
+        # Delivered by the rate-limited queue, which retries and dead-letters on failure
+        logger.debug("Queueing Telegram message to %s", chat_id)
+        notifier.send(chat_id, text)
+        return
+    
+    logger.debug("Sending Telegram message to %s", chat_id)
+    result = get_client().send_message(chat_id, text)
+    if not result.get('ok'):
+        logger.warning("Telegram message to %s failed: %s", chat_id, result)
 
-def handle_payment_confirmation(user_id, amount, transaction_hash):
-    """Handle payment confirmation from webhook"""
-    try:
-        # Update user's payment status
-        db.update_payment(user_id, amount)
-        
-        # Check if user has reached the required payment amount
-        user = db.get_user(user_id)
+def process_payment_webhook(data):
+    """Process the transactions of one payment webhook, traced as one unit"""
+    transactions = data if isinstance(data, list) else [data]
+    with start_trace('payment_webhook', transactions=len(transactions), batch=PAYMENT_BATCH_MODE):
+        if PAYMENT_BATCH_MODE:
+            logger.info("Processing %d transactions as one batch", len(transactions))
+            process_transactions(transactions, send_telegram_message)
+        else:
+            logger.info("Processing %d transactions", len(transactions))
+            process_each_transaction(transactions, send_telegram_message)
+
+# --- Update Processing ---
+
+def process_update(update):
+    """Run the handler chain for a single Telegram update"""
+    kind = metrics.update_kind(update)
+    tags = {'update_id': update.get('update_id'), 'kind': kind}
+    if kind == 'callback_query':
+        tags['callback_data'] = update['callback_query'].get('data')
+    with start_trace('telegram_update', **tags), metrics.UPDATE_SECONDS.time(kind):
+        handle_update(update)
+
+def handle_update(update):
+    """The handler chain behind process_update"""
+    # Handle messages
+    if 'message' in update:
+        message = update['message']
+        chat_id = message['chat']['id']
+        user_id = message['from']['id']
+        username = message.get('from', {}).get('username')
         
-        if user and user['paid_amount'] >= REQUIRED_PAYMENT and not user['is_premium']:
-            # User has reached the required payment amount, upgrade to premium
-            db.set_premium_status(user_id, True)
+        # Handle commands
+        if 'text' in message:
+            text = message['text']
+            command = text.split()[0] if text.strip() else ''
             
-            # Process referral commission if applicable
-            referrer_id = db.get_referrer(user_id)
-            if referrer_id:
-                commission_amount = amount * (COMMISSION_PERCENTAGE / 100)
-                db.add_commission(referrer_id, commission_amount, user_id)
+            if text.startswith('/start'):
+                # Extract start parameter if any
+                parts = text.split()
+                start_param = parts[1] if len(parts) > 1 else None
                 
-                # Notify referrer
-                referrer_message = (
-                    f"🎉 <b>Commission Earned!</b> 🎉\n\n"
-                    f"One of your referrals has made a payment of {amount:.3f} SOL.\n"
-                    f"You earned {commission_amount:.3f} SOL commission!"
-                )
-                send_message(referrer_id, referrer_message)
-            
-            # Send confirmation to user with new format
-            user_message = (
-                f"🎉 <b>Payment Confirmed!</b> 🎉\n\n"
-                f"We have received your payment of {amount:.3f} solana\n\n"
-                f"Enter /start to begin accessing Translucent's features"
-            )
-            send_message(user_id, user_message)
-        else:
-            # User has made a payment but not enough for premium yet
-            remaining = max(0, REQUIRED_PAYMENT - user['paid_amount'])
-            
-            user_message = (
-                f"🎉 <b>Payment Confirmed!</b> 🎉\n\n"
-                f"We have received your payment of {amount:.3f} solana\n\n"
-                f"Enter /start to begin accessing Translucent's features"
-            )
-            send_message(user_id, user_message)
+                # Special case for web_auth parameter
+                if start_param == 'web_auth':
+                    # Generate auth token and send link with button
+                    auth_token = issue_login_token(user_id)
+                    if auth_token:
+                        auth_url = f"{WEBHOOK_HOST}?token={auth_token['token']}"
+                        keyboard = {
+                            'inline_keyboard': [
+                                [{'text': '🌐 Access Website', 'url': auth_url}]
+                            ]
+                        }
+                        send_message(
+                            chat_id,
+                            f"🔗 <b>Website Authentication</b> 🔗\n\n"
+                            f"Click the button below to access the Translucent website with your account:",
+                            keyboard
+                        )
+                    else:
+                        send_message(chat_id, "❌ Failed to generate authentication token. Please try again.")
+                    return
+                
+                # Handle regular start command or referral
+                handle_start_command(chat_id, user_id, username, start_param)
+            elif text == '/debug_codes' and user_id in ADMIN_IDS:
+                handle_debug_codes(chat_id, user_id)
+            elif text == '/debug_schema' and user_id in ADMIN_IDS:
+                handle_debug_schema(chat_id, user_id)
+            elif command == '/broadcast':
+                handle_broadcast(chat_id, user_id, text[len('/broadcast'):].strip())
+            elif command == '/broadcast_status':
+                handle_broadcast_status(chat_id, user_id, parse_broadcast_id(text))
+            elif command == '/broadcast_cancel':
+                handle_broadcast_cancel(chat_id, user_id, parse_broadcast_id(text))
+            else:
+                # Check if user is in a state waiting for input
+                state = db.get_user_state(user_id)
+                message_id = message.get('message_id')
+                if state == 'ADD_WALLET':
+                    handle_wallet_input(chat_id, user_id, text, message_id)
+                elif state == 'CREATE_REFERRAL':
+                    handle_referral_code_input(chat_id, user_id, text, message_id)
+                elif state == 'SET_PAYOUT_WALLET':
+                    handle_payout_wallet_input(chat_id, user_id, text, message_id)
+                # Simply ignore other commands - no need to respond
+    
+    # Handle callback queries (button clicks)
+    elif 'callback_query' in update:
+        callback_query = update['callback_query']
+        query_id = callback_query['id']
+        chat_id = callback_query['message']['chat']['id']
+        message_id = callback_query['message']['message_id']
+        user_id = callback_query['from']['id']
+        data = callback_query['data']
         
-        return True
-    except Exception as e:
-        logger.error(f"Error handling payment confirmation: {e}", exc_info=True)
-        return False
+        # Answer callback query to stop loading animation
+        answer_callback_query(query_id)
+        
+        # Route the callback data to its handler
+        if not callback_router.dispatch(data, chat_id, message_id, user_id):
+            logger.info(f"No handler for callback data: {data}")
+
+def get_update_chat_id(update):
+    """Get the chat an update belongs to, used to keep each chat's updates in order"""
+    if 'message' in update:
+        return update['message'].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        return update['callback_query'].get('message', {}).get('chat', {}).get('id')
+    return update.get('update_id')
+
+# Worker lanes for acknowledge-then-process mode. Updates from the same chat always
+# land on the same lane, so conversation state changes are applied in order
+update_queue = None
+if WEBHOOK_ASYNC_MODE:
+    update_queue = LaneDispatcher(process_update, get_update_chat_id, lanes=WEBHOOK_WORKERS, max_size=WEBHOOK_QUEUE_SIZE, name='telegram-updates')
+    atexit.register(update_queue.shutdown, WEBHOOK_DRAIN_TIMEOUT)
 
 # --- Routes ---
 
@@ -1134,141 +1287,40 @@ def telegram_webhook():
     """Handle webhook requests from Telegram"""
     try:
         update = request.json
+    except Exception as e:
+        logger.error(f"Error reading Telegram update: {e}", exc_info=True)
+        return '', 500
+    
+    # Short-circuit redeliveries before doing any DB or API work
+    update_id = update.get('update_id') if isinstance(update, dict) else None
+    reserved = False
+    try:
+        if update_deduplicator and update_id is not None:
+            if update_deduplicator.is_duplicate(update_id):
+                return '', 200
+            reserved = True
         
-        # Handle messages
-        if 'message' in update:
-            message = update['message']
-            chat_id = message['chat']['id']
-            user_id = message['from']['id']
-            username = message.get('from', {}).get('username')
-            
-            # Handle commands
-            if 'text' in message:
-                text = message['text']
-                
-                if text.startswith('/start'):
-                    # Extract start parameter if any
-                    parts = text.split()
-                    start_param = parts[1] if len(parts) > 1 else None
-                    
-                    # Special case for web_auth parameter
-                    if start_param == 'web_auth':
-                        # Generate auth token and send link with button
-                        auth_token = db.generate_auth_token(user_id, AUTH_TOKEN_EXPIRY)
-                        if auth_token:
-                            auth_url = f"{WEBHOOK_HOST}?token={auth_token['token']}"
-                            keyboard = {
-                                'inline_keyboard': [
-                                    [{'text': '🌐 Access Website', 'url': auth_url}]
-                                ]
-                            }
-                            send_message(
-                                chat_id,
-                                f"🔗 <b>Website Authentication</b> 🔗\n\n"
-                                f"Click the button below to access the Translucent website with your account:",
-                                keyboard
-                            )
-                        else:
-                            send_message(chat_id, "❌ Failed to generate authentication token. Please try again.")
-                        return '', 200
-                    
-                    # Handle regular start command or referral
-                    handle_start_command(chat_id, user_id, username, start_param)
-                elif text == '/debug_codes' and user_id in ADMIN_IDS:
-                    handle_debug_codes(chat_id, user_id)
-                elif text == '/debug_schema' and user_id in ADMIN_IDS:
-                    handle_debug_schema(chat_id, user_id)
-                else:
-                    # Check if user is in a state waiting for input
-                    state = db.get_user_state(user_id)
-                    message_id = message.get('message_id')
-                    if state == 'ADD_WALLET':
-                        handle_wallet_input(chat_id, user_id, text, message_id)
-                    elif state == 'CREATE_REFERRAL':
-                        handle_referral_code_input(chat_id, user_id, text, message_id)
-                    elif state == 'SET_PAYOUT_WALLET':
-                        handle_payout_wallet_input(chat_id, user_id, text, message_id)
-                    # Simply ignore other commands - no need to respond
-        
-        # Handle callback queries (button clicks)
-        elif 'callback_query' in update:
-            callback_query = update['callback_query']
-            query_id = callback_query['id']
-            chat_id = callback_query['message']['chat']['id']
-            message_id = callback_query['message']['message_id']
-            user_id = callback_query['from']['id']
-            data = callback_query['data']
+        if WEBHOOK_ASYNC_MODE:
+            # Acknowledge right away and let the worker pool run the handlers
+            if not isinstance(update, dict) or 'update_id' not in update:
+                logger.warning("Rejected malformed Telegram update")
+                return '', 400
             
-            # Answer callback query to stop loading animation
-            answer_callback_query(query_id)
+            if not update_queue.submit(update, timeout=WEBHOOK_SUBMIT_TIMEOUT):
+                # Queue is full, Telegram will redeliver the update later
+                if reserved:
+                    update_deduplicator.forget(update_id)
+                return '', 503
             
-            # Handle different callback data
-            if data == 'wallet_menu':
-                handle_wallet_menu(chat_id, message_id, user_id)
-            elif data == 'add_wallet':
-                handle_add_wallet(chat_id, message_id, user_id)
-            elif data == 'remove_wallet':
-                handle_remove_wallet(chat_id, message_id, user_id)
-            elif data.startswith('remove_wallet_'):
-                # Extract the wallet address from the callback data
-                wallet_address = data[len('remove_wallet_'):]
-                handle_remove_specific_wallet(chat_id, message_id, user_id, wallet_address)
-            elif data == 'back_to_start':
-                # Get user info
-                user = db.get_user(user_id)
-                is_premium = user and user['is_premium']
-                
-                # Show appropriate welcome message based on premium status
-                if is_premium:
-                    text = (
-                        "⭐👁️ <b>Translucent Lifetime Access</b>\n\n"
-                        "🎯 The only trading database for finding wallets to track and copy trade across 5 networks\n"
-                        "[ SOL, ETH, BASE, TRON, BSC ]\n\n"
-                        "🌐 Twitter/X: <a href='https://twitter.com/translucentrade'>@translucentrade</a>\n"
-                        "🟢 Trade on all chains via <a href='https://t.me/gmgnaibot?start=i_iuGhO47u'>GMGN.ai</a>\n"
-                        "✏️ Contact the developer: <a href='https://x.com/toursoflife'>@toursoflife</a>\n\n"
-                        "👁️ To access the website and login, please click the button below. Links expire, and are not intended to be shared for security reasons\n\n"
-                        "💰 The referral program is available. Click the button below to setup/manage your referrals\n\n"
-                        "Thank you for using Translucent"
-                    )
-                else:
-                    text = (
-                        "👁️ <b>Welcome to Translucent</b>\n\n"
-                        "🎯 The only trading database for finding wallets to track and copy trade across 5 networks\n"
-                        "[ SOL, ETH, BASE, TRON, BSC ]\n\n"
-                        "🌐 Twitter/X: <a href='https://twitter.com/translucentrade'>@translucentrade</a>\n"
-                        "🟢 Trade on all chains via <a href='https://t.me/gmgnaibot?start=i_iuGhO47u'>GMGN.ai</a>\n"
-                        "✏️ Contact the developer: <a href='https://x.com/toursoflife'>@toursoflife</a>\n\n"
-                        "👁️ <b>How to access the website</b>\n\n"
-                        "We offer lifetime access for 0.5 solana. Link the wallet you are paying from and then click pay now. Web access will be granted automatically\n\n"
-                        "💰 The referral program is available to everybody. Visit the referral program by clicking the button below"
-                    )
-                
-                # Create keyboard based on premium status
-                keyboard = get_start_keyboard(is_premium)
-                
-                # Edit the message with the new text and keyboard
-                edit_message(chat_id, message_id, text, keyboard)
-            elif data == 'pay_now':
-                handle_pay_now(chat_id, message_id, user_id)
-            elif data == 'check_payment':
-                handle_check_payment(chat_id, message_id, user_id)
-            elif data == 'referral_menu':
-                handle_referral_menu(chat_id, message_id, user_id)
-            elif data == 'create_referral':
-                handle_create_referral(chat_id, message_id, user_id)
-            elif data == 'change_payout_wallet':
-                handle_change_payout_wallet(chat_id, message_id, user_id)
-            elif data == 'view_detailed_stats':
-                handle_view_detailed_stats(chat_id, message_id, user_id)
-            elif data == 'access_website':
-                handle_access_website(chat_id, message_id, user_id)
-            elif data == 'website_login':
-                handle_website_login(chat_id, message_id, user_id)
+            return '', 200
         
+        process_update(update)
         return '', 200
     except Exception as e:
         logger.error(f"Error processing Telegram update: {e}", exc_info=True)
+        # Let Telegram's redelivery through
+        if reserved:
+            update_deduplicator.forget(update_id)
         return '', 500
 
 @app.route('/payment_webhook', methods=['POST'])
@@ -1276,18 +1328,8 @@ def payment_webhook():
     """Handle payment webhook from Solana payment processor"""
     try:
         data = request.json
-        logger.info(f"Received webhook data: {json.dumps(data, indent=2)}")
-        
-        # Check if data is a list (multiple transactions)
-        if isinstance(data, list):
-            logger.info(f"Processing {len(data)} transactions")
-            for transaction in data:
-                process_transaction(transaction)
-        else:
-            # Single transaction
-            logger.info("Processing single transaction")
-            process_transaction(data)
-            
+        log_payload(logger, "Received webhook data", data)
+        process_payment_webhook(data)
         return jsonify({'status': 'success'}), 200
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
@@ -1301,7 +1343,7 @@ def verify_token_direct():
         return jsonify({'valid': False, 'error': 'No token provided'}), 400
         
     # Verify the token
-    user = db.verify_auth_token(token)
+    user = redeem_login_token(token)
     if user:
         return jsonify({
             'valid': True,
@@ -1319,6 +1361,35 @@ def ping():
     """Simple ping endpoint to check if server is running"""
     return jsonify({'status': 'ok', 'message': 'Server is running'})
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Latency histograms and payment counters in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        return "Not found", 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/webhook_stats', methods=['GET'])
+def webhook_stats():
+    """Internal queue, cache and delivery counters, for holders of STATS_TOKEN"""
+    if not STATS_TOKEN or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {STATS_TOKEN}'):
+        return "Not found", 404
+    return jsonify({
+        'async_mode': WEBHOOK_ASYNC_MODE,
+        'queue': update_queue.stats() if update_queue else None,
+        'dedup': update_deduplicator.stats() if update_deduplicator else None,
+        'user_cache': db.get_user_cache_stats(),
+        'wallet_index': db.wallet_index.stats() if db.wallet_index else None,
+        'notifications': notifier.stats() if notifier else None,
+        'broadcasts': broadcast_engine.stats(),
+        'login_tokens': login_token_stats(),
+        'jwt_cache': jwt_cache_stats(),
+        'logging': logging_stats(),
+        'tracing': tracing_stats(),
+        'static_assets': {os.path.basename(os.path.dirname(build_dir)): assets.stats() for build_dir, assets in static_assets.items()},
+        'token_sweeper': token_sweeper.stats() if token_sweeper else None,
+        'callbacks': callback_router.stats()
+    })
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_react(path):
@@ -1327,9 +1398,6 @@ def serve_react(path):
     if path.startswith('telegram_webhook') or path.startswith('payment_webhook') or path.startswith('verify_token') or path.startswith('api/'):
         return "Not found", 404
     
-    # Log the requested path
-    logger.info(f"Serving React path: {path}")
-    
     # Check if user is authenticated and premium by looking for JWT in Authorization header
     is_premium = False
     auth_header = request.headers.get('Authorization')
@@ -1337,11 +1405,10 @@ def serve_react(path):
     if auth_header and auth_header.startswith('Bearer '):
         token = auth_header.split(' ')[1]
         try:
-            # Decode and verify JWT
-            payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-            user = db.get_user(payload['telegram_id'])
-            is_premium = user and user['is_premium']
-        except:
+            # Verified tokens are cached, so the page's asset requests don't each decode and query
+            _, user = verify_jwt_token(token)
+            is_premium = bool(user and user['is_premium'])
+        except jwt.InvalidTokenError:
             # Token invalid or expired, user is not authenticated
             is_premium = False
     
@@ -1356,24 +1423,13 @@ def serve_react(path):
     if path.startswith('premium/') and is_premium:
         path = path[8:]  # Remove 'premium/' prefix
     
-    # Special case for static files
-    if path.startswith('static/'):
-        # Extract the file path relative to the build directory
-        file_path = path
-        directory = os.path.join(build_dir, os.path.dirname(file_path))
-        filename = os.path.basename(file_path)
-        logger.info(f"Serving static file: {filename} from {directory}")
-        return send_from_directory(directory, filename)
-    
-    # Check if the file exists in the build directory
-    if path and os.path.exists(os.path.join(build_dir, path)):
-        logger.info(f"Serving file: {path} from {build_dir}")
-        return send_from_directory(build_dir, path)
+    # Static files and other existing build files are served as they are
+    if path and build_file_exists(build_dir, path):
+        return send_build_file(build_dir, path)
     
     # For all other routes, serve the index.html from the appropriate build directory
-    logger.info(f"Serving index.html from {build_dir}")
-    if os.path.exists(os.path.join(build_dir, 'index.html')):
-        return send_from_directory(build_dir, 'index.html')
+    if build_file_exists(build_dir, 'index.html'):
+        return send_build_file(build_dir, 'index.html')
     else:
         logger.error(f"index.html not found in {build_dir}")
         return "React app not built. Run 'npm run build' in the appropriate React app directory.", 500
@@ -1382,28 +1438,22 @@ def serve_react(path):
 @app.route('/premium/static/<path:path>')
 def serve_premium_static(path):
     """Serve static files from the premium React build directory"""
-    logger.info(f"Serving premium static file: {path}")
-    return send_from_directory(os.path.join(PREMIUM_PAGE_BUILD_DIR, 'static'), path)
+    return send_build_file(PREMIUM_PAGE_BUILD_DIR, f"static/{path}")
 
 # The regular static route remains for landing page
 @app.route('/static/<path:path>')
 def serve_static(path):
     """Serve static files from the landing page React build directory"""
-    logger.info(f"Serving landing page static file: {path}")
-    return send_from_directory(os.path.join(LANDING_PAGE_BUILD_DIR, 'static'), path)
+    return send_build_file(LANDING_PAGE_BUILD_DIR, f"static/{path}")
 
 if __name__ == '__main__':
-    # Add any missing columns to the database
-    db.add_missing_columns()
-    
     # Set the webhook from config
     webhook_url = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
-    set_webhook_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook?url={webhook_url}"
     
     logger.info(f"Setting webhook to {webhook_url}")
-    response = requests.get(set_webhook_url)
-    logger.info(f"Webhook set response: {response.json()}")
+    response = get_client().set_webhook(webhook_url)
+    logger.info(f"Webhook set response: {response}")
     
-    # Run the Flask app
+    # Run the Flask development server; in production use: gunicorn -c gunicorn.conf.py combined_server:app
     logger.info(f"Starting combined webhook server on port {PORT}")
     app.run(host='0.0.0.0', port=PORT) 
\ No newline at end of file
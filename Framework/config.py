@@ -3,6 +3,13 @@ import os
 # Telegram Bot Token from BotFather
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 
+# Telegram Bot API client configuration
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', '20'))  # Keep-alive connections to the Bot API
+TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get('TELEGRAM_CONNECT_TIMEOUT', '5'))  # seconds
+TELEGRAM_READ_TIMEOUT = float(os.environ.get('TELEGRAM_READ_TIMEOUT', '15'))  # seconds
+TELEGRAM_HTTP2 = os.environ.get('TELEGRAM_HTTP2', 'true').lower() in ('1', 'true', 'yes')  # Used when httpx and h2 are installed
+
 # Solana Configuration
 DEPOSIT_ADDRESS = os.environ.get('DEPOSIT_ADDRESS')  # The address users will send SOL to
 REQUIRED_PAYMENT = float(os.environ.get('REQUIRED_PAYMENT', '0.5'))  # Amount in SOL required for premium
@@ -13,9 +20,27 @@ COMMISSION_PERCENTAGE = float(os.environ.get('COMMISSION_PERCENTAGE', '10.0'))
 # Helius Configuration
 HELIUS_API_KEY = os.environ.get('HELIUS_API_KEY')
 WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+PAYMENT_BATCH_MODE = os.environ.get('PAYMENT_BATCH_MODE', 'true').lower() in ('1', 'true', 'yes')  # Apply each webhook payload in one database transaction
 
 # Database Configuration - SQLite
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'translucent_bot.db')  # SQLite database file
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'false').lower() in ('1', 'true', 'yes')  # create/upgrade the schema whenever a process starts
+DB_MIGRATE_ON_START = os.environ.get('DB_MIGRATE_ON_START', 'true').lower() in ('1', 'true', 'yes')  # gunicorn: migrate once in the master before workers start
+REFERRAL_COUNTERS_ENABLED = os.environ.get('REFERRAL_COUNTERS_ENABLED', 'false').lower() in ('1', 'true', 'yes')  # Materialized per-referrer stats rows
+
+# User profile cache in front of Database.get_user
+USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '30'))  # seconds, bounds staleness across processes
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))  # cached users per process
+
+# Conversation state store: 'users' (users.state column), 'table' (shared conversation_states table) or 'memory'
+STATE_STORE = os.environ.get('STATE_STORE', 'users')
+STATE_TTL = int(os.environ.get('STATE_TTL', '3600'))  # seconds before an abandoned conversation state expires
+STATE_WRITE_BEHIND = os.environ.get('STATE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')  # memory store: persist to users.state in the background
+STATE_FLUSH_INTERVAL = float(os.environ.get('STATE_FLUSH_INTERVAL', '5'))  # seconds between write-behind flushes
+
+# In-memory wallet -> user index used to match payments
+WALLET_INDEX_ENABLED = os.environ.get('WALLET_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
 
 # Server Configuration
 WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST')
@@ -25,11 +50,85 @@ PAYMENT_WEBHOOK_PATH = os.environ.get('PAYMENT_WEBHOOK_PATH', '/payment_webhook'
 PORT = int(os.environ.get('PORT', '8000'))  # Port for Telegram webhook
 PAYMENT_PORT = int(os.environ.get('PAYMENT_PORT', '5001'))  # Port for payment webhook
 
+# Production server (gunicorn.conf.py)
+GUNICORN_WORKERS = int(os.environ.get('GUNICORN_WORKERS', '2'))  # worker processes
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', '8'))  # request threads per worker
+GUNICORN_TIMEOUT = int(os.environ.get('GUNICORN_TIMEOUT', '60'))  # seconds before a stuck worker is restarted
+GUNICORN_GRACEFUL_TIMEOUT = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))  # seconds workers get to finish on reload/shutdown
+GUNICORN_KEEPALIVE = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))  # seconds to hold idle keep-alive connections
+GUNICORN_MAX_REQUESTS = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))  # recycle a worker after this many requests, 0 disables
+GUNICORN_MAX_REQUESTS_JITTER = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+SET_WEBHOOK_ON_START = os.environ.get('SET_WEBHOOK_ON_START', 'true').lower() in ('1', 'true', 'yes')  # point Telegram at WEBHOOK_HOST when the server starts
+
+# Logging
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')  # per-module levels, e.g. "combined_server=WARNING,database=DEBUG"
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' or 'json' (one object per line)
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))  # records waiting for the writer thread, more are dropped
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))  # share of webhook payloads logged at DEBUG
+
+# Prometheus-style metrics on /metrics (per process; scrape each worker or run one)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Request tracing - spans for every Database method and Bot API call within an update or payment webhook
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))  # share of traces exported
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '0'))  # also export every trace slower than this; 0 disables
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'log')  # 'log' (JSON lines on the tracing.spans logger) or 'collector'
+TRACE_COLLECTOR_URL = os.environ.get('TRACE_COLLECTOR_URL', 'http://localhost:9411/api/v2/spans')  # Zipkin v2 JSON endpoint
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'telegram-bot')
+TRACE_QUEUE_SIZE = int(os.environ.get('TRACE_QUEUE_SIZE', '1000'))  # traces waiting for the collector before new ones are dropped
+
+# Webhook processing - acknowledge Telegram updates immediately and process them on a worker pool
+WEBHOOK_ASYNC_MODE = os.environ.get('WEBHOOK_ASYNC_MODE', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))  # Worker lanes per process, each chat is pinned to one lane
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))  # Max queued updates before rejecting, split across lanes
+WEBHOOK_SUBMIT_TIMEOUT = float(os.environ.get('WEBHOOK_SUBMIT_TIMEOUT', '2'))  # seconds to wait for queue space
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get('WEBHOOK_DRAIN_TIMEOUT', '30'))  # seconds to drain the queue on shutdown
+
+# Drop Telegram redeliveries of updates we've already seen
+UPDATE_DEDUP_ENABLED = os.environ.get('UPDATE_DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+UPDATE_DEDUP_BACKEND = os.environ.get('UPDATE_DEDUP_BACKEND', 'memory')  # 'memory' or 'database' (shared between processes)
+UPDATE_DEDUP_TTL = int(os.environ.get('UPDATE_DEDUP_TTL', '3600'))  # seconds to remember an update_id
+UPDATE_DEDUP_MAX_SIZE = int(os.environ.get('UPDATE_DEDUP_MAX_SIZE', '100000'))  # update_ids kept in memory
+
+# Outbound notification queue (payment and referral messages)
+NOTIFY_QUEUE_ENABLED = os.environ.get('NOTIFY_QUEUE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+NOTIFY_GLOBAL_RATE = float(os.environ.get('NOTIFY_GLOBAL_RATE', str(30 / GUNICORN_WORKERS)))  # messages per second for this process, notifications and broadcasts together; Telegram allows ~30 per bot across all workers
+NOTIFY_PER_CHAT_RATE = float(os.environ.get('NOTIFY_PER_CHAT_RATE', '1'))  # messages per second to a single chat
+NOTIFY_WORKERS = int(os.environ.get('NOTIFY_WORKERS', '4'))  # concurrent sends
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', '5'))  # attempts before a message is dead-lettered
+NOTIFY_RETRY_BASE_DELAY = float(os.environ.get('NOTIFY_RETRY_BASE_DELAY', '1'))  # seconds, doubled on each retry
+NOTIFY_RETRY_MAX_DELAY = float(os.environ.get('NOTIFY_RETRY_MAX_DELAY', '60'))  # seconds
+
+# Admin broadcasts to the whole user base
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', str(NOTIFY_GLOBAL_RATE * 2 / 3)))  # messages per second for this process, drawn from NOTIFY_GLOBAL_RATE so the rest is left for notifications
+BROADCAST_SENDERS = int(os.environ.get('BROADCAST_SENDERS', '8'))  # concurrent sends
+BROADCAST_PAGE_SIZE = int(os.environ.get('BROADCAST_PAGE_SIZE', '200'))  # recipients per page, progress is checkpointed after each page
+BROADCAST_RESUME_ON_START = os.environ.get('BROADCAST_RESUME_ON_START', 'true').lower() in ('1', 'true', 'yes')
+
+# React builds served from memory (indexed at startup, so restart after a new build)
+STATIC_CACHE_ENABLED = os.environ.get('STATIC_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+STATIC_CACHE_MAX_FILE_SIZE = int(os.environ.get('STATIC_CACHE_MAX_FILE_SIZE', str(1024 * 1024)))  # bytes, larger files are sent from disk
+STATIC_CACHE_MAX_TOTAL_SIZE = int(os.environ.get('STATIC_CACHE_MAX_TOTAL_SIZE', str(64 * 1024 * 1024)))  # bytes per build, including compressed variants
+
 # Admin user IDs (comma-separated list of Telegram IDs)
 ADMIN_IDS = [int(id) for id in os.environ.get('ADMIN_IDS', '').split(',') if id.strip()]
+STATS_TOKEN = os.environ.get('STATS_TOKEN', '')  # bearer token for /webhook_stats, which answers 404 while it is empty
 
 # Authentication Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-super-secret-key-change-this-in-production')
 AUTH_SERVER_URL = WEBHOOK_HOST  # Use the same ngrok URL
 WEBSITE_URL = WEBHOOK_HOST  # Use the same ngrok URL
-AUTH_TOKEN_EXPIRY = int(os.environ.get('AUTH_TOKEN_EXPIRY', '15'))  # minutes 
\ No newline at end of file
+AUTH_TOKEN_EXPIRY = int(os.environ.get('AUTH_TOKEN_EXPIRY', '15'))  # minutes
+JWT_CACHE_ENABLED = os.environ.get('JWT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+JWT_CACHE_TTL = int(os.environ.get('JWT_CACHE_TTL', '60'))  # seconds, bounds staleness of premium status across processes
+JWT_CACHE_MAX_SIZE = int(os.environ.get('JWT_CACHE_MAX_SIZE', '10000'))  # verified tokens per process
+AUTH_TOKEN_MODE = os.environ.get('AUTH_TOKEN_MODE', 'database')  # 'database' (auth_tokens table) or 'signed' (stateless HMAC links)
+AUTH_LINK_SECRET = os.environ.get('AUTH_LINK_SECRET') or JWT_SECRET  # key for signed login links
+AUTH_NONCE_BACKEND = os.environ.get('AUTH_NONCE_BACKEND', 'database')  # 'database' (shared between processes) or 'memory' (single process only)
+AUTH_NONCE_MAX_SIZE = int(os.environ.get('AUTH_NONCE_MAX_SIZE', '100000'))  # spent nonces kept in memory
+TOKEN_SWEEP_ENABLED = os.environ.get('TOKEN_SWEEP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TOKEN_SWEEP_INTERVAL = float(os.environ.get('TOKEN_SWEEP_INTERVAL', '300'))  # seconds between sweeps of expired login tokens
+TOKEN_SWEEP_BATCH_SIZE = int(os.environ.get('TOKEN_SWEEP_BATCH_SIZE', '1000'))  # rows deleted per transaction
+TOKEN_SWEEP_MAX_BATCHES = int(os.environ.get('TOKEN_SWEEP_MAX_BATCHES', '100'))  # per table per sweep, the rest waits for the next one
@@ -1,54 +1,137 @@
-from sqlalchemy import create_engine, text, MetaData, Table, Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, exc, inspect, text, bindparam, MetaData, Table, Column, Index, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 import os
 import time
 import uuid
+import json
 import datetime
 import logging
+import threading
+import weakref
 from contextlib import contextmanager
 import sqlite3  # Still needed for direct migrations
+from config import DATABASE_PATH, DB_AUTO_MIGRATE, METRICS_ENABLED, TRACE_ENABLED, REFERRAL_COUNTERS_ENABLED, USER_CACHE_ENABLED, USER_CACHE_TTL, USER_CACHE_MAX_SIZE, STATE_STORE, STATE_TTL, STATE_WRITE_BEHIND, STATE_FLUSH_INTERVAL, WALLET_INDEX_ENABLED
+from cache import TTLCache
+from state_store import create_state_store
+from wallet_index import WalletIndex
+from tracing import trace_methods
+from metrics import instrument_methods, DB_METHOD_SECONDS, DB_METHOD_ERRORS, PAYMENTS_PROCESSED, PAYMENTS_SOL, REFERRALS_CONVERTED
 
 logger = logging.getLogger(__name__)
 Base = declarative_base()
 
+# Wallet changes kept for WalletIndex.sync; an index further behind rebuilds instead
+WALLET_CHANGES_KEPT = 10000
+
+# Every Database in this process, so their pools can be reset after a fork
+_instances = weakref.WeakSet()
+
+# Called with a telegram_id whenever a user's row changes, for caches kept outside Database
+_user_invalidation_listeners = []
+
+def on_user_invalidated(callback):
+    """Register callback(telegram_id) to run after a committed change to that user"""
+    _user_invalidation_listeners.append(callback)
+
+def _guard_pool_against_fork(engine):
+    """Never hand a connection opened by another process to this one.
+    
+    A forked worker inherits the parent's pooled connections; using the same socket
+    from two processes corrupts both sessions. Connections are tagged with the pid
+    that opened them and discarded on checkout anywhere else.
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+    
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+            raise exc.DisconnectionError(
+                f"Connection belongs to pid {connection_record.info['pid']}, attempting to check out in pid {pid}"
+            )
+
+def reset_after_fork():
+    """Give every Database a fresh, empty connection pool in a newly forked worker.
+    
+    The inherited pools are dropped without closing their connections, which still
+    belong to the parent process.
+    """
+    for db in list(_instances):
+        db.Session.remove()
+        db.engine.pool = db.engine.pool.recreate()
+
+def create_db_engine(db_name=None):
+    """Build the engine for DATABASE_URL, or for a local SQLite file when it isn't set"""
+    # Use environment variable for database URL in production
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url:
+        # Fallback to SQLite for local development
+        db_url = f'sqlite:///{db_name}'
+    
+    logger.info(f"Connecting to database: {db_url.split('@')[0] if '@' in db_url else db_url}")
+    
+    # Create engine with connection pooling if not SQLite
+    if db_url.startswith('sqlite'):
+        # SQLite doesn't need pooling parameters
+        engine = create_engine(
+            db_url,
+            connect_args={"check_same_thread": False}  # Allow multi-threaded access
+        )
+    else:
+        # PostgreSQL and other databases support pooling
+        engine = create_engine(
+            db_url,
+            pool_size=10,
+            max_overflow=20,
+            pool_timeout=30,
+            pool_recycle=1800,  # Recycle connections after 30 minutes
+            pool_pre_ping=True  # Verify connections before using them
+        )
+    
+    _guard_pool_against_fork(engine)
+    return engine
+
 class Database:
-    def __init__(self, db_name=None):
-        # Use environment variable for database URL in production
-        db_url = os.environ.get('DATABASE_URL')
-        if not db_url:
-            # Fallback to SQLite for local development
-            self.db_path = db_name  # Keep for backward compatibility
-            db_url = f'sqlite:///{db_name}'
-            self.is_sqlite = True
-        else:
-            self.is_sqlite = False
+    def __init__(self, db_name=None, referral_counters=REFERRAL_COUNTERS_ENABLED, user_cache=None, state_store=None, migrate=DB_AUTO_MIGRATE):
+        # Keep a materialized per-referrer stats row up to date on every referral change
+        self.referral_counters = referral_counters
         
-        logger.info(f"Connecting to database: {db_url.split('@')[0] if '@' in db_url else db_url}")
+        # Read-through cache for get_user. Any object with get/set/pop/clear/stats will do
+        if user_cache is None and USER_CACHE_ENABLED:
+            user_cache = TTLCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL)
+        self.user_cache = user_cache
         
-        # Create engine with connection pooling if not SQLite
-        if self.is_sqlite:
-            # SQLite doesn't need pooling parameters
-            self.engine = create_engine(
-                db_url,
-                connect_args={"check_same_thread": False}  # Allow multi-threaded access
-            )
-        else:
-            # PostgreSQL and other databases support pooling
-            self.engine = create_engine(
-                db_url,
-                pool_size=10,
-                max_overflow=20,
-                pool_timeout=30,
-                pool_recycle=1800,  # Recycle connections after 30 minutes
-                pool_pre_ping=True  # Verify connections before using them
-            )
+        self.db_path = db_name  # Keep for backward compatibility
+        self.engine = create_db_engine(db_name)
+        self.is_sqlite = self.engine.dialect.name == 'sqlite'
+        
+        _instances.add(self)
         
         # Create session factory
         self.Session = scoped_session(sessionmaker(bind=self.engine))
         
-        # Initialize database if needed
-        self.init_db()
+        # Schema changes normally run once per deploy (see migrate), not in every process
+        if migrate:
+            self.init_db()
+        
+        # Where conversation state lives (users table, shared table or process memory)
+        self.state_store = state_store or create_state_store(
+            self,
+            backend=STATE_STORE,
+            ttl=STATE_TTL,
+            write_behind=STATE_WRITE_BEHIND,
+            flush_interval=STATE_FLUSH_INTERVAL
+        )
+        
+        # In-memory wallet -> user index for payment matching, kept current through wallet_changes
+        self.wallet_index = None
+        if WALLET_INDEX_ENABLED:
+            self.wallet_index = WalletIndex(self)
+            self.wallet_index.build()
     
     @contextmanager
     def session_scope(self):
@@ -57,75 +140,45 @@ class Database:
         try:
             yield session
             session.commit()
+            
+            # Only drop cached users once their changes are visible to other readers
+            for telegram_id in session.info.get('invalidate_users', ()):
+                self.invalidate_user(telegram_id)
+            for callback in session.info.get('after_commit', ()):
+                callback()
         except Exception as e:
             session.rollback()
             logger.error(f"Database error: {e}")
             raise
         finally:
+            session.info.pop('invalidate_users', None)
+            session.info.pop('after_commit', None)
             session.close()
     
+    def _invalidate_users_on_commit(self, session, *telegram_ids):
+        """Mark users whose cached rows must be dropped when the session commits"""
+        session.info.setdefault('invalidate_users', set()).update(
+            telegram_id for telegram_id in telegram_ids if telegram_id is not None
+        )
+    
+    def _after_commit(self, session, callback):
+        """Run a callback once the session's transaction has committed"""
+        session.info.setdefault('after_commit', []).append(callback)
+    
+    def invalidate_user(self, telegram_id):
+        """Drop a user from the profile cache and any cache registered with on_user_invalidated"""
+        if self.user_cache is not None:
+            self.user_cache.pop(telegram_id)
+        for callback in _user_invalidation_listeners:
+            callback(telegram_id)
+    
+    def get_user_cache_stats(self):
+        """Hit/miss counters for the user profile cache"""
+        return self.user_cache.stats() if self.user_cache is not None else None
+    
     def init_db(self):
         """Initialize database tables if they don't exist"""
-        metadata = MetaData()
-        
-        # Define tables
-        users = Table('users', metadata,
-            Column('id', Integer, primary_key=True),
-            Column('telegram_id', Integer, unique=True, nullable=False, index=True),
-            Column('username', String),
-            Column('is_premium', Boolean, default=False),
-            Column('paid_amount', Float, default=0),
-            Column('referral_code', String, unique=True, index=True),
-            Column('state', String),
-            Column('payout_wallet', String),
-            Column('total_commission', Float, default=0),
-            Column('created_at', DateTime),
-            Column('updated_at', DateTime)
-        )
-        
-        wallets = Table('wallets', metadata,
-            Column('id', Integer, primary_key=True),
-            Column('telegram_id', Integer, nullable=False, index=True),
-            Column('solana_address', String, nullable=False, index=True),
-            Column('created_at', DateTime)
-        )
-        
-        payments = Table('payments', metadata,
-            Column('id', Integer, primary_key=True),
-            Column('telegram_id', Integer, nullable=False, index=True),
-            Column('amount', Float, nullable=False),
-            Column('transaction_id', String, nullable=False, unique=True, index=True),
-            Column('payment_date', DateTime, index=True)
-        )
-        
-        referrals = Table('referrals', metadata,
-            Column('id', Integer, primary_key=True),
-            Column('referrer_id', Integer, nullable=False, index=True),
-            Column('referred_id', Integer, nullable=False, index=True, unique=True),
-            Column('converted', Boolean, default=False),
-            Column('commission_amount', Float, default=0),
-            Column('created_at', DateTime)
-        )
-        
-        referral_codes = Table('referral_codes', metadata,
-            Column('id', Integer, primary_key=True),
-            Column('telegram_id', Integer, nullable=False, index=True, unique=True),
-            Column('code', String, nullable=False, unique=True, index=True),
-            Column('created_at', DateTime)
-        )
-        
-        auth_tokens = Table('auth_tokens', metadata,
-            Column('id', Integer, primary_key=True),
-            Column('telegram_id', Integer, nullable=False, index=True),
-            Column('token', String, nullable=False, unique=True, index=True),
-            Column('expires_at', DateTime, nullable=False, index=True),
-            Column('created_at', DateTime),
-            Column('used', Boolean, default=False)
-        )
-        
-        # Create tables if they don't exist
-        metadata.create_all(self.engine)
-        logger.info("Database initialized")
+        create_schema(self.engine)
 
     # --- User Management Methods ---
     
@@ -159,6 +212,14 @@ class Database:
     
     def get_user(self, telegram_id):
         """Get user information"""
+        if self.user_cache is not None:
+            user = self.user_cache.get(telegram_id)
+            if user is not None:
+                # Hand out a copy so callers can't modify the cached row
+                return dict(user)
+            # A write committed while we read invalidates the key, and then the row isn't cached
+            generation = self.user_cache.generation()
+        
         with self.session_scope() as session:
             result = session.execute(
                 text("SELECT * FROM users WHERE telegram_id = :telegram_id"),
@@ -167,7 +228,10 @@ class Database:
             
             if result:
                 # Convert to dict
-                return {col: getattr(result, col) for col in result._mapping.keys()}
+                user = {col: getattr(result, col) for col in result._mapping.keys()}
+                if self.user_cache is not None:
+                    self.user_cache.set(telegram_id, dict(user), since=generation)
+                return user
             return None
     
     def set_user_premium(self, telegram_id, amount):
@@ -188,6 +252,7 @@ class Database:
                     "updated_at": now
                 }
             )
+            self._invalidate_users_on_commit(session, telegram_id)
             
             # Check if this user was referred by someone
             referral = session.execute(
@@ -198,6 +263,8 @@ class Database:
             if referral:
                 referrer_id = referral[0]
                 commission_amount = amount * 0.2  # 20% commission
+                self._invalidate_users_on_commit(session, referrer_id)
+                self._after_commit(session, REFERRALS_CONVERTED.inc)
                 
                 # Mark referral as converted
                 session.execute(
@@ -227,6 +294,9 @@ class Database:
                     }
                 )
                 
+                if self.referral_counters:
+                    self._bump_referral_counters(session, referrer_id, converted=1, commission=commission_amount)
+                
                 logger.info(f"Converted referral: {telegram_id} paid, {referrer_id} earned {commission_amount}")
                 
                 return True, referrer_id, commission_amount
@@ -235,15 +305,15 @@ class Database:
     
     def set_user_state(self, telegram_id, state):
         """Set user state for conversation handling"""
-        with self.session_scope() as session:
-            session.execute(
-                text("UPDATE users SET state = :state WHERE telegram_id = :telegram_id"),
-                {"telegram_id": telegram_id, "state": state}
-            )
-            return True
+        self.state_store.set(telegram_id, state)
+        return True
     
     def get_user_state(self, telegram_id):
         """Get user state for conversation handling"""
+        return self.state_store.get(telegram_id) or None
+    
+    def read_state_column(self, telegram_id):
+        """Read conversation state from the users table"""
         with self.session_scope() as session:
             result = session.execute(
                 text("SELECT state FROM users WHERE telegram_id = :telegram_id"),
@@ -253,6 +323,93 @@ class Database:
             if result and result[0]:
                 return result[0]
             return None
+    
+    def write_state_columns(self, states):
+        """Write conversation states ({telegram_id: state}) to the users table in one transaction"""
+        with self.session_scope() as session:
+            session.execute(
+                text("UPDATE users SET state = :state WHERE telegram_id = :telegram_id"),
+                [{"telegram_id": telegram_id, "state": state} for telegram_id, state in states.items()]
+            )
+            self._invalidate_users_on_commit(session, *states.keys())
+            return True
+    
+    def get_conversation_state(self, telegram_id):
+        """Read conversation state from the conversation_states table"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("SELECT state FROM conversation_states WHERE telegram_id = :telegram_id AND expires_at > :now"),
+                {"telegram_id": telegram_id, "now": datetime.datetime.now()}
+            ).fetchone()
+            
+            return result[0] if result else None
+    
+    def set_conversation_state(self, telegram_id, state, ttl):
+        """Store conversation state in the conversation_states table"""
+        with self.session_scope() as session:
+            if self.is_sqlite:
+                query = """
+                    INSERT OR REPLACE INTO conversation_states (telegram_id, state, expires_at)
+                    VALUES (:telegram_id, :state, :expires_at)
+                """
+            else:
+                query = """
+                    INSERT INTO conversation_states (telegram_id, state, expires_at)
+                    VALUES (:telegram_id, :state, :expires_at)
+                    ON CONFLICT (telegram_id) DO UPDATE SET state = EXCLUDED.state, expires_at = EXCLUDED.expires_at
+                """
+            
+            session.execute(
+                text(query),
+                {
+                    "telegram_id": telegram_id,
+                    "state": state,
+                    "expires_at": datetime.datetime.now() + datetime.timedelta(seconds=ttl)
+                }
+            )
+            return True
+    
+    def delete_conversation_state(self, telegram_id):
+        """Clear conversation state from the conversation_states table"""
+        with self.session_scope() as session:
+            session.execute(
+                text("DELETE FROM conversation_states WHERE telegram_id = :telegram_id"),
+                {"telegram_id": telegram_id}
+            )
+            return True
+    
+    def set_premium_status(self, telegram_id, is_premium):
+        """Grant or revoke premium access without recording a payment"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("UPDATE users SET is_premium = :is_premium, updated_at = :updated_at WHERE telegram_id = :telegram_id"),
+                {
+                    "telegram_id": telegram_id,
+                    "is_premium": bool(is_premium),
+                    "updated_at": datetime.datetime.now()
+                }
+            )
+            self._invalidate_users_on_commit(session, telegram_id)
+            return result.rowcount > 0
+    
+    def set_payout_wallet(self, telegram_id, wallet_address):
+        """Set the wallet referral commissions are paid out to"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("UPDATE users SET payout_wallet = :wallet_address, updated_at = :updated_at WHERE telegram_id = :telegram_id"),
+                {
+                    "telegram_id": telegram_id,
+                    "wallet_address": wallet_address,
+                    "updated_at": datetime.datetime.now()
+                }
+            )
+            self._invalidate_users_on_commit(session, telegram_id)
+            return result.rowcount > 0
+    
+    def get_payout_wallet(self, telegram_id):
+        """Get the wallet referral commissions are paid out to"""
+        user = self.get_user(telegram_id)
+        return user['payout_wallet'] if user else None
 
     # --- Wallet Management Methods ---
     
@@ -284,6 +441,7 @@ class Database:
                     "created_at": now
                 }
             )
+            self._record_wallet_change(session, wallet_address, telegram_id, True)
             
             return True
     
@@ -302,7 +460,7 @@ class Database:
     def remove_wallet(self, telegram_id, wallet_address):
         """Remove a wallet from the user"""
         with self.session_scope() as session:
-            session.execute(
+            result = session.execute(
                 text("""
                     DELETE FROM wallets 
                     WHERE telegram_id = :telegram_id AND solana_address = :wallet_address
@@ -310,7 +468,65 @@ class Database:
                 {"telegram_id": telegram_id, "wallet_address": wallet_address}
             )
             
+            if result.rowcount:
+                self._record_wallet_change(session, wallet_address, telegram_id, False)
+            
             return True
+    
+    def _record_wallet_change(self, session, wallet_address, telegram_id, linked):
+        """Log a link or unlink for the wallet indexes of every process (see WalletIndex.sync)"""
+        # The counter row stays locked until commit, so change numbers commit in order and without gaps
+        version = session.execute(
+            text("UPDATE wallet_change_version SET version = version + 1 WHERE id = 1 RETURNING version")
+        ).scalar()
+        session.execute(
+            text("""
+                INSERT INTO wallet_changes (version, solana_address, telegram_id, linked, changed_at)
+                VALUES (:version, :wallet_address, :telegram_id, :linked, :changed_at)
+            """),
+            {
+                "version": version,
+                "wallet_address": wallet_address,
+                "telegram_id": telegram_id,
+                "linked": linked,
+                "changed_at": datetime.datetime.now()
+            }
+        )
+        # An index that falls further behind than this rebuilds from the wallets table
+        session.execute(
+            text("DELETE FROM wallet_changes WHERE version <= :oldest"),
+            {"oldest": version - WALLET_CHANGES_KEPT}
+        )
+    
+    def get_wallet_change_version(self):
+        """Number of the latest committed wallet change"""
+        with self.session_scope() as session:
+            return session.execute(
+                text("SELECT version FROM wallet_change_version WHERE id = 1")
+            ).scalar() or 0
+    
+    def get_wallet_changes(self, after, upto):
+        """Get (solana_address, telegram_id, linked) for the changes numbered after < n <= upto, in order"""
+        with self.session_scope() as session:
+            results = session.execute(
+                text("""
+                    SELECT solana_address, telegram_id, linked FROM wallet_changes
+                    WHERE version > :after AND version <= :upto
+                    ORDER BY version
+                """),
+                {"after": after, "upto": upto}
+            ).fetchall()
+            
+            return [(row[0], row[1], bool(row[2])) for row in results]
+    
+    def get_wallet_owners(self):
+        """Get (solana_address, telegram_id) for every linked wallet, oldest link first"""
+        with self.session_scope() as session:
+            results = session.execute(
+                text("SELECT solana_address, telegram_id FROM wallets ORDER BY id")
+            ).fetchall()
+            
+            return [(row[0], row[1]) for row in results]
 
     # --- Payment Methods ---
     
@@ -328,84 +544,146 @@ class Database:
                     logger.warning(f"Transaction {transaction_id} has already been processed")
                     return False
                 
-                # Add payment record
-                now = datetime.datetime.now()
-                session.execute(
-                    text("""
-                        INSERT INTO payments (telegram_id, amount, transaction_id, payment_date)
-                        VALUES (:telegram_id, :amount, :transaction_id, :payment_date)
-                    """),
-                    {
-                        "telegram_id": telegram_id,
-                        "amount": amount,
-                        "transaction_id": transaction_id,
-                        "payment_date": now
-                    }
-                )
-                
-                # Update user's paid amount and premium status
-                session.execute(
-                    text("""
-                        UPDATE users 
-                        SET paid_amount = paid_amount + :amount,
-                            is_premium = 1,
-                            updated_at = :updated_at
-                        WHERE telegram_id = :telegram_id
-                    """),
-                    {
-                        "telegram_id": telegram_id,
-                        "amount": amount,
-                        "updated_at": now
-                    }
-                )
-                
-                # Check if this user was referred by someone
-                referral = session.execute(
-                    text("SELECT referrer_id FROM referrals WHERE referred_id = :referred_id AND converted = 0"),
-                    {"referred_id": telegram_id}
-                ).fetchone()
-                
-                if referral:
-                    referrer_id = referral[0]
-                    commission_amount = amount * 0.2  # 20% commission
-                    
-                    # Mark referral as converted
-                    session.execute(
-                        text("""
-                            UPDATE referrals 
-                            SET converted = 1, 
-                                commission_amount = :commission_amount 
-                            WHERE referrer_id = :referrer_id AND referred_id = :referred_id
-                        """),
-                        {
-                            "referrer_id": referrer_id,
-                            "referred_id": telegram_id,
-                            "commission_amount": commission_amount
-                        }
-                    )
-                    
-                    # Update referrer's total commission
-                    session.execute(
-                        text("""
-                            UPDATE users 
-                            SET total_commission = total_commission + :amount 
-                            WHERE telegram_id = :telegram_id
-                        """),
-                        {
-                            "telegram_id": referrer_id,
-                            "amount": commission_amount
-                        }
-                    )
-                    
-                    logger.info(f"Added commission of {commission_amount} SOL to user {referrer_id}")
-                
-                logger.info(f"Payment of {amount} SOL recorded for user {telegram_id}")
+                self._record_payment(session, telegram_id, transaction_id, amount, datetime.datetime.now())
                 return True
                 
             except Exception as e:
                 logger.error(f"Error adding payment: {e}")
                 return False
     
+    def _record_payment(self, session, telegram_id, transaction_id, amount, now):
+        """Insert a payment, credit the user and convert their referral inside the caller's session.
+        
+        Returns (referrer_id, commission_amount), or (None, 0) if there was no open referral.
+        """
+        # Add payment record
+        session.execute(
+            text("""
+                INSERT INTO payments (telegram_id, amount, transaction_id, payment_date)
+                VALUES (:telegram_id, :amount, :transaction_id, :payment_date)
+            """),
+            {
+                "telegram_id": telegram_id,
+                "amount": amount,
+                "transaction_id": transaction_id,
+                "payment_date": now
+            }
+        )
+        
+        # Update user's paid amount and premium status
+        session.execute(
+            text("""
+                UPDATE users 
+                SET paid_amount = paid_amount + :amount,
+                    is_premium = 1,
+                    updated_at = :updated_at
+                WHERE telegram_id = :telegram_id
+            """),
+            {
+                "telegram_id": telegram_id,
+                "amount": amount,
+                "updated_at": now
+            }
+        )
+        self._invalidate_users_on_commit(session, telegram_id)
+        
+        # Check if this user was referred by someone
+        referral = session.execute(
+            text("SELECT referrer_id FROM referrals WHERE referred_id = :referred_id AND converted = 0"),
+            {"referred_id": telegram_id}
+        ).fetchone()
+        
+        referrer_id = None
+        commission_amount = 0
+        if referral:
+            referrer_id = referral[0]
+            commission_amount = amount * 0.2  # 20% commission
+            self._invalidate_users_on_commit(session, referrer_id)
+            
+            # Mark referral as converted
+            session.execute(
+                text("""
+                    UPDATE referrals 
+                    SET converted = 1, 
+                        commission_amount = :commission_amount 
+                    WHERE referrer_id = :referrer_id AND referred_id = :referred_id
+                """),
+                {
+                    "referrer_id": referrer_id,
+                    "referred_id": telegram_id,
+                    "commission_amount": commission_amount
+                }
+            )
+            
+            # Update referrer's total commission
+            session.execute(
+                text("""
+                    UPDATE users 
+                    SET total_commission = total_commission + :amount 
+                    WHERE telegram_id = :telegram_id
+                """),
+                {
+                    "telegram_id": referrer_id,
+                    "amount": commission_amount
+                }
+            )
+            
+            if self.referral_counters:
+                self._bump_referral_counters(session, referrer_id, converted=1, commission=commission_amount)
+            
+            logger.info(f"Added commission of {commission_amount} SOL to user {referrer_id}")
+        
+        self._after_commit(session, lambda: _count_payment(amount, referrer_id is not None))
+        logger.info(f"Payment of {amount} SOL recorded for user {telegram_id}")
+        return referrer_id, commission_amount
+    
+    def get_processed_transaction_ids(self, transaction_ids):
+        """Get which of the given transaction ids already have a payment recorded"""
+        transaction_ids = list(set(transaction_ids))
+        if not transaction_ids:
+            return set()
+        
+        with self.session_scope() as session:
+            results = session.execute(
+                text("SELECT transaction_id FROM payments WHERE transaction_id IN :transaction_ids")
+                .bindparams(bindparam('transaction_ids', expanding=True)),
+                {"transaction_ids": transaction_ids}
+            ).fetchall()
+            return {row[0] for row in results}
+    
+    def add_payments(self, payments):
+        """Record several payments in a single transaction.
+        
+        payments is a list of dicts with telegram_id, transaction_id and amount. Callers
+        should drop already processed transaction ids first (get_processed_transaction_ids);
+        a duplicate that slips through rolls back the whole batch. Returns one dict per
+        payment with the user's new paid_amount and any referral commission it produced.
+        """
+        if not payments:
+            return []
+        
+        with self.session_scope() as session:
+            now = datetime.datetime.now()
+            results = []
+            for payment in payments:
+                referrer_id, commission_amount = self._record_payment(
+                    session, payment['telegram_id'], payment['transaction_id'], payment['amount'], now
+                )
+                results.append(dict(payment, referrer_id=referrer_id, commission_amount=commission_amount))
+            
+            # Read the new totals in the same transaction so notifications match what was committed
+            paid = session.execute(
+                text("SELECT telegram_id, paid_amount FROM users WHERE telegram_id IN :telegram_ids")
+                .bindparams(bindparam('telegram_ids', expanding=True)),
+                {"telegram_ids": list({payment['telegram_id'] for payment in payments})}
+            ).fetchall()
+            paid = dict(paid)
+            for result in results:
+                result['paid_amount'] = paid.get(result['telegram_id'], 0)
+            
+            logger.info(f"Recorded {len(results)} payments in one transaction")
+            return results
+    
     def get_user_payments(self, telegram_id):
         """Get all payments for a user"""
         with self.session_scope() as session:
@@ -495,35 +773,111 @@ class Database:
                 }
             )
             
+            if self.referral_counters:
+                self._bump_referral_counters(session, referrer_id, total=1)
+            
             return True
     
     def get_referral_stats(self, telegram_id):
         """Get referral statistics for a user"""
         with self.session_scope() as session:
-            # Get total referrals
-            total_result = session.execute(
-                text("SELECT COUNT(*) FROM referrals WHERE referrer_id = :telegram_id"),
-                {"telegram_id": telegram_id}
-            ).fetchone()
-            
-            # Get converted referrals
-            converted_result = session.execute(
-                text("SELECT COUNT(*) FROM referrals WHERE referrer_id = :telegram_id AND converted = 1"),
-                {"telegram_id": telegram_id}
-            ).fetchone()
+            if self.referral_counters:
+                # Point lookup on the materialized counter row
+                result = session.execute(
+                    text("""
+                        SELECT total_referrals, converted_referrals, total_commission
+                        FROM referral_counters WHERE referrer_id = :telegram_id
+                    """),
+                    {"telegram_id": telegram_id}
+                ).fetchone()
+                
+                if result:
+                    return {
+                        "total_referrals": result[0],
+                        "converted_referrals": result[1],
+                        "total_commission": result[2] or 0
+                    }
             
-            # Get total commission
-            commission_result = session.execute(
-                text("SELECT SUM(commission_amount) FROM referrals WHERE referrer_id = :telegram_id AND converted = 1"),
+            # Single pass over the referrer's rows using the (referrer_id, converted) index
+            result = session.execute(
+                text("""
+                    SELECT COUNT(*),
+                           SUM(CASE WHEN converted THEN 1 ELSE 0 END),
+                           SUM(CASE WHEN converted THEN commission_amount ELSE 0 END)
+                    FROM referrals WHERE referrer_id = :telegram_id
+                """),
                 {"telegram_id": telegram_id}
             ).fetchone()
             
             return {
-                "total_referrals": total_result[0] if total_result else 0,
-                "converted_referrals": converted_result[0] if converted_result else 0,
-                "total_commission": commission_result[0] if commission_result and commission_result[0] else 0
+                "total_referrals": result[0] if result else 0,
+                "converted_referrals": result[1] if result and result[1] else 0,
+                "total_commission": result[2] if result and result[2] else 0
             }
     
+    def _bump_referral_counters(self, session, referrer_id, total=0, converted=0, commission=0):
+        """Apply a change to a referrer's counter row inside the caller's transaction"""
+        params = {
+            "referrer_id": referrer_id,
+            "total": total,
+            "converted": converted,
+            "commission": commission,
+            "updated_at": datetime.datetime.now()
+        }
+        increment = text("""
+            UPDATE referral_counters
+            SET total_referrals = total_referrals + :total,
+                converted_referrals = converted_referrals + :converted,
+                total_commission = total_commission + :commission,
+                updated_at = :updated_at
+            WHERE referrer_id = :referrer_id
+        """)
+        
+        if session.execute(increment, params).rowcount:
+            return
+        
+        # No row yet: seed it from the referrals table, which already includes this change
+        or_ignore = "OR IGNORE" if self.is_sqlite else ""
+        on_conflict = "" if self.is_sqlite else "ON CONFLICT (referrer_id) DO NOTHING"
+        seeded = session.execute(
+            text(f"""
+                INSERT {or_ignore} INTO referral_counters
+                    (referrer_id, total_referrals, converted_referrals, total_commission, updated_at)
+                SELECT :referrer_id, COUNT(*),
+                       COALESCE(SUM(CASE WHEN converted THEN 1 ELSE 0 END), 0),
+                       COALESCE(SUM(CASE WHEN converted THEN commission_amount ELSE 0 END), 0),
+                       :updated_at
+                FROM referrals WHERE referrer_id = :referrer_id
+                {on_conflict}
+            """),
+            params
+        ).rowcount
+        
+        if not seeded:
+            # Another transaction created the row first
+            session.execute(increment, params)
+    
+    def rebuild_referral_counters(self):
+        """Recompute every materialized referral counter row from the referrals table"""
+        with self.session_scope() as session:
+            session.execute(text("DELETE FROM referral_counters"))
+            result = session.execute(
+                text("""
+                    INSERT INTO referral_counters
+                        (referrer_id, total_referrals, converted_referrals, total_commission, updated_at)
+                    SELECT referrer_id, COUNT(*),
+                           SUM(CASE WHEN converted THEN 1 ELSE 0 END),
+                           SUM(CASE WHEN converted THEN commission_amount ELSE 0 END),
+                           :updated_at
+                    FROM referrals
+                    GROUP BY referrer_id
+                """),
+                {"updated_at": datetime.datetime.now()}
+            )
+            
+            logger.info(f"Rebuilt referral counters for {result.rowcount} referrers")
+            return result.rowcount
+    
     def get_user_referrals(self, telegram_id):
         """Get all referrals for a user"""
         with self.session_scope() as session:
@@ -590,7 +944,7 @@ class Database:
             session.execute(
                 text("""
                     INSERT INTO auth_tokens (telegram_id, token, expires_at, created_at, used)
-                    VALUES (:telegram_id, :token, :expires_at, :created_at, 0)
+                    VALUES (:telegram_id, :token, :expires_at, :created_at, FALSE)
                 """),
                 {
                     "telegram_id": telegram_id,
@@ -606,71 +960,316 @@ class Database:
             }
     
     def verify_auth_token(self, token):
-        """Verify an authentication token and return user info if valid"""
+        """Consume an authentication token and return the user it was issued to, if valid"""
+        generation = self.user_cache.generation() if self.user_cache is not None else None
         with self.session_scope() as session:
-            # Get token from database
-            now = datetime.datetime.now()
-            result = session.execute(
-                text("""
-                    SELECT * FROM auth_tokens 
-                    WHERE token = :token AND used = 0 AND expires_at > :now
-                """),
-                {"token": token, "now": now}
-            ).fetchone()
+            params = {"token": token, "now": datetime.datetime.now()}
+            
+            # Marking the token used is the check itself, so two clicks on one link can't both pass
+            if self.is_sqlite:
+                # SQLite's RETURNING can't see joined tables. The UPDATE holds the write
+                # lock until commit, so the user is read in the same transaction
+                consumed = session.execute(
+                    text("""
+                        UPDATE auth_tokens SET used = TRUE
+                        WHERE token = :token AND used = FALSE AND expires_at > :now
+                        RETURNING telegram_id
+                    """),
+                    params
+                ).fetchone()
+                if not consumed:
+                    return None
+                
+                result = session.execute(
+                    text("SELECT * FROM users WHERE telegram_id = :telegram_id"),
+                    {"telegram_id": consumed.telegram_id}
+                ).fetchone()
+            else:
+                result = session.execute(
+                    text("""
+                        UPDATE auth_tokens SET used = TRUE
+                        FROM users
+                        WHERE auth_tokens.token = :token AND auth_tokens.used = FALSE
+                          AND auth_tokens.expires_at > :now
+                          AND users.telegram_id = auth_tokens.telegram_id
+                        RETURNING users.*
+                    """),
+                    params
+                ).fetchone()
             
             if not result:
                 return None
             
-            # Convert to dict
-            token_data = {col: getattr(result, col) for col in result._mapping.keys()}
+            user = {col: getattr(result, col) for col in result._mapping.keys()}
+            if self.user_cache is not None:
+                self.user_cache.set(user['telegram_id'], dict(user), since=generation)
+            return user
+    
+    def clean_expired_tokens(self, limit=1000):
+        """Remove up to limit expired or used tokens. Returns the number removed"""
+        with self.session_scope() as session:
+            # Bounded so a large backlog never holds the table lock for long
+            result = session.execute(
+                text("""
+                    DELETE FROM auth_tokens WHERE id IN (
+                        SELECT id FROM auth_tokens
+                        WHERE expires_at < :now OR used = TRUE
+                        LIMIT :limit
+                    )
+                """),
+                {"now": datetime.datetime.now(), "limit": limit}
+            )
+            return result.rowcount
+
+    # --- Update Deduplication Methods ---
+    
+    def mark_update_processed(self, update_id):
+        """Record a Telegram update_id. Returns False if it was already recorded"""
+        with self.session_scope() as session:
+            if self.is_sqlite:
+                query = "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (:update_id, :received_at)"
+            else:
+                query = "INSERT INTO processed_updates (update_id, received_at) VALUES (:update_id, :received_at) ON CONFLICT (update_id) DO NOTHING"
             
-            # Mark token as used
+            result = session.execute(
+                text(query),
+                {"update_id": update_id, "received_at": datetime.datetime.now()}
+            )
+            
+            return result.rowcount == 1
+    
+    def forget_processed_update(self, update_id):
+        """Remove a recorded update_id, so the update is accepted again"""
+        with self.session_scope() as session:
             session.execute(
-                text("UPDATE auth_tokens SET used = 1 WHERE id = :id"),
-                {"id": token_data['id']}
+                text("DELETE FROM processed_updates WHERE update_id = :update_id"),
+                {"update_id": update_id}
+            )
+    
+    def purge_processed_updates(self, older_than):
+        """Delete update_id records received before the given time"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("DELETE FROM processed_updates WHERE received_at < :older_than"),
+                {"older_than": older_than}
             )
             
-            # Get user data
-            user = self.get_user(token_data['telegram_id'])
+            return result.rowcount
+
+    # --- Signed Login Token Methods ---
+    
+    def spend_login_nonce(self, nonce, expires_at):
+        """Record a signed login token's nonce. Returns False if it was already spent"""
+        with self.session_scope() as session:
+            if self.is_sqlite:
+                query = "INSERT OR IGNORE INTO spent_login_nonces (nonce, expires_at) VALUES (:nonce, :expires_at)"
+            else:
+                query = "INSERT INTO spent_login_nonces (nonce, expires_at) VALUES (:nonce, :expires_at) ON CONFLICT (nonce) DO NOTHING"
+            
+            result = session.execute(text(query), {"nonce": nonce, "expires_at": expires_at})
             
-            return user
+            return result.rowcount == 1
+    
+    def purge_spent_login_nonces(self, now, limit=1000):
+        """Delete up to limit nonces whose tokens have expired"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("""
+                    DELETE FROM spent_login_nonces WHERE nonce IN (
+                        SELECT nonce FROM spent_login_nonces WHERE expires_at < :now LIMIT :limit
+                    )
+                """),
+                {"now": now, "limit": limit}
+            )
+            
+            return result.rowcount
+
+    # --- Notification Dead Letters ---
     
-    def clean_expired_tokens(self):
-        """Remove expired tokens from the database"""
+    def add_notification_dead_letters(self, letters):
+        """Persist notifications that could not be delivered"""
+        if not letters:
+            return
         with self.session_scope() as session:
             now = datetime.datetime.now()
+            session.execute(
+                text("""
+                    INSERT INTO notification_dead_letters (chat_id, text, reply_markup, attempts, last_error, retryable, failed_at)
+                    VALUES (:chat_id, :text, :reply_markup, :attempts, :last_error, :retryable, :failed_at)
+                """),
+                [
+                    dict(
+                        letter,
+                        reply_markup=json.dumps(letter['reply_markup']) if letter.get('reply_markup') else None,
+                        failed_at=now
+                    )
+                    for letter in letters
+                ]
+            )
+    
+    def pop_notification_dead_letters(self, limit=1000):
+        """Remove and return retryable dead letters, oldest first"""
+        with self.session_scope() as session:
+            results = session.execute(
+                text("""
+                    SELECT id, chat_id, text, reply_markup, attempts, last_error
+                    FROM notification_dead_letters
+                    WHERE retryable = :retryable
+                    ORDER BY id
+                    LIMIT :limit
+                """),
+                {"retryable": True, "limit": limit}
+            ).fetchall()
+            if not results:
+                return []
             
-            # Check if 'used' column exists in the auth_tokens table
-            try:
-                # Try to query with the used column
-                session.execute(text("SELECT used FROM auth_tokens LIMIT 1"))
-                has_used_column = True
-            except Exception:
-                has_used_column = False
-            
-            # Use appropriate query based on schema
-            if has_used_column:
-                result = session.execute(
-                    text("DELETE FROM auth_tokens WHERE expires_at < :now OR used = 1"),
-                    {"now": now}
-                )
-            else:
-                # If the column doesn't exist, just filter by expiration
+            session.execute(
+                text("DELETE FROM notification_dead_letters WHERE id IN :ids")
+                .bindparams(bindparam('ids', expanding=True)),
+                {"ids": [row[0] for row in results]}
+            )
+            return [
+                {
+                    "chat_id": row[1],
+                    "text": row[2],
+                    "reply_markup": json.loads(row[3]) if row[3] else None,
+                    "attempts": row[4],
+                    "last_error": row[5]
+                }
+                for row in results
+            ]
+    
+    # --- Broadcast Methods ---
+    
+    def create_broadcast(self, text_body, created_by):
+        """Create a broadcast record and return its ID"""
+        with self.session_scope() as session:
+            now = datetime.datetime.now()
+            result = session.execute(
+                text("""
+                    INSERT INTO broadcasts (text, created_by, status, last_user_id, sent, failed, blocked, created_at, updated_at)
+                    VALUES (:text, :created_by, 'running', 0, 0, 0, 0, :now, :now)
+                    RETURNING id
+                """),
+                {"text": text_body, "created_by": created_by, "now": now}
+            ).fetchone()
+            return result[0]
+    
+    def get_broadcast(self, broadcast_id):
+        """Get a broadcast record"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("SELECT * FROM broadcasts WHERE id = :id"),
+                {"id": broadcast_id}
+            ).fetchone()
+            return dict(result._mapping) if result else None
+    
+    def get_latest_broadcast(self):
+        """Get the most recently created broadcast record"""
+        with self.session_scope() as session:
+            result = session.execute(text("SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1")).fetchone()
+            return dict(result._mapping) if result else None
+    
+    def save_broadcast_progress(self, broadcast_id, last_user_id, sent, failed, blocked, status='running'):
+        """Checkpoint a broadcast. Also serves as the heartbeat of the process running it.
+        
+        A cancel written by another process is never overwritten. Returns the status the
+        broadcast is left in, so the sender can stop when it reads 'cancelled'.
+        """
+        with self.session_scope() as session:
+            now = datetime.datetime.now()
+            row = session.execute(
+                text("""
+                    UPDATE broadcasts
+                    SET last_user_id = :last_user_id, sent = :sent, failed = :failed, blocked = :blocked,
+                        status = CASE WHEN status = 'cancelled' THEN status ELSE :status END,
+                        updated_at = :now,
+                        finished_at = CASE WHEN :status IN ('completed', 'cancelled') THEN :now ELSE finished_at END
+                    WHERE id = :id
+                    RETURNING status
+                """),
+                {
+                    "id": broadcast_id,
+                    "last_user_id": last_user_id,
+                    "sent": sent,
+                    "failed": failed,
+                    "blocked": blocked,
+                    "status": status,
+                    "now": now
+                }
+            ).fetchone()
+            return row[0] if row else None
+    
+    def set_broadcast_status(self, broadcast_id, status):
+        """Change a broadcast's status without touching its counters. A cancelled broadcast stays cancelled"""
+        with self.session_scope() as session:
+            result = session.execute(
+                text("""
+                    UPDATE broadcasts SET status = :status, updated_at = :now
+                    WHERE id = :id AND (status <> 'cancelled' OR :status = 'cancelled')
+                """),
+                {"id": broadcast_id, "status": status, "now": datetime.datetime.now()}
+            )
+            return result.rowcount == 1
+    
+    def claim_resumable_broadcasts(self, stale_before):
+        """Take over broadcasts that were interrupted or whose process stopped checkpointing.
+        
+        Each claim is a compare-and-set on updated_at, so when several processes start at
+        once only one of them resumes a given broadcast.
+        """
+        with self.session_scope() as session:
+            candidates = session.execute(
+                text("""
+                    SELECT id, updated_at FROM broadcasts
+                    WHERE status = 'interrupted' OR (status = 'running' AND updated_at < :stale_before)
+                    ORDER BY id
+                """),
+                {"stale_before": stale_before}
+            ).fetchall()
+        
+        claimed = []
+        for broadcast_id, updated_at in candidates:
+            with self.session_scope() as session:
                 result = session.execute(
-                    text("DELETE FROM auth_tokens WHERE expires_at < :now"),
-                    {"now": now}
+                    text("""
+                        UPDATE broadcasts SET status = 'running', updated_at = :now
+                        WHERE id = :id AND updated_at = :updated_at AND status IN ('running', 'interrupted')
+                    """),
+                    {"id": broadcast_id, "updated_at": updated_at, "now": datetime.datetime.now()}
                 )
-            
-            # Add the missing column if it doesn't exist
-            if not has_used_column:
-                try:
-                    session.execute(text("ALTER TABLE auth_tokens ADD COLUMN used BOOLEAN DEFAULT 0"))
-                    logger.info("Added 'used' column to auth_tokens table")
-                except Exception as e:
-                    logger.error(f"Error adding 'used' column: {e}")
-            
+                if result.rowcount == 1:
+                    claimed.append(broadcast_id)
+        return claimed
+    
+    def get_broadcast_recipients(self, after_user_id, limit):
+        """Get the next page of (users.id, telegram_id) for a broadcast, skipping blocked users"""
+        with self.session_scope() as session:
+            results = session.execute(
+                text("""
+                    SELECT id, telegram_id FROM users
+                    WHERE id > :after_user_id AND (is_blocked IS NULL OR is_blocked = :blocked)
+                    ORDER BY id
+                    LIMIT :limit
+                """),
+                {"after_user_id": after_user_id, "blocked": False, "limit": limit}
+            ).fetchall()
+            return [(row[0], row[1]) for row in results]
+    
+    def set_users_blocked(self, telegram_ids, blocked=True):
+        """Flag users who blocked (or unblocked) the bot"""
+        telegram_ids = list(set(telegram_ids))
+        if not telegram_ids:
+            return 0
+        with self.session_scope() as session:
+            result = session.execute(
+                text("UPDATE users SET is_blocked = :blocked WHERE telegram_id IN :telegram_ids")
+                .bindparams(bindparam('telegram_ids', expanding=True)),
+                {"blocked": blocked, "telegram_ids": telegram_ids}
+            )
+            self._invalidate_users_on_commit(session, *telegram_ids)
             return result.rowcount
-
+    
     # --- Admin Methods ---
     
     def get_all_users(self):
@@ -697,8 +1296,7 @@ class Database:
     
     def add_missing_columns(self):
         """Add any missing columns to the database tables"""
-        # This method is not needed with SQLAlchemy schema - metadata.create_all() handles this
-        logger.info("Using SQLAlchemy schema management - no need to manually add columns")
+        add_missing_columns(self.engine)
         return True
     
     def debug_schema(self):
@@ -716,21 +1314,247 @@ class Database:
 
     def get_user_by_wallet(self, wallet_address):
         """Get user ID by wallet address"""
-        with self.session_scope() as session:
-            result = session.execute(
-                text("SELECT telegram_id FROM wallets WHERE solana_address = :address"),
-                {"address": wallet_address}
-            ).fetchone()
-            
-            if result:
-                logger.info(f"Found user by wallet address: {wallet_address}")
-                return result[0]
-            
+        telegram_id = self.get_users_by_wallets([wallet_address]).get(wallet_address)
+        if telegram_id is None:
             logger.warning(f"No user found with wallet address: {wallet_address}")
-            return None
+        return telegram_id
+    
+    def get_users_by_wallets(self, wallet_addresses):
+        """Get user IDs for several wallet addresses at once. Unknown addresses are left out"""
+        wallet_addresses = set(wallet_addresses)
+        if not wallet_addresses:
+            return {}
+        
+        if self.wallet_index:
+            try:
+                # Catches up with links and unlinks made through any process
+                self.wallet_index.sync()
+            except Exception as e:
+                logger.error(f"Error syncing wallet index, reading the wallets table: {e}")
+            else:
+                return self.wallet_index.lookup_many(wallet_addresses)
+        
+        with self.session_scope() as session:
+            results = session.execute(
+                text("SELECT solana_address, telegram_id FROM wallets WHERE solana_address IN :addresses ORDER BY id")
+                .bindparams(bindparam('addresses', expanding=True)),
+                {"addresses": list(wallet_addresses)}
+            ).fetchall()
+        
+        # The earliest link wins when several users registered the same address
+        users = {}
+        for address, telegram_id in results:
+            users.setdefault(address, telegram_id)
+        return users
+
+def create_schema(engine):
+    """Create missing tables, indexes and columns"""
+    metadata = MetaData()
+    
+    # Define tables
+    users = Table('users', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('telegram_id', Integer, unique=True, nullable=False, index=True),
+        Column('username', String),
+        Column('is_premium', Boolean, default=False),
+        Column('paid_amount', Float, default=0),
+        Column('referral_code', String, unique=True, index=True),
+        Column('state', String),
+        Column('payout_wallet', String),
+        Column('total_commission', Float, default=0),
+        Column('is_blocked', Boolean, default=False),  # user blocked the bot, skipped by broadcasts
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime)
+    )
+    
+    wallets = Table('wallets', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('telegram_id', Integer, nullable=False, index=True),
+        Column('solana_address', String, nullable=False, index=True),
+        Column('created_at', DateTime)
+    )
+    
+    payments = Table('payments', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('telegram_id', Integer, nullable=False, index=True),
+        Column('amount', Float, nullable=False),
+        Column('transaction_id', String, nullable=False, unique=True, index=True),
+        Column('payment_date', DateTime, index=True)
+    )
+    
+    referrals = Table('referrals', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('referrer_id', Integer, nullable=False, index=True),
+        Column('referred_id', Integer, nullable=False, index=True, unique=True),
+        Column('converted', Boolean, default=False),
+        Column('commission_amount', Float, default=0),
+        Column('created_at', DateTime)
+    )
+    
+    # Covers the per-referrer stats aggregate without touching the table rows
+    referrals_stats_index = Index('ix_referrals_referrer_converted', referrals.c.referrer_id, referrals.c.converted)
+    
+    referral_counters = Table('referral_counters', metadata,
+        Column('referrer_id', Integer, primary_key=True, autoincrement=False),
+        Column('total_referrals', Integer, nullable=False, default=0),
+        Column('converted_referrals', Integer, nullable=False, default=0),
+        Column('total_commission', Float, nullable=False, default=0),
+        Column('updated_at', DateTime)
+    )
+    
+    referral_codes = Table('referral_codes', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('telegram_id', Integer, nullable=False, index=True, unique=True),
+        Column('code', String, nullable=False, unique=True, index=True),
+        Column('created_at', DateTime)
+    )
+    
+    auth_tokens = Table('auth_tokens', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('telegram_id', Integer, nullable=False, index=True),
+        Column('token', String, nullable=False, unique=True, index=True),
+        Column('expires_at', DateTime, nullable=False, index=True),
+        Column('created_at', DateTime),
+        Column('used', Boolean, default=False)
+    )
+    
+    conversation_states = Table('conversation_states', metadata,
+        Column('telegram_id', Integer, primary_key=True, autoincrement=False),
+        Column('state', String, nullable=False),
+        Column('expires_at', DateTime, nullable=False, index=True)
+    )
+    
+    processed_updates = Table('processed_updates', metadata,
+        Column('update_id', BigInteger, primary_key=True, autoincrement=False),
+        Column('received_at', DateTime, nullable=False, index=True)
+    )
+    
+    spent_login_nonces = Table('spent_login_nonces', metadata,
+        Column('nonce', String, primary_key=True),
+        Column('expires_at', DateTime, nullable=False, index=True)
+    )
+    
+    notification_dead_letters = Table('notification_dead_letters', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('chat_id', BigInteger, nullable=False),
+        Column('text', String, nullable=False),
+        Column('reply_markup', String),  # JSON
+        Column('attempts', Integer, default=0),
+        Column('last_error', String),
+        Column('retryable', Boolean, default=True, index=True),
+        Column('failed_at', DateTime, nullable=False)
+    )
+    
+    # Numbered log of wallet links and unlinks, read by every process's WalletIndex
+    wallet_changes = Table('wallet_changes', metadata,
+        Column('version', BigInteger, primary_key=True, autoincrement=False),
+        Column('solana_address', String, nullable=False),
+        Column('telegram_id', Integer, nullable=False),
+        Column('linked', Boolean, nullable=False),
+        Column('changed_at', DateTime, nullable=False)
+    )
+    
+    # Single row holding the number of the latest wallet change
+    wallet_change_version = Table('wallet_change_version', metadata,
+        Column('id', Integer, primary_key=True, autoincrement=False),
+        Column('version', BigInteger, nullable=False, default=0)
+    )
+    
+    broadcasts = Table('broadcasts', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('text', String, nullable=False),
+        Column('created_by', BigInteger),
+        Column('status', String, nullable=False, index=True),  # running, interrupted, cancelled, completed
+        Column('last_user_id', Integer, default=0),  # users.id checkpoint, everyone up to it was handled
+        Column('sent', Integer, default=0),
+        Column('failed', Integer, default=0),
+        Column('blocked', Integer, default=0),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('finished_at', DateTime)
+    )
+    
+    # Create tables if they don't exist
+    metadata.create_all(engine)
+    
+    # create_all only adds indexes with new tables, so add it to existing databases too
+    referrals_stats_index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM wallet_change_version WHERE id = 1")).first() is None:
+            conn.execute(text("INSERT INTO wallet_change_version (id, version) VALUES (1, 0)"))
+    add_missing_columns(engine)
+    logger.info("Database schema is up to date")
+
+def add_missing_columns(engine):
+    """Add columns introduced after a table was first created"""
+    # metadata.create_all() only creates missing tables, so columns added later need an ALTER
+    columns = {column['name'] for column in inspect(engine).get_columns('users')}
+    if 'is_blocked' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE users ADD COLUMN is_blocked BOOLEAN DEFAULT FALSE"))
+        logger.info("Added users.is_blocked column")
+
+    columns = {column['name'] for column in inspect(engine).get_columns('auth_tokens')}
+    if 'used' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE auth_tokens ADD COLUMN used BOOLEAN DEFAULT FALSE"))
+        logger.info("Added auth_tokens.used column")
+
+def migrate(db_name=DATABASE_PATH):
+    """Bring the schema up to date. Run once per deploy rather than in every process"""
+    engine = create_db_engine(db_name)
+    try:
+        create_schema(engine)
+    finally:
+        engine.dispose()
+
+def _count_payment(amount, converted_referral):
+    PAYMENTS_PROCESSED.inc()
+    PAYMENTS_SOL.inc(amount=amount)
+    if converted_referral:
+        REFERRALS_CONVERTED.inc()
+
+if TRACE_ENABLED:
+    trace_methods(Database, 'db.')
+if METRICS_ENABLED:
+    instrument_methods(Database, DB_METHOD_SECONDS, DB_METHOD_ERRORS)
+
+# --- Process-wide instance ---
+
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """Return the process-wide Database, creating it on first use"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = Database(DATABASE_PATH)
+    return _db
+
+def set_db(instance):
+    """Replace the process-wide Database, e.g. with a wrapper around it"""
+    global _db
+    with _db_lock:
+        _db = instance
+
+class LazyDatabase:
+    """Module-level stand-in for the process-wide Database.
+    
+    Importing modules can keep a `db` global without building an engine at import
+    time; the Database is created by whichever attribute is used first.
+    """
+    
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+db = LazyDatabase()
 
-# Initialize database if run directly
+# Migrate the schema if run directly
 if __name__ == "__main__":
-    from config import DATABASE_PATH
-    db = Database(DATABASE_PATH)
-    print(f"Database initialized at {DATABASE_PATH}") 
\ No newline at end of file
+    migrate()
+    instance = get_db()
+    if instance.referral_counters:
+        instance.rebuild_referral_counters()
+    print(f"Database migrated at {DATABASE_PATH}")
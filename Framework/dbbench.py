@@ -0,0 +1,436 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+# Microbenchmarks for the Database methods: seeds users, wallets, referral codes,
+# referrals, payments and auth tokens at a configurable scale, then times each method
+# with random arguments drawn from the seeded data. Runs against a fresh SQLite file
+# and, when one is reachable, a local PostgreSQL database; both land in one JSON file.
+#
+#   python dbbench.py                                  # 100k users, SQLite (+ Postgres if present)
+#   python dbbench.py --users 10000 -m get_user -m get_referral_stats
+#   python dbbench.py --postgres-url postgresql://localhost/telegram_bot_bench --reset --json bench.json
+#
+# The Postgres database is emptied and reseeded, so point it at one kept for benchmarks.
+
+DEFAULT_POSTGRES_URL = 'postgresql://localhost/telegram_bot_bench'
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+FIRST_TELEGRAM_ID = 1_000_000  # Integer columns are 32-bit on Postgres
+CHUNK_SIZE = 5000
+
+# Everything seeded, children first so a reset can delete in this order
+SEEDED_TABLES = ('auth_tokens', 'payments', 'referrals', 'referral_counters', 'referral_codes', 'wallets', 'users')
+
+def random_wallet():
+    return ''.join(random.choices(BASE58, k=44))
+
+class SeedData:
+    """What was seeded, for picking benchmark arguments"""
+
+    def __init__(self, users, wallets, referrers, codes, tokens):
+        self.users = users  # telegram ids
+        self.wallets = wallets  # (telegram_id, address)
+        self.referrers = referrers  # telegram ids with a referral code, most referred first
+        self.codes = codes
+        self.tokens = tokens  # unused auth tokens, consumed by verify_auth_token
+        self._next_id = users[-1] + 1
+
+    def user(self):
+        return random.choice(self.users)
+
+    def wallet(self):
+        return random.choice(self.wallets)[1]
+
+    def referrer(self):
+        # Skewed the same way referrals were handed out, so busy referrers are picked more often
+        return self.referrers[int(len(self.referrers) * random.random() ** 3)]
+
+    def new_user_id(self):
+        self._next_id += 1
+        return self._next_id
+
+def seed(engine, users, wallets_per_user, referrers, referred_share, payments_per_user, premium_share, tokens):
+    """Bulk insert synthetic rows, CHUNK_SIZE per statement batch. Returns (SeedData, row counts)"""
+    from sqlalchemy import text
+    now = datetime.datetime.now()
+    telegram_ids = list(range(FIRST_TELEGRAM_ID, FIRST_TELEGRAM_ID + users))
+    referrer_ids = telegram_ids[:min(referrers, users)]
+    counts = {}
+
+    def insert(table, sql, rows):
+        counts[table] = counts.get(table, 0) + len(rows)
+        with engine.begin() as conn:
+            for start in range(0, len(rows), CHUNK_SIZE):
+                conn.execute(text(sql), rows[start:start + CHUNK_SIZE])
+
+    paid = {}
+    payments = []
+    for telegram_id in telegram_ids:
+        for _ in range(_count(payments_per_user)):
+            amount = round(random.uniform(0.01, 0.5), 9)
+            paid[telegram_id] = paid.get(telegram_id, 0) + amount
+            payments.append({'telegram_id': telegram_id, 'amount': amount, 'transaction_id': uuid.uuid4().hex, 'payment_date': now})
+
+    insert('users', """
+        INSERT INTO users (telegram_id, username, is_premium, paid_amount, total_commission, is_blocked, created_at, updated_at)
+        VALUES (:telegram_id, :username, :is_premium, :paid_amount, 0, :is_blocked, :created_at, :created_at)
+    """, [{
+        'telegram_id': telegram_id,
+        'username': f'user{telegram_id}',
+        'is_premium': random.random() < premium_share,
+        'paid_amount': paid.get(telegram_id, 0),
+        'is_blocked': False,
+        'created_at': now
+    } for telegram_id in telegram_ids])
+
+    wallets = [(telegram_id, random_wallet()) for telegram_id in telegram_ids for _ in range(_count(wallets_per_user))]
+    insert('wallets', "INSERT INTO wallets (telegram_id, solana_address, created_at) VALUES (:telegram_id, :address, :created_at)",
+           [{'telegram_id': telegram_id, 'address': address, 'created_at': now} for telegram_id, address in wallets])
+
+    codes = {telegram_id: f'code{telegram_id}' for telegram_id in referrer_ids}
+    insert('referral_codes', "INSERT INTO referral_codes (telegram_id, code, created_at) VALUES (:telegram_id, :code, :created_at)",
+           [{'telegram_id': telegram_id, 'code': code, 'created_at': now} for telegram_id, code in codes.items()])
+
+    # A few referrers bring in most referrals, as with real referral programs
+    referrals = []
+    if referrer_ids:
+        for telegram_id in telegram_ids[len(referrer_ids):]:
+            if random.random() < referred_share:
+                converted = telegram_id in paid
+                referrals.append({
+                    'referrer_id': referrer_ids[int(len(referrer_ids) * random.random() ** 3)],
+                    'referred_id': telegram_id,
+                    'converted': converted,
+                    'commission_amount': round(paid[telegram_id] * 0.1, 9) if converted else 0,
+                    'created_at': now
+                })
+    insert('referrals', """
+        INSERT INTO referrals (referrer_id, referred_id, converted, commission_amount, created_at)
+        VALUES (:referrer_id, :referred_id, :converted, :commission_amount, :created_at)
+    """, referrals)
+
+    insert('payments', """
+        INSERT INTO payments (telegram_id, amount, transaction_id, payment_date)
+        VALUES (:telegram_id, :amount, :transaction_id, :payment_date)
+    """, payments)
+
+    token_values = [uuid.uuid4().hex for _ in range(tokens)]
+    insert('auth_tokens', """
+        INSERT INTO auth_tokens (telegram_id, token, expires_at, created_at, used)
+        VALUES (:telegram_id, :token, :expires_at, :created_at, :used)
+    """, [{
+        'telegram_id': random.choice(telegram_ids),
+        'token': token,
+        'expires_at': now + datetime.timedelta(days=1),
+        'created_at': now,
+        'used': False
+    } for token in token_values])
+
+    data = SeedData(telegram_ids, wallets or [(telegram_ids[0], random_wallet())], referrer_ids or telegram_ids[:1], list(codes.values()) or ['none'], token_values)
+    return data, counts
+
+def _count(mean):
+    """A whole number of rows averaging mean"""
+    whole = int(mean)
+    return whole + (1 if random.random() < mean - whole else 0)
+
+# --- Benchmark cases ---
+
+# name -> (function(db, data), iteration factor); factor < 1 for methods that scan whole tables
+CASES = {}
+
+def case(name, factor=1.0):
+    def register(fn):
+        CASES[name] = (fn, factor)
+        return fn
+    return register
+
+@case('get_user')
+def _get_user(db, data):
+    db.get_user(data.user())
+
+@case('get_user_wallets')
+def _get_user_wallets(db, data):
+    db.get_user_wallets(data.user())
+
+@case('get_user_by_wallet')
+def _get_user_by_wallet(db, data):
+    db.get_user_by_wallet(data.wallet())
+
+@case('get_users_by_wallets')
+def _get_users_by_wallets(db, data):
+    db.get_users_by_wallets([data.wallet() for _ in range(20)])
+
+@case('get_user_payments')
+def _get_user_payments(db, data):
+    db.get_user_payments(data.user())
+
+@case('get_processed_transaction_ids')
+def _get_processed_transaction_ids(db, data):
+    db.get_processed_transaction_ids([uuid.uuid4().hex for _ in range(20)])
+
+@case('get_referral_code')
+def _get_referral_code(db, data):
+    db.get_referral_code(data.referrer())
+
+@case('get_user_by_referral_code')
+def _get_user_by_referral_code(db, data):
+    db.get_user_by_referral_code(random.choice(data.codes))
+
+@case('get_referral_stats')
+def _get_referral_stats(db, data):
+    db.get_referral_stats(data.referrer())
+
+@case('get_user_referrals')
+def _get_user_referrals(db, data):
+    db.get_user_referrals(data.referrer())
+
+@case('get_payout_wallet')
+def _get_payout_wallet(db, data):
+    db.get_payout_wallet(data.user())
+
+@case('get_user_state')
+def _get_user_state(db, data):
+    db.get_user_state(data.user())
+
+@case('get_broadcast_recipients')
+def _get_broadcast_recipients(db, data):
+    db.get_broadcast_recipients(random.randrange(len(data.users)), 500)
+
+@case('get_premium_stats', factor=0.05)
+def _get_premium_stats(db, data):
+    db.get_premium_stats()
+
+@case('get_wallet_owners', factor=0.01)
+def _get_wallet_owners(db, data):
+    db.get_wallet_owners()
+
+@case('get_all_users', factor=0.01)
+def _get_all_users(db, data):
+    db.get_all_users()
+
+@case('add_user_if_not_exists')
+def _add_user_if_not_exists(db, data):
+    db.add_user_if_not_exists(data.new_user_id(), 'bench')
+
+@case('set_user_state')
+def _set_user_state(db, data):
+    db.set_user_state(data.user(), random.choice(('ADD_WALLET', None)))
+
+@case('add_wallet')
+def _add_wallet(db, data):
+    db.add_wallet(data.user(), random_wallet())
+
+@case('set_payout_wallet')
+def _set_payout_wallet(db, data):
+    db.set_payout_wallet(data.user(), random_wallet())
+
+@case('add_payment')
+def _add_payment(db, data):
+    db.add_payment(data.user(), uuid.uuid4().hex, 0.01)
+
+@case('add_payments')
+def _add_payments(db, data):
+    db.add_payments([{'telegram_id': data.user(), 'transaction_id': uuid.uuid4().hex, 'amount': 0.01} for _ in range(20)])
+
+@case('record_referral')
+def _record_referral(db, data):
+    referred_id = data.new_user_id()
+    db.add_user_if_not_exists(referred_id, 'bench')
+    db.record_referral(data.referrer(), referred_id)
+
+@case('set_user_premium')
+def _set_user_premium(db, data):
+    db.set_user_premium(data.user(), 0.01)
+
+@case('generate_auth_token')
+def _generate_auth_token(db, data):
+    db.generate_auth_token(data.user(), 600)
+
+@case('verify_auth_token')
+def _verify_auth_token(db, data):
+    db.verify_auth_token(data.tokens.pop() if data.tokens else uuid.uuid4().hex)
+
+@case('mark_update_processed')
+def _mark_update_processed(db, data):
+    db.mark_update_processed(random.getrandbits(40))
+
+@case('spend_login_nonce')
+def _spend_login_nonce(db, data):
+    db.spend_login_nonce(uuid.uuid4().hex, datetime.datetime.now() + datetime.timedelta(minutes=10))
+
+def time_case(db, data, fn, iterations, warmup, queries):
+    """Run one case; latencies in milliseconds"""
+    from loadtest import percentile
+    for _ in range(warmup):
+        fn(db, data)
+
+    latencies = []
+    queries.take()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(db, data)
+        latencies.append(time.perf_counter() - start)
+    statements = queries.take()
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 3)
+    return {
+        'iterations': iterations,
+        'ops_per_second': round(iterations / sum(latencies), 1),
+        'mean_ms': ms(sum(latencies) / iterations),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]),
+        'queries_per_call': round(statements / iterations, 2)
+    }
+
+def run_backend(name, url, database_path, args, names):
+    """Seed one database and time every selected case on it"""
+    # create_db_engine picks the database from DATABASE_URL
+    if url:
+        os.environ['DATABASE_URL'] = url
+    else:
+        os.environ.pop('DATABASE_URL', None)
+
+    from sqlalchemy import text
+    from database import Database, create_db_engine, migrate
+    from loadtest import QueryCounter
+
+    engine = create_db_engine(database_path)
+    migrate(database_path)
+    with engine.begin() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM users")).scalar()
+        if existing:
+            if not args.reset:
+                engine.dispose()
+                print(f"[{name}] users table already has {existing} rows; rerun with --reset to empty it")
+                return None
+            for table in SEEDED_TABLES:
+                conn.execute(text(f"DELETE FROM {table}"))
+
+    random.seed(args.seed)
+    started = time.perf_counter()
+    data, rows = seed(engine, args.users, args.wallets_per_user, args.referrers, args.referred_share,
+                      args.payments_per_user, args.premium_share, args.tokens)
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    seed_seconds = time.perf_counter() - started
+    engine.dispose()
+    print(f"[{name}] seeded {sum(rows.values())} rows in {seed_seconds:.1f}s")
+
+    db = Database(database_path, migrate=False)
+    if db.referral_counters:
+        db.rebuild_referral_counters()
+    queries = QueryCounter(db.engine)
+
+    methods = {}
+    for case_name in names:
+        fn, factor = CASES[case_name]
+        iterations = max(1, int(args.iterations * factor))
+        warmup = min(args.warmup, iterations)
+        methods[case_name] = time_case(db, data, fn, iterations, warmup, queries)
+        summary = methods[case_name]
+        print(f"[{name}] {case_name:<30} p50 {summary['p50_ms']:>9.3f} ms  p95 {summary['p95_ms']:>9.3f} ms  {summary['queries_per_call']:>5} q/call")
+    db.engine.dispose()
+
+    return {
+        'url': url.split('@')[-1] if url else database_path,
+        'server_version': '.'.join(str(part) for part in db.engine.dialect.server_version_info or ()),
+        'seed_seconds': round(seed_seconds, 2),
+        'rows': rows,
+        'methods': methods
+    }
+
+def postgres_reachable(url):
+    from sqlalchemy import create_engine, text
+    try:
+        engine = create_engine(url)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        engine.dispose()
+        return True
+    except Exception as e:
+        print(f"Skipping PostgreSQL at {url.split('@')[-1]}: {e.__class__.__name__}: {str(e).splitlines()[0] if str(e) else ''}")
+        return False
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the Database methods on seeded SQLite and PostgreSQL databases')
+    parser.add_argument('-m', '--method', action='append', choices=sorted(CASES), help='method to time, repeatable (default: all)')
+    parser.add_argument('--users', type=int, default=100000, help='users to seed')
+    parser.add_argument('--wallets-per-user', type=float, default=1.2, help='average linked wallets per user')
+    parser.add_argument('--referrers', type=int, default=1000, help='users with a referral code')
+    parser.add_argument('--referred-share', type=float, default=0.3, help='share of the other users who came through a referral')
+    parser.add_argument('--payments-per-user', type=float, default=0.5, help='average payments per user')
+    parser.add_argument('--premium-share', type=float, default=0.2, help='share of users who are premium')
+    parser.add_argument('--tokens', type=int, default=10000, help='unused auth tokens to seed')
+    parser.add_argument('-n', '--iterations', type=int, default=1000, help='timed calls per method (table scans run fewer)')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed calls per method first')
+    parser.add_argument('--backend', action='append', choices=('sqlite', 'postgres'), help='backend to run, repeatable (default: both, Postgres if reachable)')
+    parser.add_argument('--sqlite-path', help='SQLite file to use (default: a fresh temporary file)')
+    parser.add_argument('--postgres-url', default=os.environ.get('BENCH_POSTGRES_URL', DEFAULT_POSTGRES_URL), help='PostgreSQL database to seed (default: BENCH_POSTGRES_URL or %(default)s)')
+    parser.add_argument('--reset', action='store_true', help='empty the seeded tables of a database that already has users')
+    parser.add_argument('--with-caches', action='store_true', help='keep the user cache and wallet index on, as configured, instead of timing the queries')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--seed', type=int, default=1, help='random seed; the same seed and scale give the same data')
+    args = parser.parse_args(argv)
+
+    # Configure before anything imports config
+    if not args.with_caches:
+        os.environ['USER_CACHE_ENABLED'] = 'false'
+        os.environ['WALLET_INDEX_ENABLED'] = 'false'
+    os.environ.setdefault('METRICS_ENABLED', 'false')
+    os.environ.setdefault('TRACE_ENABLED', 'false')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from log_setup import configure_logging
+    configure_logging()
+
+    names = args.method or list(CASES)
+    backends = args.backend or ['sqlite', 'postgres']
+    results = {}
+    if 'sqlite' in backends:
+        sqlite_path = args.sqlite_path or os.path.join(tempfile.mkdtemp(prefix='dbbench-'), 'bench.db')
+        results['sqlite'] = run_backend('sqlite', None, sqlite_path, args, names)
+    if 'postgres' in backends and postgres_reachable(args.postgres_url):
+        results['postgres'] = run_backend('postgres', args.postgres_url, None, args, names)
+
+    import sqlalchemy
+    import sqlite3
+    report = {
+        'settings': {
+            'users': args.users,
+            'wallets_per_user': args.wallets_per_user,
+            'referrers': args.referrers,
+            'referred_share': args.referred_share,
+            'payments_per_user': args.payments_per_user,
+            'premium_share': args.premium_share,
+            'tokens': args.tokens,
+            'iterations': args.iterations,
+            'with_caches': args.with_caches,
+            'seed': args.seed
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'run_at': datetime.datetime.now().isoformat()
+        },
+        'backends': {name: result for name, result in results.items() if result}
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['backends'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# Gunicorn settings for combined_server, loaded with:
+#   gunicorn -c gunicorn.conf.py combined_server:app
+# Send SIGHUP to the master to reload gracefully: new workers are started with the
+# new code and the old ones finish their requests within GUNICORN_GRACEFUL_TIMEOUT.
+from config import PORT, GUNICORN_WORKERS, GUNICORN_THREADS, GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE, GUNICORN_MAX_REQUESTS, GUNICORN_MAX_REQUESTS_JITTER, SET_WEBHOOK_ON_START, DB_MIGRATE_ON_START, BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH
+
+bind = f"0.0.0.0:{PORT}"
+workers = GUNICORN_WORKERS
+threads = GUNICORN_THREADS
+worker_class = 'gthread' if GUNICORN_THREADS > 1 else 'sync'
+timeout = GUNICORN_TIMEOUT
+graceful_timeout = GUNICORN_GRACEFUL_TIMEOUT
+keepalive = GUNICORN_KEEPALIVE
+max_requests = GUNICORN_MAX_REQUESTS
+max_requests_jitter = GUNICORN_MAX_REQUESTS_JITTER
+
+# Every worker imports the app itself, so each builds its own Database engine and pool
+# and starts its own background threads after the fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    """Bring the schema up to date once, before any worker is started"""
+    if DB_MIGRATE_ON_START:
+        from database import migrate
+        migrate()
+        server.log.info("Database schema is up to date")
+
+def when_ready(server):
+    """Point Telegram at this server once, from the master"""
+    if not SET_WEBHOOK_ON_START or not WEBHOOK_HOST:
+        return
+
+    # A throwaway client, so no pooled connection is inherited by the workers
+    from telegram_api import TelegramClient
+    client = TelegramClient(BOT_TOKEN)
+    try:
+        webhook_url = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+        response = client.set_webhook(webhook_url)
+        server.log.info(f"Webhook set to {webhook_url}: {response}")
+    finally:
+        client.close()
+
+def post_fork(server, worker):
+    """Drop any connection pool the worker inherited from the master"""
+    from database import reset_after_fork
+    reset_after_fork()
+    server.log.info(f"Worker {worker.pid} started with fresh database pools")
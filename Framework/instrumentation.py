@@ -0,0 +1,24 @@
+import inspect
+
+# Attribute names set on the wrappers made by wrap_public_methods
+_markers = set()
+
+def wrap_public_methods(cls, wrap, marker):
+    """Replace every public method defined on cls with wrap(method, name).
+
+    The wrapper is tagged with marker, and methods already carrying it are skipped, so
+    wrapping a class twice is harmless. Methods wrapped under another marker (metrics
+    over tracing, or the other way round) are wrapped again whatever the order;
+    generators, session_scope and other decorated helpers are left alone.
+    """
+    _markers.add(marker)
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(method) or inspect.isgeneratorfunction(method):
+            continue
+        if getattr(method, marker, False):
+            continue
+        if getattr(method, '__wrapped__', None) and not any(getattr(method, other, False) for other in _markers):
+            continue
+        wrapper = wrap(method, name)
+        setattr(wrapper, marker, True)
+        setattr(cls, name, wrapper)
@@ -0,0 +1,85 @@
+import hashlib
+import itertools
+import threading
+import time
+import jwt
+from cache import TTLCache
+from config import JWT_SECRET, JWT_CACHE_ENABLED, JWT_CACHE_TTL, JWT_CACHE_MAX_SIZE
+from database import db, on_user_invalidated
+
+def decode_jwt(token, secret):
+    """Verify a website JWT's signature and expiry; it must name a user"""
+    return jwt.decode(token, secret, algorithms=['HS256'], options={'require': ['telegram_id']})
+
+class VerifiedTokenCache:
+    """Remembers website JWTs that have been verified, together with their user.
+
+    Entries are keyed by a SHA-256 digest of the token and expire at the token's exp
+    or after ttl, whichever is first, so an expired token always goes back through
+    jwt.decode. When a user's row changes in this process every entry loaded before
+    the change stops being served; ttl bounds how long changes made by other
+    processes can go unnoticed.
+    """
+
+    def __init__(self, secret, max_size=10000, ttl=60):
+        self.secret = secret
+        self.ttl = ttl
+        self.tokens = TTLCache(max_size=max_size, ttl=ttl)
+        # telegram_id -> sequence number of its last change. Kept for ttl, after which
+        # every entry loaded before that change has expired anyway
+        self.changed = TTLCache(max_size=max_size, ttl=ttl)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next_seq(self):
+        with self._lock:
+            return next(self._seq)
+
+    def verify(self, token):
+        """Return (claims, user) for a valid token. Raises jwt.InvalidTokenError like jwt.decode"""
+        digest = hashlib.sha256(token.encode()).digest()
+        entry = self.tokens.get(digest)
+        if entry is not None:
+            loaded_at, claims, user = entry
+            if self.changed.get(claims['telegram_id'], -1) < loaded_at:
+                return dict(claims), dict(user) if user else None
+            self.tokens.pop(digest)
+
+        # Taken before the user is read, so a change committed meanwhile invalidates it
+        loaded_at = self._next_seq()
+        claims = decode_jwt(token, self.secret)
+        user = db.get_user(claims['telegram_id'])
+
+        ttl = self.ttl
+        if 'exp' in claims:
+            ttl = min(ttl, claims['exp'] - time.time())
+        if ttl > 0:
+            self.tokens.set(digest, (loaded_at, dict(claims), dict(user) if user else None), ttl=ttl)
+        return claims, user
+
+    def invalidate_user(self, telegram_id):
+        """Stop serving entries loaded before this call for the user"""
+        self.changed.set(telegram_id, self._next_seq())
+
+    def stats(self):
+        """Hit/miss counters"""
+        return self.tokens.stats()
+
+verified_tokens = None
+if JWT_CACHE_ENABLED:
+    verified_tokens = VerifiedTokenCache(JWT_SECRET, max_size=JWT_CACHE_MAX_SIZE, ttl=JWT_CACHE_TTL)
+    on_user_invalidated(verified_tokens.invalidate_user)
+
+def verify_jwt_token(token):
+    """Decode a website JWT and load its user. Returns (claims, user), user may be None.
+
+    Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError like jwt.decode.
+    """
+    if verified_tokens:
+        return verified_tokens.verify(token)
+    claims = decode_jwt(token, JWT_SECRET)
+    return claims, db.get_user(claims['telegram_id'])
+
+def jwt_cache_stats():
+    """Counters for /webhook_stats"""
+    return verified_tokens.stats() if verified_tokens else None
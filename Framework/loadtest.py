@@ -0,0 +1,458 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import string
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Load generator for combined_server: replays synthetic Telegram updates and Helius
+# webhooks, with a local stand-in for api.telegram.org, and reports throughput,
+# latency percentiles and SQL statements per request for each scenario.
+#
+#   python loadtest.py                         # every scenario, in process, fresh SQLite DB
+#   python loadtest.py -s pay_now -n 2000 -c 16
+#   python loadtest.py --json results.json --baseline last.json
+#
+# With --url the traffic goes to a running server instead; start it with
+# TELEGRAM_API_URL pointing at the stub (--stub-port) and the same DEPOSIT_ADDRESS.
+
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+LAMPORTS_PER_SOL = 1_000_000_000
+
+# The routes combined_server serves the webhooks on
+TELEGRAM_WEBHOOK = '/telegram_webhook'
+PAYMENT_WEBHOOK = '/payment_webhook'
+
+def random_wallet():
+    return ''.join(random.choices(BASE58, k=44))
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(p / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class TelegramStub:
+    """Local stand-in for api.telegram.org that answers every Bot API method with ok.
+
+    Calls are counted per method; latency adds a fixed delay to each answer to mimic
+    the round trip to Telegram.
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        self.latency = latency
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; without this Nagle adds ~40ms per call
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                stub._count(self.path.rsplit('/', 1)[-1])
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = json.dumps({'ok': True, 'result': {'message_id': next(stub._message_ids)}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='telegram-stub', daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _count(self, method):
+        with self._lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+
+    def total(self):
+        with self._lock:
+            return sum(self.counts.values())
+
+class QueryCounter:
+    """Counts the SQL statements each thread sends through an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        """Statements counted in this thread since the last call"""
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+class InProcessTarget:
+    """Sends requests straight into the Flask app, one test client per thread"""
+
+    def __init__(self, app, queries):
+        self.app = app
+        self.queries = queries
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        self.queries.take()
+        response = client.post(path, json=payload)
+        return response.status_code, self.queries.take()
+
+class HttpTarget:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        import requests
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.post(self.base_url + path, json=payload, timeout=30)
+        return response.status_code, None
+
+class Traffic:
+    """Builds synthetic Telegram updates and Helius webhook payloads.
+
+    Users are numbered from a high base so they never collide with real ids, while
+    staying within the 32-bit Integer columns of the Postgres schema. Referrers
+    and payers are set up through the bot itself, as real users would, so the same
+    seeding works in process and against a running server.
+    """
+
+    def __init__(self, deposit_address, batch_size=20):
+        self.deposit_address = deposit_address
+        self.batch_size = batch_size
+        run = random.randrange(1000, 9999)
+        self._update_ids = itertools.count(run * 10_000_000)
+        self._user_ids = itertools.count(2_000_000_000 + (run % 1000) * 100_000)
+        self._lock = threading.Lock()
+        self.referrers = []  # (user_id, code)
+        self.referral_codes = []
+        self.payers = []  # (user_id, wallet)
+
+    def new_user(self):
+        with self._lock:
+            return next(self._user_ids)
+
+    def _update_id(self):
+        with self._lock:
+            return next(self._update_ids)
+
+    def message(self, user_id, text):
+        return TELEGRAM_WEBHOOK, {
+            'update_id': self._update_id(),
+            'message': {
+                'message_id': random.randrange(1, 1_000_000),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'username': f'load{user_id}'},
+                'text': text
+            }
+        }
+
+    def callback(self, user_id, data):
+        return TELEGRAM_WEBHOOK, {
+            'update_id': self._update_id(),
+            'callback_query': {
+                'id': str(self._update_id()),
+                'data': data,
+                'from': {'id': user_id, 'is_bot': False, 'username': f'load{user_id}'},
+                'message': {'message_id': random.randrange(1, 1_000_000), 'chat': {'id': user_id, 'type': 'private'}}
+            }
+        }
+
+    def helius_batch(self):
+        """A webhook batch: payments from linked wallets, some unknown senders and unrelated transfers"""
+        transactions = []
+        for _ in range(self.batch_size):
+            roll = random.random()
+            if roll < 0.6 and self.payers:
+                _, sender = random.choice(self.payers)
+                receiver = self.deposit_address
+            elif roll < 0.8:
+                sender, receiver = random_wallet(), self.deposit_address
+            else:
+                sender, receiver = random_wallet(), random_wallet()
+            transactions.append({
+                'signature': ''.join(random.choices(BASE58, k=88)),
+                'type': 'TRANSFER',
+                'timestamp': int(time.time()),
+                'nativeTransfers': [{
+                    'fromUserAccount': sender,
+                    'toUserAccount': receiver,
+                    'amount': random.randrange(LAMPORTS_PER_SOL // 100, LAMPORTS_PER_SOL // 10)
+                }]
+            })
+        return PAYMENT_WEBHOOK, transactions
+
+    # --- Setup flows ---
+
+    def referrer_flow(self):
+        user_id = self.new_user()
+        code = 'lt' + ''.join(random.choices(string.ascii_lowercase + string.digits, k=10))
+        return user_id, code, [
+            self.message(user_id, '/start'),
+            self.callback(user_id, 'create_referral'),
+            self.message(user_id, code)
+        ]
+
+    def wallet_flow(self, user_id=None):
+        user_id = user_id or self.new_user()
+        wallet = random_wallet()
+        return user_id, wallet, [
+            self.message(user_id, '/start'),
+            self.callback(user_id, 'wallet_menu'),
+            self.callback(user_id, 'add_wallet'),
+            self.message(user_id, wallet)
+        ]
+
+# Each scenario builds the steps of one iteration; steps run in order, like one user tapping through
+def _start_referral(traffic):
+    code = random.choice(traffic.referral_codes) if traffic.referral_codes else 'unknown'
+    return [traffic.message(traffic.new_user(), f'/start ref_{code}')]
+
+def _wallet_flow(traffic):
+    return traffic.wallet_flow()[2]
+
+def _pay_now(traffic):
+    return [traffic.callback(random.choice(traffic.payers)[0], 'pay_now')]
+
+def _referral_menu(traffic):
+    user_id, _ = random.choice(traffic.referrers)
+    return [traffic.callback(user_id, 'referral_menu')]
+
+def _helius_batch(traffic):
+    return [traffic.helius_batch()]
+
+SCENARIOS = {
+    'start_referral': _start_referral,
+    'wallet_flow': _wallet_flow,
+    'pay_now': _pay_now,
+    'referral_menu': _referral_menu,
+    'helius_batch': _helius_batch
+}
+
+class ScenarioResult:
+    """Latencies and counters of one scenario run"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.queries = 0
+        self.counted_queries = False
+        self.telegram_calls = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok, queries):
+        with self._lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+            if queries is not None:
+                self.counted_queries = True
+                self.queries += queries
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        requests = len(latencies)
+        ms = lambda value: round(value * 1000, 2) if value is not None else None
+        return {
+            'requests': requests,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 3),
+            'throughput': round(requests / self.elapsed, 1) if self.elapsed else None,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'max_ms': ms(latencies[-1] if latencies else None),
+            'db_queries_per_request': round(self.queries / requests, 2) if requests and self.counted_queries else None,
+            'telegram_calls_per_request': round(self.telegram_calls / requests, 2) if requests else None
+        }
+
+def run_steps(target, steps, result=None):
+    for path, payload in steps:
+        start = time.perf_counter()
+        try:
+            status, queries = target.post(path, payload)
+            ok = status < 400
+        except Exception:
+            queries, ok = None, False
+        if result:
+            result.record(time.perf_counter() - start, ok, queries)
+
+def seed(target, traffic, referrers, payers, concurrency):
+    """Create referrers with referral codes and payers with linked wallets through the bot"""
+    referrer_flows = [traffic.referrer_flow() for _ in range(referrers)]
+    payer_flows = [traffic.wallet_flow() for _ in range(payers)]
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda flow: run_steps(target, flow[2]), referrer_flows + payer_flows))
+    traffic.referrers = [(user_id, code) for user_id, code, _ in referrer_flows]
+    traffic.referral_codes = [code for _, code in traffic.referrers]
+    traffic.payers = [(user_id, wallet) for user_id, wallet, _ in payer_flows]
+
+def run_scenario(name, target, traffic, stub, iterations, concurrency, warmup):
+    build = SCENARIOS[name]
+    for _ in range(warmup):
+        run_steps(target, build(traffic))
+
+    result = ScenarioResult(name)
+    flows = [build(traffic) for _ in range(iterations)]
+    calls_before = stub.total()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda steps: run_steps(target, steps, result), flows))
+    result.elapsed = time.perf_counter() - start
+    result.telegram_calls = stub.total() - calls_before
+    return result.summary()
+
+def compare(results, baseline, tolerance):
+    """Regressions against a previous --json run: p95 latency or queries per request up by more than tolerance"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for key in ('p95_ms', 'db_queries_per_request'):
+            before, after = previous.get(key), current.get(key)
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(f"{name}: {key} {before} -> {after}")
+    return regressions
+
+def print_table(results):
+    columns = ('requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'db_queries_per_request', 'telegram_calls_per_request')
+    headers = ('scenario', 'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'db q/req', 'tg/req')
+    rows = [headers] + [(name,) + tuple('-' if summary[key] is None else str(summary[key]) for key in columns) for name, summary in results.items()]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay synthetic Telegram and Helius traffic against combined_server')
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS), help='scenario to run, repeatable (default: all)')
+    parser.add_argument('-n', '--iterations', type=int, default=500, help='iterations per scenario')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='concurrent simulated users')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed iterations before each scenario')
+    parser.add_argument('--batch-size', type=int, default=20, help='transactions per Helius webhook')
+    parser.add_argument('--referrers', type=int, default=50, help='referrers created before the run')
+    parser.add_argument('--payers', type=int, default=200, help='users with linked wallets created before the run')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='seconds the Telegram stub waits before answering')
+    parser.add_argument('--stub-port', type=int, default=0, help='port for the Telegram stub (default: any free port)')
+    parser.add_argument('--url', help='base URL of a running server; default is to run the Flask app in process')
+    parser.add_argument('--database', help='SQLite file for the in-process app (default: a fresh temporary file)')
+    parser.add_argument('--deposit-address', help='deposit address the server watches (default: DEPOSIT_ADDRESS, or a random one in process)')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run; exit 1 if p95 or queries per request regress')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed regression against the baseline, as a fraction')
+    parser.add_argument('--seed', type=int, help='random seed, for repeatable traffic')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    stub = TelegramStub(args.stub_port, args.stub_latency)
+    stub.start()
+
+    if args.url:
+        print(f"Telegram stub listening on {stub.url}; the server must use TELEGRAM_API_URL={stub.url}")
+        deposit_address = args.deposit_address or os.environ.get('DEPOSIT_ADDRESS')
+        if not deposit_address:
+            parser.error('--deposit-address (or DEPOSIT_ADDRESS) is required with --url')
+        target = HttpTarget(args.url)
+    else:
+        # Configure the app before anything imports config
+        database_path = args.database or os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'loadtest.db')
+        deposit_address = args.deposit_address or os.environ.get('DEPOSIT_ADDRESS') or random_wallet()
+        os.environ.update({
+            'DATABASE_PATH': database_path,
+            'TELEGRAM_API_URL': stub.url,
+            'DEPOSIT_ADDRESS': deposit_address,
+            # Handle updates inline so latency and queries belong to the request
+            'WEBHOOK_ASYNC_MODE': 'false',
+            'NOTIFY_QUEUE_ENABLED': 'false'
+        })
+        os.environ.setdefault('BOT_TOKEN', '0:loadtest')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        # Unknown senders and the payment audit trail would log on every webhook
+        os.environ.setdefault('LOG_LEVELS', 'combined_server=ERROR,payments.audit=WARNING')
+
+        import database
+        database.migrate(database_path)
+        import combined_server
+        target = InProcessTarget(combined_server.app, QueryCounter(database.get_db().engine))
+        print(f"Running in process against {database_path}")
+
+    traffic = Traffic(deposit_address, batch_size=args.batch_size)
+    started = time.perf_counter()
+    seed(target, traffic, args.referrers, max(1, args.payers), args.concurrency)
+    if not traffic.referrers:
+        traffic.referrers = [(traffic.payers[0][0], 'unknown')]
+    print(f"Seeded {args.referrers} referrers and {len(traffic.payers)} payers in {time.perf_counter() - started:.1f}s")
+
+    results = {}
+    for name in args.scenario or list(SCENARIOS):
+        results[name] = run_scenario(name, target, traffic, stub, args.iterations, args.concurrency, args.warmup)
+    stub.stop()
+
+    print_table(results)
+    report = {
+        'scenarios': results,
+        'settings': {
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'batch_size': args.batch_size,
+            'stub_latency': args.stub_latency,
+            'target': args.url or 'in-process'
+        },
+        'telegram_calls': dict(stub.counts)
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
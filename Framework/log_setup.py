@@ -0,0 +1,120 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_PAYLOAD_SAMPLE_RATE
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through extra= and is a field
+_RECORD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+# Payment audit trail: one line per recorded payment, kept at INFO whatever the module levels
+audit_logger = logging.getLogger('payments.audit')
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without formatting them.
+
+    The message is formatted by the listener, so the %-style arguments must not be
+    mutated after the call. When the queue is full the record is dropped and counted,
+    except for the payment audit trail, which waits for room instead.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if record.name == audit_logger.name:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+class LazyJson:
+    """Serializes a payload only if the record is actually written"""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return json.dumps(self.payload, separators=(',', ':'), default=str)
+
+_handler = None
+_listener = None
+_lock = threading.Lock()
+
+def parse_levels(spec):
+    """Parse "module=LEVEL,other=LEVEL" into a dict"""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging():
+    """Route all logging through a background writer thread. Safe to call more than once"""
+    global _handler, _listener
+    with _lock:
+        if _handler:
+            return
+
+        stream = logging.StreamHandler()
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = _NonBlockingQueueHandler(log_queue)
+        _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL.upper())
+
+        audit_logger.setLevel(logging.INFO)
+        for name, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+def log_payload(logger, message, payload, sample_rate=LOG_PAYLOAD_SAMPLE_RATE):
+    """Log a sampled fraction of payloads at DEBUG, serialized only when written"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < sample_rate:
+        logger.debug("%s: %s", message, LazyJson(payload))
+
+def logging_stats():
+    """Counters for /webhook_stats"""
+    if not _handler:
+        return None
+    with _handler._lock:
+        dropped = _handler.dropped
+    return {'queued': _handler.queue.qsize(), 'dropped': dropped}
@@ -0,0 +1,134 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+import logging
+from cache import TTLCache
+from config import AUTH_TOKEN_MODE, AUTH_TOKEN_EXPIRY, AUTH_LINK_SECRET, AUTH_NONCE_BACKEND, AUTH_NONCE_MAX_SIZE, GUNICORN_WORKERS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+class SignedLoginTokens:
+    """Stateless one-time login tokens.
+
+    A token is "<telegram_id>.<expires>.<nonce>.<signature>" where the signature is a
+    truncated HMAC-SHA256 of the rest, so issuing and checking one needs no database.
+    Single use is enforced by remembering spent nonces until the token would have
+    expired anyway: in a bounded in-process TTL cache, and when a database is given
+    also in the shared spent_login_nonces table so every process sees the same set
+    (expired rows there are deleted by the TokenSweeper).
+    """
+
+    def __init__(self, secret, ttl, db=None, max_size=100000):
+        self.key = hashlib.sha256(b'login-token:' + secret.encode()).digest()
+        self.ttl = ttl
+        self.db = db
+        self.spent = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {'issued': 0, 'redeemed': 0, 'bad_signature': 0, 'expired': 0, 'replayed': 0}
+
+    def _sign(self, message):
+        digest = hmac.new(self.key, message.encode(), hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+            return self._stats[name]
+
+    def issue(self, telegram_id):
+        """Create a token for a user. Returns the same shape as Database.generate_auth_token"""
+        expires = int(time.time()) + self.ttl
+        message = f"{int(telegram_id)}.{expires}.{secrets.token_urlsafe(9)}"
+        self._count('issued')
+        return {
+            "token": f"{message}.{self._sign(message)}",
+            "expires_at": datetime.datetime.fromtimestamp(expires).isoformat()
+        }
+
+    def redeem(self, token):
+        """Check and spend a token. Returns the telegram_id, or None if it can't be used"""
+        try:
+            message, signature = token.rsplit('.', 1)
+            telegram_id, expires, nonce = message.split('.')
+            telegram_id, expires = int(telegram_id), int(expires)
+        except ValueError:
+            self._count('bad_signature')
+            return None
+
+        if not hmac.compare_digest(signature, self._sign(message)):
+            self._count('bad_signature')
+            return None
+
+        remaining = expires - time.time()
+        if remaining <= 0:
+            self._count('expired')
+            return None
+
+        if not self._spend(nonce, expires, remaining):
+            self._count('replayed')
+            logger.warning(f"Rejected reused login token for user {telegram_id}")
+            return None
+
+        self._count('redeemed')
+        return telegram_id
+
+    def _spend(self, nonce, expires, remaining):
+        """Mark a nonce as used. Returns False if it already was"""
+        if not self.spent.add(nonce, ttl=remaining):
+            return False
+        if not self.db:
+            return True
+
+        try:
+            spent = self.db.spend_login_nonce(nonce, datetime.datetime.fromtimestamp(expires))
+        except Exception as e:
+            # The signature and expiry still hold, and this process won't accept it twice
+            logger.error(f"Error recording login nonce in shared backend: {e}")
+            return True
+        return spent
+
+    def stats(self):
+        """Token counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['nonce_backend'] = 'database' if self.db else 'memory'
+        stats['cached_nonces'] = len(self.spent)
+        return stats
+
+signed_tokens = None
+if AUTH_TOKEN_MODE == 'signed':
+    if AUTH_NONCE_BACKEND == 'memory' and GUNICORN_WORKERS > 1:
+        # Each worker would keep its own spent set and accept the same link once
+        raise RuntimeError("AUTH_NONCE_BACKEND=memory needs GUNICORN_WORKERS=1; use AUTH_NONCE_BACKEND=database")
+    signed_tokens = SignedLoginTokens(
+        AUTH_LINK_SECRET,
+        AUTH_TOKEN_EXPIRY * 60,
+        db=db if AUTH_NONCE_BACKEND == 'database' else None,
+        max_size=AUTH_NONCE_MAX_SIZE
+    )
+
+def issue_login_token(telegram_id):
+    """Create a one-time website login token for a user"""
+    if signed_tokens:
+        return signed_tokens.issue(telegram_id)
+    return db.generate_auth_token(telegram_id, AUTH_TOKEN_EXPIRY * 60)
+
+def redeem_login_token(token):
+    """Spend a login token and return the user it was issued to, or None"""
+    # Tokens from the auth_tokens table have no dots, so links sent before switching
+    # to signed mode keep working until they expire
+    if signed_tokens and '.' in token:
+        telegram_id = signed_tokens.redeem(token)
+        return db.get_user(telegram_id) if telegram_id is not None else None
+    return db.verify_auth_token(token)
+
+def login_token_stats():
+    """Counters for /webhook_stats"""
+    if signed_tokens:
+        return dict(signed_tokens.stats(), mode='signed')
+    return {'mode': 'database'}
@@ -0,0 +1,157 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from instrumentation import wrap_public_methods
+
+# Latency buckets in seconds, from a cache hit to a slow Bot API call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    """A monotonically increasing count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + '_total', labels, value
+
+class Histogram:
+    """Observation counts in cumulative buckets, plus their sum, per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [count per bucket..., count over the last bucket, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('+Inf' if bound == float('inf') else repr(bound)),), cumulative
+            yield self.name + '_count', labels, cumulative
+            yield self.name + '_sum', labels, counts[-1]
+
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            labelnames = metric.labelnames + (('le',) if name.endswith('_bucket') else ())
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in zip(labelnames, labels))
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+# --- Metrics ---
+
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+UPDATE_SECONDS = Histogram('telegram_update_duration_seconds', 'Time to run the handlers for one Telegram update', ('kind',))
+CALLBACK_SECONDS = Histogram('callback_handler_duration_seconds', 'Callback query handler latency by route', ('route',))
+DB_METHOD_SECONDS = Histogram('db_method_duration_seconds', 'Database method latency, including nested calls', ('method',))
+DB_METHOD_ERRORS = Counter('db_method_errors', 'Database methods that raised', ('method',))
+TELEGRAM_SECONDS = Histogram('telegram_api_duration_seconds', 'Bot API call latency by method', ('method',))
+TELEGRAM_ERRORS = Counter('telegram_api_errors', 'Bot API calls that failed, by error code', ('method', 'error_code'))
+PAYMENTS_PROCESSED = Counter('payments_processed', 'Payments recorded')
+PAYMENTS_SOL = Counter('payments_received_sol', 'SOL received in recorded payments')
+REFERRALS_CONVERTED = Counter('referrals_converted', 'Referrals converted by a payment')
+
+# --- Instrumentation helpers ---
+
+def instrument_methods(cls, histogram, errors):
+    """Time every public method defined on cls, labelled with its name"""
+    wrap_public_methods(cls, lambda method, name: _timed_method(method, name, histogram, errors), '_timed')
+
+def _timed_method(method, name, histogram, errors):
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+    return timed
+
+def record_telegram_call(method, elapsed, result):
+    """Record one Bot API call and, if it failed, its error code"""
+    TELEGRAM_SECONDS.observe(elapsed, method)
+    if not result.get('ok'):
+        TELEGRAM_ERRORS.inc(method, str(result.get('error_code', 'exception')))
+
+def update_kind(update):
+    """The update type label: message, callback_query, ..."""
+    if isinstance(update, dict):
+        for key in update:
+            if key != 'update_id':
+                return key
+    return 'unknown'
+
+def instrument_flask(app):
+    """Time every request by its URL rule, so /static/<path:path> is one series"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, str(response.status_code))
+        return response
@@ -0,0 +1,310 @@
+import atexit
+import heapq
+import itertools
+import random
+import threading
+import time
+import logging
+from telegram_api import get_client
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Refills rate tokens per second up to capacity"""
+
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available, 0 if one is available now"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until):
+        """Hold the bucket empty until the given time (Telegram's retry_after)"""
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+class RateLimiter:
+    """Enforces Telegram's global and per-chat send limits with token buckets.
+
+    Telegram's limits apply per bot, so when several processes send notifications
+    global_rate should be divided between them. Broadcasts in the same process draw
+    from the global bucket through reserve_global, so both together stay within it.
+    """
+
+    def __init__(self, global_rate=30, per_chat_rate=1, prune_every=1000):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.prune_every = prune_every
+        self._chats = {}
+        self._reserved = 0
+        self._global_lock = threading.Lock()
+
+    def reserve(self, chat_id, now):
+        """Take a send slot for chat_id. Returns 0 on success, otherwise the seconds to wait"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = TokenBucket(self.per_chat_rate, capacity=1, now=now)
+
+        with self._global_lock:
+            wait = max(self.global_bucket.wait_time(now), chat.wait_time(now))
+            if wait > 0:
+                return wait
+            self.global_bucket.take()
+
+        chat.take()
+        self._reserved += 1
+        if self._reserved % self.prune_every == 0:
+            self._prune(now)
+        return 0
+
+    def reserve_global(self, now):
+        """Take a slot from the global bucket only. Returns 0 on success, otherwise the seconds to wait"""
+        with self._global_lock:
+            wait = self.global_bucket.wait_time(now)
+            if wait == 0:
+                self.global_bucket.take()
+            return wait
+
+    def block_global(self, until):
+        with self._global_lock:
+            self.global_bucket.block(until)
+
+    def block_chat(self, chat_id, until):
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            chat.block(until)
+
+    def _prune(self, now):
+        """Forget chats whose bucket has refilled, they behave like new ones"""
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.is_idle(now)]:
+            del self._chats[chat_id]
+
+class Notification:
+    """One outbound message and its delivery history"""
+    __slots__ = ('chat_id', 'text', 'reply_markup', 'attempts', 'last_error')
+
+    def __init__(self, chat_id, text, reply_markup=None, attempts=0, last_error=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.attempts = attempts
+        self.last_error = last_error
+
+class NotificationQueue:
+    """Outbound Telegram message queue that respects the Bot API rate limits.
+
+    Messages wait in a due-time heap and are sent by a small worker pool once both
+    the global and the per-chat token bucket allow it. Telegram's flood limits apply
+    to the whole bot, so a 429 holds the global bucket as well as the chat for its
+    retry_after; other failures are retried with jittered exponential backoff.
+    Messages that keep failing, hit a permanent error, or are still queued at shutdown
+    go to the notification_dead_letters table; retryable ones are requeued on start.
+
+    Queued messages live only in memory until then: if the process is killed without
+    a graceful shutdown (SIGKILL, OOM, a crash, a worker timeout), everything queued or
+    waiting for a retry is lost. Under normal load that is a few seconds of messages,
+    but during a long retry_after or backoff it can be minutes' worth.
+    """
+
+    def __init__(self, db, client=None, global_rate=30, per_chat_rate=1, workers=4,
+                 max_attempts=5, base_delay=1.0, max_delay=60.0, requeue_on_start=True):
+        self.db = db
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = RateLimiter(global_rate, per_chat_rate)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._in_flight = 0
+        self._stats = {'enqueued': 0, 'sent': 0, 'retried': 0, 'rate_limited': 0, 'dead_lettered': 0, 'requeued': 0}
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f'notifier-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        # Off the constructor so building the queue at import doesn't touch the database
+        if requeue_on_start:
+            threading.Thread(target=self.requeue_dead_letters, name='notifier-requeue', daemon=True).start()
+        atexit.register(self.close)
+
+    def send(self, chat_id, text, reply_markup=None):
+        """Queue a message for delivery"""
+        self._push(Notification(chat_id, text, reply_markup), time.monotonic())
+        with self._cond:
+            self._stats['enqueued'] += 1
+
+    def _push(self, notification, due, seq=None):
+        with self._cond:
+            if not self._stopping:
+                seq = next(self._seq) if seq is None else seq
+                heapq.heappush(self._heap, (due, seq, notification))
+                self._cond.notify()
+                return
+        # Shutting down, keep it for the next start
+        self._dead_letter([notification], retryable=True)
+
+    def _next(self):
+        """Block until a message is due and the rate limits allow it. Returns None on shutdown"""
+        with self._cond:
+            while not self._stopping:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                now = time.monotonic()
+                due, seq, notification = self._heap[0]
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                wait = self.limiter.reserve(notification.chat_id, now)
+                if wait > 0:
+                    # Keep the original sequence number so a chat's messages stay in order
+                    heapq.heappush(self._heap, (now + wait, seq, notification))
+                    continue
+
+                self._in_flight += 1
+                return seq, notification
+            return None
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            seq, notification = item
+            try:
+                self._deliver(seq, notification)
+            except Exception as e:
+                logger.error(f"Error delivering notification to {notification.chat_id}: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, seq, notification):
+        notification.attempts += 1
+        client = self.client or get_client()
+        result = client.send_message(notification.chat_id, notification.text, notification.reply_markup)
+        if result.get('ok'):
+            with self._cond:
+                self._stats['sent'] += 1
+            return
+
+        error_code = result.get('error_code')
+        notification.last_error = result.get('description') or result.get('error')
+
+        if error_code == 429:
+            # Telegram tells us exactly how long to back off; this doesn't count as an attempt
+            retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+            notification.attempts -= 1
+            until = time.monotonic() + retry_after
+            with self._cond:
+                self.limiter.block_chat(notification.chat_id, until)
+                self.limiter.block_global(until)
+                self._stats['rate_limited'] += 1
+            logger.warning(f"Rate limited sending to {notification.chat_id}, retrying in {retry_after}s")
+            self._push(notification, until, seq)
+            return
+
+        # Other 4xx errors (chat not found, bot blocked, bad markup) won't succeed on retry
+        permanent = error_code is not None and 400 <= error_code < 500
+        if permanent or notification.attempts >= self.max_attempts:
+            self._dead_letter([notification], retryable=not permanent)
+            return
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (notification.attempts - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        with self._cond:
+            self._stats['retried'] += 1
+        logger.info(f"Retrying notification to {notification.chat_id} in {delay:.1f}s (attempt {notification.attempts})")
+        self._push(notification, time.monotonic() + delay, seq)
+
+    def _dead_letter(self, notifications, retryable):
+        try:
+            self.db.add_notification_dead_letters([
+                {
+                    'chat_id': notification.chat_id,
+                    'text': notification.text,
+                    'reply_markup': notification.reply_markup,
+                    'attempts': notification.attempts,
+                    'last_error': notification.last_error,
+                    'retryable': retryable
+                }
+                for notification in notifications
+            ])
+        except Exception as e:
+            logger.error(f"Error writing {len(notifications)} notifications to dead letters: {e}")
+            return
+        with self._cond:
+            self._stats['dead_lettered'] += len(notifications)
+        logger.warning(f"Moved {len(notifications)} notifications to dead letters (retryable: {retryable})")
+
+    def requeue_dead_letters(self):
+        """Load retryable dead letters back into the queue"""
+        try:
+            letters = self.db.pop_notification_dead_letters()
+        except Exception as e:
+            logger.error(f"Error loading notification dead letters: {e}")
+            return 0
+
+        now = time.monotonic()
+        for letter in letters:
+            # Give every requeued message a fresh set of attempts
+            self._push(Notification(letter['chat_id'], letter['text'], letter['reply_markup']), now)
+        with self._cond:
+            self._stats['requeued'] += len(letters)
+        if letters:
+            logger.info(f"Requeued {len(letters)} notifications from dead letters")
+        return len(letters)
+
+    def close(self, timeout=10):
+        """Give in-flight sends a moment to finish and persist whatever is still queued"""
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+            deadline = time.monotonic() + timeout
+            while self._in_flight and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            pending = [notification for _, _, notification in sorted(self._heap)]
+            self._heap = []
+
+        if pending:
+            self._dead_letter(pending, retryable=True)
+
+    def stats(self):
+        """Delivery counters and current queue depth"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._heap)
+            stats['in_flight'] = self._in_flight
+        return stats
@@ -0,0 +1,109 @@
+import logging
+from config import DEPOSIT_ADDRESS, REQUIRED_PAYMENT
+from database import db
+from log_setup import audit_logger
+
+logger = logging.getLogger(__name__)
+
+def process_transactions(transactions, send_message):
+    """Record the payments in a list of Helius transactions in one database transaction.
+
+    send_message(chat_id, text) is called for the user and referrer notifications once
+    everything is committed. Returns the add_payments results.
+    """
+    # Collect transfers to our deposit address, keeping the payload order
+    transfers = []
+    for transaction in transactions:
+        transaction_id = transaction.get('signature')
+        if not transaction_id:
+            logger.error("Transaction missing signature")
+            continue
+
+        for transfer in transaction.get('nativeTransfers') or []:
+            if transfer.get('toUserAccount') == DEPOSIT_ADDRESS:
+                transfers.append((transaction_id, transfer))
+
+    if not transfers:
+        logger.info("No payments to %s in %d transactions", DEPOSIT_ADDRESS, len(transactions))
+        return []
+
+    # Resolve every sender and drop already processed signatures with one lookup each
+    owners = db.get_users_by_wallets(transfer.get('fromUserAccount') for _, transfer in transfers)
+    processed = db.get_processed_transaction_ids(transaction_id for transaction_id, _ in transfers)
+
+    # One payment per signature, from the first transfer whose wallet belongs to a user
+    payments = []
+    for transaction_id, transfer in transfers:
+        from_address = transfer.get('fromUserAccount')
+        user_id = owners.get(from_address)
+        if not user_id:
+            logger.warning("Wallet %s not associated with any user", from_address)
+            continue
+        if transaction_id in processed:
+            logger.warning("Transaction %s has already been processed", transaction_id)
+            continue
+
+        processed.add(transaction_id)
+        payments.append({
+            'telegram_id': user_id,
+            'transaction_id': transaction_id,
+            'amount': transfer.get('amount', 0) / 1_000_000_000  # lamports to SOL
+        })
+
+    results = db.add_payments(payments)
+
+    # Only notify once everything is committed
+    for result in results:
+        audit_logger.info(
+            "payment recorded tx=%s user=%s amount=%.9f total_paid=%.9f referrer=%s commission=%.9f",
+            result['transaction_id'], result['telegram_id'], result['amount'], result['paid_amount'],
+            result['referrer_id'], result['commission_amount'] or 0
+        )
+        try:
+            send_payment_notifications(result, send_message)
+        except Exception as e:
+            logger.error("Error sending payment notifications for %s: %s", result['transaction_id'], e, exc_info=True)
+    return results
+
+def process_each_transaction(transactions, send_message):
+    """Record every transaction's payments in its own database transaction, so one bad
+    transaction doesn't hold back the others. Returns the results of those that succeeded
+    """
+    results = []
+    for transaction in transactions:
+        try:
+            results.extend(process_transactions([transaction], send_message))
+        except Exception as e:
+            logger.error("Error processing transaction: %s", e, exc_info=True)
+    return results
+
+def send_payment_notifications(payment, send_message):
+    """Tell a user (and their referrer) about a recorded payment"""
+    user_id = payment['telegram_id']
+    amount_sol = payment['amount']
+    paid_amount = payment['paid_amount']
+
+    if paid_amount >= REQUIRED_PAYMENT:
+        send_message(user_id,
+            "🎉 <b>Payment Confirmed!</b> 🎉\n\n"
+            f"We have received your payment of {amount_sol:.3f} solana\n\n"
+            f"Enter /start to begin accessing Translucent's features"
+        )
+    else:
+        remaining = REQUIRED_PAYMENT - paid_amount
+        send_message(user_id,
+            "💰 <b>Partial Payment Received</b> 💰\n\n"
+            f"• Amount received: {amount_sol:.3f} SOL\n"
+            f"• Total paid so far: {paid_amount:.3f} SOL\n"
+            f"• Remaining amount: {remaining:.3f} SOL\n\n"
+            "Please complete the payment to gain full access."
+        )
+
+    referrer_id = payment['referrer_id']
+    if referrer_id:
+        referral_stats = db.get_referral_stats(referrer_id)
+        send_message(referrer_id,
+            "🎉 <b>Referral Converted!</b> 🎉\n\n"
+            f"You earned {payment['commission_amount']:.3f} SOL in commission.\n\n"
+            f"Total commission earned: {referral_stats['total_commission']:.3f} SOL"
+        )
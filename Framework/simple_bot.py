@@ -1,34 +1,23 @@
-import requests
 import logging
-import json
 from flask import Flask, request
-from config import BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, PORT, DEPOSIT_ADDRESS, REQUIRED_PAYMENT
-from database import Database
+from config import WEBHOOK_HOST, WEBHOOK_PATH, PORT, DEPOSIT_ADDRESS, REQUIRED_PAYMENT
+from log_setup import configure_logging, log_payload
+from database import db
+from telegram_api import get_client
+from callback_router import CallbackRouter
 
 # Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-db = Database('translucent_bot.db')
+
+# Routes inline keyboard callback_data to the handlers registered below
+callback_router = CallbackRouter()
 
 def send_message(chat_id, text, reply_markup=None):
     """Send a message to a Telegram chat"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    
-    if reply_markup:
-        payload['reply_markup'] = json.dumps(reply_markup)
-        
-    response = requests.post(url, json=payload)
-    return response.json()
+    return get_client().send_message(chat_id, text, reply_markup)
 
 def get_start_keyboard(is_premium=False):
     """Get the main keyboard for the start command"""
@@ -108,34 +97,21 @@ def handle_start_command(chat_id, user_id):
     
     send_message(chat_id, text, keyboard)
 
+@callback_router.exact('back_to_start')
+def handle_back_to_start(chat_id, message_id, user_id):
+    """Handle back to start menu button click"""
+    handle_start_command(chat_id, user_id)
+    edit_message(chat_id, message_id, "Returning to main menu...")
+
 def answer_callback_query(query_id, text=None, show_alert=False):
     """Answer a callback query to stop the loading animation"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/answerCallbackQuery"
-    payload = {'callback_query_id': query_id}
-    
-    if text:
-        payload['text'] = text
-        payload['show_alert'] = show_alert
-        
-    response = requests.post(url, json=payload)
-    return response.json()
+    return get_client().answer_callback_query(query_id, text, show_alert)
 
 def edit_message(chat_id, message_id, text, reply_markup=None):
     """Edit a message"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/editMessageText"
-    payload = {
-        'chat_id': chat_id,
-        'message_id': message_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    
-    if reply_markup:
-        payload['reply_markup'] = json.dumps(reply_markup)
-        
-    response = requests.post(url, json=payload)
-    return response.json()
+    return get_client().edit_message_text(chat_id, message_id, text, reply_markup)
 
+@callback_router.exact('wallet_menu')
 def handle_wallet_menu(chat_id, message_id, user_id):
     """Handle wallet menu button click"""
     # Get user's wallets
@@ -151,6 +127,7 @@ def handle_wallet_menu(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('add_wallet')
 def handle_add_wallet(chat_id, message_id, user_id):
     """Handle add wallet button click"""
     text = (
@@ -200,6 +177,7 @@ def validate_solana_address(address):
     # Solana addresses are base58 encoded and typically 32-44 characters
     return bool(re.match(r'^[1-9A-HJ-NP-Za-km-z]{32,44}$', address))
 
+@callback_router.exact('pay_now')
 def handle_pay_now(chat_id, message_id, user_id):
     """Handle pay now button click"""
     # Get user's wallets
@@ -243,6 +221,7 @@ def handle_pay_now(chat_id, message_id, user_id):
     
     edit_message(chat_id, message_id, text, keyboard)
 
+@callback_router.exact('check_payment')
 def handle_check_payment(chat_id, message_id, user_id):
     """Handle check payment status button click"""
     # Get user info
@@ -343,6 +322,7 @@ def handle_referral_command(chat_id, user_id):
     
     send_message(chat_id, text, keyboard)
 
+@callback_router.exact('referral_menu')
 def handle_referral_menu(chat_id, message_id, user_id):
     """Handle referral menu button click"""
     # Similar to handle_referral_command but edit message instead
@@ -375,7 +355,7 @@ def telegram_webhook():
     """Handle Telegram webhook updates"""
     try:
         update = request.json
-        logger.info(f"Received Telegram update: {json.dumps(update, indent=2)}")
+        log_payload(logger, "Received Telegram update", update)
         
         # Process the update
         if 'message' in update:
@@ -424,20 +404,8 @@ def telegram_webhook():
             # Answer callback query to stop loading animation
             answer_callback_query(query_id)
             
-            # Handle different callback data
-            if data == 'wallet_menu':
-                handle_wallet_menu(chat_id, message_id, user_id)
-            elif data == 'add_wallet':
-                handle_add_wallet(chat_id, message_id, user_id)
-            elif data == 'back_to_start':
-                handle_start_command(chat_id, user_id)
-                edit_message(chat_id, message_id, "Returning to main menu...")
-            elif data == 'pay_now':
-                handle_pay_now(chat_id, message_id, user_id)
-            elif data == 'check_payment':
-                handle_check_payment(chat_id, message_id, user_id)
-            elif data == 'referral_menu':
-                handle_referral_menu(chat_id, message_id, user_id)
+            # Route the callback data to its handler
+            callback_router.dispatch(data, chat_id, message_id, user_id)
         
         return '', 200
     except Exception as e:
@@ -452,11 +420,10 @@ def index():
 if __name__ == '__main__':
     # Set the webhook
     webhook_url = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
-    set_webhook_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook?url={webhook_url}"
     
     logger.info(f"Setting webhook to {webhook_url}")
-    response = requests.get(set_webhook_url)
-    logger.info(f"Webhook set response: {response.json()}")
+    response = get_client().set_webhook(webhook_url)
+    logger.info(f"Webhook set response: {response}")
     
     # Make sure the payment webhook server is running
     logger.info("Make sure to run webhook_server.py in a separate terminal for payment processing")
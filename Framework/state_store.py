@@ -0,0 +1,109 @@
+import atexit
+import threading
+import logging
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class UsersTableStateStore:
+    """Keeps conversation state in the users.state column (the original behaviour)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, telegram_id):
+        return self.db.read_state_column(telegram_id)
+
+    def set(self, telegram_id, state):
+        self.db.write_state_columns({telegram_id: state})
+
+class KeyValueStateStore:
+    """Keeps conversation state in the shared conversation_states table, off the users rows"""
+
+    def __init__(self, db, ttl=3600):
+        self.db = db
+        self.ttl = ttl
+
+    def get(self, telegram_id):
+        return self.db.get_conversation_state(telegram_id)
+
+    def set(self, telegram_id, state):
+        if state is None:
+            self.db.delete_conversation_state(telegram_id)
+        else:
+            self.db.set_conversation_state(telegram_id, state, self.ttl)
+
+class MemoryStateStore:
+    """Keeps conversation state in a per-process TTL dict.
+
+    With write_behind enabled, changed states are flushed to users.state in batches
+    from a background thread, and a state missing from memory (after a restart) is
+    read back from the column once.
+    """
+
+    def __init__(self, db, ttl=3600, max_size=100000, write_behind=False, flush_interval=5):
+        self.db = db
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._states = TTLCache(max_size=max_size, ttl=ttl)
+        self._dirty = {}
+        self._dirty_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        if write_behind:
+            self._flusher = threading.Thread(target=self._flush_loop, name='state-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def get(self, telegram_id):
+        state = self._states.get(telegram_id, _MISSING)
+        if state is _MISSING:
+            state = self.db.read_state_column(telegram_id) if self.write_behind else None
+            # Remember "no state" too, so plain messages don't keep hitting the database
+            self._states.set(telegram_id, state)
+        return state
+
+    def set(self, telegram_id, state):
+        self._states.set(telegram_id, state)
+        if self.write_behind:
+            with self._dirty_lock:
+                self._dirty[telegram_id] = state
+
+    def flush(self):
+        """Write pending state changes to the users table"""
+        with self._dirty_lock:
+            pending, self._dirty = self._dirty, {}
+        if not pending:
+            return 0
+
+        try:
+            self.db.write_state_columns(pending)
+        except Exception as e:
+            logger.error(f"Error flushing {len(pending)} conversation states: {e}")
+            # Put them back unless a newer state arrived in the meantime
+            with self._dirty_lock:
+                for telegram_id, state in pending.items():
+                    self._dirty.setdefault(telegram_id, state)
+            return 0
+        return len(pending)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the flusher and write out anything still pending"""
+        self._stop.set()
+        self.flush()
+
+def create_state_store(db, backend='users', ttl=3600, write_behind=False, flush_interval=5):
+    """Build the configured conversation state store"""
+    if backend == 'memory':
+        return MemoryStateStore(db, ttl=ttl, write_behind=write_behind, flush_interval=flush_interval)
+    if backend == 'table':
+        return KeyValueStateStore(db, ttl=ttl)
+    if backend != 'users':
+        logger.warning(f"Unknown state store backend '{backend}', using users table")
+    return UsersTableStateStore(db)
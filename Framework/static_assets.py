@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import logging
+
+# brotli is optional; without it only gzip variants are served
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Build tools put a content hash in the names of files under static/, e.g. main.8f2a1c3d.js
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml', 'application/wasm')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+class Asset:
+    """One file of a build, with its compressed variants when they are worth having"""
+
+    def __init__(self, path, full_path, size, data, etag, mimetype, cache_control):
+        self.path = path
+        self.full_path = full_path
+        self.size = size
+        self.data = data  # None for files too large to keep in memory
+        self.etag = etag
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.variants = {}  # encoding -> bytes
+
+class StaticAssets:
+    """In-memory index of a React build directory.
+
+    The whole tree is indexed once, at startup. Files up to max_file_size are held in
+    memory, up to max_total_size in all, together with gzip and brotli variants:
+    prebuilt .gz/.br files next to them are used when present, otherwise the variants
+    are compressed here. Responses carry a strong ETag and honour If-None-Match;
+    hashed files under static/ are marked immutable, everything else must be
+    revalidated. Files not held in memory are left to the caller to send from disk.
+    """
+
+    def __init__(self, build_dir, max_file_size=1024 * 1024, max_total_size=64 * 1024 * 1024, min_compress_size=1024):
+        self.build_dir = build_dir
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.min_compress_size = min_compress_size
+        self.assets = {}
+        self.memory_size = 0
+        self._stats = {'served': 0, 'not_modified': 0, 'gzip': 0, 'br': 0}
+        self._lock = threading.Lock()
+        self.index()
+
+    def index(self):
+        """(Re)build the index from the build directory"""
+        assets = {}
+        memory_size = 0
+        if not os.path.isdir(self.build_dir):
+            logger.warning(f"Build directory {self.build_dir} not found, no static assets indexed")
+            self.assets, self.memory_size = assets, memory_size
+            return
+
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                # Prebuilt variants are attached to the file they compress
+                if name.endswith(('.gz', '.br')) and os.path.splitext(name)[0] in files:
+                    continue
+
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.build_dir).replace(os.sep, '/')
+                asset = self._load(path, full_path, memory_size)
+                memory_size += len(asset.data or b'') + sum(len(variant) for variant in asset.variants.values())
+                assets[path] = asset
+
+        self.assets, self.memory_size = assets, memory_size
+        logger.info(f"Indexed {len(assets)} static assets in {self.build_dir} ({memory_size // 1024} KiB in memory)")
+
+    def _load(self, path, full_path, memory_size):
+        size = os.path.getsize(full_path)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if mimetype.startswith(('text/', 'application/javascript', 'application/json')):
+            mimetype += '; charset=utf-8'
+        hashed = path.startswith('static/') and HASHED_NAME.search(os.path.basename(path))
+        cache_control = IMMUTABLE if hashed else REVALIDATE
+
+        if size > self.max_file_size or memory_size + size > self.max_total_size:
+            stat = os.stat(full_path)
+            etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+            return Asset(path, full_path, size, None, etag, mimetype, cache_control)
+
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        asset = Asset(path, full_path, size, data, etag, mimetype, cache_control)
+
+        if size >= self.min_compress_size and mimetype.startswith(COMPRESSIBLE_TYPES):
+            for encoding, suffix, compress in (('br', '.br', brotli and brotli.compress), ('gzip', '.gz', gzip.compress)):
+                if os.path.exists(full_path + suffix):
+                    with open(full_path + suffix, 'rb') as f:
+                        variant = f.read()
+                elif compress:
+                    variant = compress(data)
+                else:
+                    continue
+                if len(variant) < size:
+                    asset.variants[encoding] = variant
+        return asset
+
+    def get(self, path):
+        """The indexed asset at a path relative to the build directory, or None"""
+        return self.assets.get(path)
+
+    def respond(self, asset, accept_encoding='', if_none_match=''):
+        """Pick the body for a request. Returns (status, headers, body); body is None for a 304"""
+        encoding = None
+        accepted = {
+            part.split(';')[0].strip() for part in accept_encoding.lower().replace(' ', '').split(',')
+            if not part.endswith(('q=0', 'q=0.0'))
+        }
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and candidate in accepted:
+                encoding = candidate
+                break
+
+        # Each representation gets its own validator, as the bytes differ
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': asset.cache_control,
+            'Content-Type': asset.mimetype
+        }
+        if asset.variants:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if if_none_match and _etag_matches(if_none_match, etag):
+            self._count('not_modified')
+            return 304, headers, None
+
+        self._count('served')
+        if encoding:
+            self._count(encoding)
+            headers['Content-Encoding'] = encoding
+            return 200, headers, asset.variants[encoding]
+        return 200, headers, asset.data
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Index size and response counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['files'] = len(self.assets)
+        stats['memory_kib'] = self.memory_size // 1024
+        return stats
+
+def _etag_matches(if_none_match, etag):
+    """Weak comparison, as If-None-Match requires"""
+    if if_none_match.strip() == '*':
+        return True
+    wanted = etag.replace('W/', '')
+    return any(tag.strip().replace('W/', '') == wanted for tag in if_none_match.split(','))
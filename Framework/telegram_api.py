@@ -0,0 +1,220 @@
+import logging
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from config import BOT_TOKEN, TELEGRAM_API_URL, TELEGRAM_POOL_SIZE, TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_HTTP2
+from metrics import record_telegram_call
+from tracing import span, tag
+
+# httpx is optional for the sync client; HTTP/2 also needs the h2 package
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = httpx is not None
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Errors the callers expect and handle: the user blocked the bot (403) and flood
+# limits (429, retried after retry_after). Logged below ERROR so they don't flood the logs
+_EXPECTED_ERROR_LEVELS = {403: logging.DEBUG, 429: logging.INFO}
+
+def _log_api_error(method, result, body):
+    level = _EXPECTED_ERROR_LEVELS.get(result.get('error_code'), logging.ERROR)
+    logger.log(level, f"Telegram API error on {method}: {body}")
+
+class TelegramClient:
+    """Pooled, keep-alive client for the Telegram Bot API"""
+
+    def __init__(self, token, api_url=TELEGRAM_API_URL, pool_size=TELEGRAM_POOL_SIZE,
+                 connect_timeout=TELEGRAM_CONNECT_TIMEOUT, read_timeout=TELEGRAM_READ_TIMEOUT,
+                 http2=TELEGRAM_HTTP2):
+        self.api_url = f"{api_url.rstrip('/')}/bot{token}/"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+
+        if http2 and HTTP2_AVAILABLE:
+            # One multiplexed HTTP/2 connection serves all worker threads
+            self.http2 = True
+            self._http = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+            )
+        else:
+            # Fall back to a requests session with a keep-alive connection pool
+            self.http2 = False
+            self._http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self._http.mount('https://', adapter)
+            self._http.mount('http://', adapter)
+
+        logger.info(f"Telegram client ready (pool size {pool_size}, HTTP/2: {self.http2})")
+
+    def _timeout(self, read_timeout=None):
+        """Build a timeout value for the underlying HTTP library"""
+        read_timeout = read_timeout if read_timeout is not None else self.read_timeout
+        if self.http2:
+            return httpx.Timeout(read_timeout, connect=self.connect_timeout)
+        return (self.connect_timeout, read_timeout)
+
+    def call(self, method, payload=None, read_timeout=None):
+        """Call a Bot API method and return the decoded JSON response"""
+        start = time.perf_counter()
+        with span('telegram.' + method):
+            result = self._call(method, payload, read_timeout)
+            if not result.get('ok'):
+                tag('error_code', result.get('error_code', 'exception'))
+        record_telegram_call(method, time.perf_counter() - start, result)
+        return result
+
+    def _call(self, method, payload, read_timeout):
+        try:
+            response = self._http.post(
+                self.api_url + method,
+                json=payload or {},
+                timeout=self._timeout(read_timeout)
+            )
+            result = response.json()
+            if not result.get('ok'):
+                _log_api_error(method, result, response.text)
+            return result
+        except Exception as e:
+            logger.error(f"Exception calling Telegram API {method}: {e}")
+            return {"ok": False, "error": str(e)}
+
+    def send_message(self, chat_id, text, reply_markup=None, parse_mode='HTML'):
+        """Send a message to a chat"""
+        payload = {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': parse_mode
+        }
+
+        if reply_markup:
+            payload['reply_markup'] = reply_markup
+
+        return self.call('sendMessage', payload)
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None, parse_mode='HTML'):
+        """Edit the text of a message"""
+        payload = {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'text': text,
+            'parse_mode': parse_mode
+        }
+
+        if reply_markup:
+            payload['reply_markup'] = reply_markup
+
+        return self.call('editMessageText', payload)
+
+    def answer_callback_query(self, query_id, text=None, show_alert=False):
+        """Answer a callback query to stop the loading animation"""
+        payload = {'callback_query_id': query_id}
+
+        if text:
+            payload['text'] = text
+            payload['show_alert'] = show_alert
+
+        return self.call('answerCallbackQuery', payload)
+
+    def get_updates(self, offset=0, timeout=30, allowed_updates=None):
+        """Long-poll for updates"""
+        payload = {'offset': offset, 'timeout': timeout}
+
+        if allowed_updates:
+            payload['allowed_updates'] = allowed_updates
+
+        # The read timeout has to outlast the long-poll window
+        return self.call('getUpdates', payload, read_timeout=timeout + self.read_timeout)
+
+    def set_webhook(self, url):
+        """Point the bot's webhook at the given URL"""
+        return self.call('setWebhook', {'url': url})
+
+    def close(self):
+        """Close all pooled connections"""
+        self._http.close()
+
+class AsyncTelegramClient(TelegramClient):
+    """asyncio variant of TelegramClient built on httpx.AsyncClient.
+
+    The request helpers are inherited and return coroutines here, e.g.
+    ``await client.send_message(chat_id, text)``.
+    """
+
+    def __init__(self, token, api_url=TELEGRAM_API_URL, pool_size=TELEGRAM_POOL_SIZE,
+                 connect_timeout=TELEGRAM_CONNECT_TIMEOUT, read_timeout=TELEGRAM_READ_TIMEOUT,
+                 http2=TELEGRAM_HTTP2):
+        if httpx is None:
+            raise RuntimeError("AsyncTelegramClient needs httpx installed")
+
+        self.api_url = f"{api_url.rstrip('/')}/bot{token}/"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._http = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+        logger.info(f"Async Telegram client ready (pool size {pool_size}, HTTP/2: {self.http2})")
+
+    def _timeout(self, read_timeout=None):
+        read_timeout = read_timeout if read_timeout is not None else self.read_timeout
+        return httpx.Timeout(read_timeout, connect=self.connect_timeout)
+
+    async def call(self, method, payload=None, read_timeout=None):
+        """Call a Bot API method and return the decoded JSON response"""
+        start = time.perf_counter()
+        result = await self._call(method, payload, read_timeout)
+        record_telegram_call(method, time.perf_counter() - start, result)
+        return result
+
+    async def _call(self, method, payload, read_timeout):
+        try:
+            response = await self._http.post(
+                self.api_url + method,
+                json=payload or {},
+                timeout=self._timeout(read_timeout)
+            )
+            result = response.json()
+            if not result.get('ok'):
+                _log_api_error(method, result, response.text)
+            return result
+        except Exception as e:
+            logger.error(f"Exception calling Telegram API {method}: {e}")
+            return {"ok": False, "error": str(e)}
+
+    async def close(self):
+        """Close all pooled connections"""
+        await self._http.aclose()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide Telegram client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TelegramClient(BOT_TOKEN)
+    return _client
+
+def set_client(client):
+    """Replace the process-wide Telegram client"""
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# The modules live next to this directory and read their settings at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bot-tests-'), 'test.db')
+os.environ.setdefault('BOT_TOKEN', '0:test')
+os.environ.setdefault('TELEGRAM_API_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('DEPOSIT_ADDRESS', 'DepositAddress1111111111111111111111111111')
+os.environ.setdefault('NOTIFY_QUEUE_ENABLED', 'false')
+os.environ.setdefault('BROADCAST_RESUME_ON_START', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import database
+
+database.migrate(os.environ['DATABASE_PATH'])
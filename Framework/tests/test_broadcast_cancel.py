@@ -0,0 +1,43 @@
+import threading
+from broadcast import BroadcastEngine
+from database import get_db
+
+class CancellingClient:
+    """Fake Bot API client; the first send cancels the broadcast the way another process would"""
+
+    def __init__(self, db):
+        self.db = db
+        self.broadcast_id = None
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text):
+        with self._lock:
+            if not self.sent:
+                assert self.db.set_broadcast_status(self.broadcast_id, 'cancelled')
+            self.sent.append(chat_id)
+        return {'ok': True}
+
+def test_checkpoint_keeps_cancel():
+    db = get_db()
+    broadcast_id = db.create_broadcast('hello', None)
+    db.set_broadcast_status(broadcast_id, 'cancelled')
+
+    assert db.save_broadcast_progress(broadcast_id, 10, 5, 0, 0, status='running') == 'cancelled'
+    assert not db.set_broadcast_status(broadcast_id, 'interrupted')
+    broadcast = db.get_broadcast(broadcast_id)
+    assert broadcast['status'] == 'cancelled'
+    assert broadcast['sent'] == 5
+
+def test_cancel_from_another_process_stops_after_the_page():
+    db = get_db()
+    for telegram_id in range(500, 506):
+        db.add_user_if_not_exists(telegram_id, f'user{telegram_id}')
+
+    client = CancellingClient(db)
+    engine = BroadcastEngine(db, client=client, rate=1000, senders=1, page_size=2)
+    client.broadcast_id = db.create_broadcast('hello', None)
+    engine._run(client.broadcast_id)
+
+    assert len(client.sent) == 2
+    assert db.get_broadcast(client.broadcast_id)['status'] == 'cancelled'
@@ -0,0 +1,54 @@
+import datetime
+import threading
+import time
+from broadcast import BroadcastEngine
+from database import get_db
+
+class RecordingClient:
+    """Fake Bot API client; the first send takes delay seconds, like a long retry_after"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.texts = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text):
+        with self._lock:
+            first = not self.texts
+            self.texts.append(text)
+        if first:
+            time.sleep(self.delay)
+        return {'ok': True}
+
+def test_admin_text_is_sent_escaped():
+    db = get_db()
+    db.add_user_if_not_exists(600, 'reader')
+    client = RecordingClient()
+    engine = BroadcastEngine(db, client=client, rate=1000, senders=1, page_size=1)
+    broadcast_id = db.create_broadcast('Fees < 1% & no <b>catch</b>', None)
+
+    thread = threading.Thread(target=engine._run, args=(broadcast_id,))
+    thread.start()
+    while not client.texts:
+        time.sleep(0.01)
+    engine.cancel(broadcast_id)
+    thread.join()
+
+    assert client.texts[0] == 'Fees &lt; 1% &amp; no &lt;b&gt;catch&lt;/b&gt;'
+
+def test_slow_page_keeps_its_claim():
+    db = get_db()
+    db.add_user_if_not_exists(601, 'reader')
+    client = RecordingClient(delay=0.5)
+    engine = BroadcastEngine(db, client=client, rate=1000, senders=1, page_size=1, stale_after=0.15)
+    broadcast_id = db.create_broadcast('hello', None)
+
+    thread = threading.Thread(target=engine._run, args=(broadcast_id,))
+    thread.start()
+    time.sleep(0.3)
+    # Another process starting now must not take over the page still being sent
+    stale_before = datetime.datetime.now() - datetime.timedelta(seconds=0.15)
+    assert broadcast_id not in db.claim_resumable_broadcasts(stale_before)
+    engine.cancel(broadcast_id)
+    thread.join()
+    assert db.get_broadcast(broadcast_id)['status'] == 'cancelled'
@@ -0,0 +1,30 @@
+from callback_router import CallbackRouter
+
+def make_router(calls):
+    router = CallbackRouter()
+    router.add_exact('wallet_menu', lambda chat_id: calls.append(('wallet_menu', chat_id)))
+    router.add_prefix('wallet_', lambda chat_id, rest: calls.append(('wallet_*', rest)))
+    router.add_prefix('wallet_remove_', lambda chat_id, rest: calls.append(('wallet_remove_*', rest)))
+    return router
+
+def test_exact_route_beats_prefixes():
+    calls = []
+    assert make_router(calls).dispatch('wallet_menu', 1)
+    assert calls == [('wallet_menu', 1)]
+
+def test_longest_prefix_wins_and_gets_the_rest():
+    calls = []
+    router = make_router(calls)
+    assert router.dispatch('wallet_remove_Abc123', 1)
+    assert router.dispatch('wallet_rename', 1)
+    assert calls == [('wallet_remove_*', 'Abc123'), ('wallet_*', 'rename')]
+    assert router.resolve('wallet_remove_')[0] == 'wallet_remove_*'
+
+def test_unmatched_data_is_not_dispatched():
+    calls = []
+    router = make_router(calls)
+    assert router.resolve('check_payment') is None
+    assert not router.dispatch('check_payment', 1)
+    assert not router.dispatch('wallet', 1)
+    assert calls == []
+    assert router.stats() == {}
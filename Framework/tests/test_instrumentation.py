@@ -0,0 +1,56 @@
+import functools
+import pytest
+from instrumentation import wrap_public_methods
+
+def make_class():
+    def decorated(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return method(*args, **kwargs)
+        return wrapper
+
+    class Service:
+        def lookup(self, value):
+            return value
+
+        @decorated
+        def helper(self):
+            return 'helper'
+
+        def _private(self):
+            return 'private'
+
+        def rows(self):
+            yield 1
+
+    return Service
+
+def recorder(calls, tag):
+    def wrap(method, name):
+        @functools.wraps(method)
+        def wrapped(*args, **kwargs):
+            calls.append((tag, name))
+            return method(*args, **kwargs)
+        return wrapped
+    return wrap
+
+@pytest.mark.parametrize('order', [('trace', 'time'), ('time', 'trace')])
+def test_both_wrappers_apply_in_either_order(order):
+    Service, calls = make_class(), []
+    for tag in order:
+        wrap_public_methods(Service, recorder(calls, tag), f'_test_{tag}')
+
+    assert Service().lookup(1) == 1
+    assert sorted(calls) == [('time', 'lookup'), ('trace', 'lookup')]
+
+    calls.clear()
+    Service().helper(), Service()._private(), list(Service().rows())
+    assert calls == []
+
+def test_wrapping_twice_is_harmless():
+    Service, calls = make_class(), []
+    wrap_public_methods(Service, recorder(calls, 'trace'), '_test_trace')
+    wrap_public_methods(Service, recorder(calls, 'trace'), '_test_trace')
+
+    Service().lookup(1)
+    assert calls == [('trace', 'lookup')]
@@ -0,0 +1,44 @@
+import random
+import threading
+import time
+from update_queue import LaneDispatcher
+
+def test_items_for_one_chat_run_in_order():
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(item):
+        chat_id, seq = item
+        time.sleep(random.uniform(0, 0.002))
+        with lock:
+            handled.setdefault(chat_id, []).append(seq)
+
+    dispatcher = LaneDispatcher(handle, key_func=lambda item: item[0], lanes=4, max_size=4000)
+    for seq in range(100):
+        for chat_id in range(10):
+            assert dispatcher.submit((chat_id, seq), timeout=1)
+    assert dispatcher.shutdown(timeout=10)
+
+    assert handled == {chat_id: list(range(100)) for chat_id in range(10)}
+
+def test_different_chats_do_not_wait_for_each_other():
+    release = threading.Event()
+    done = []
+
+    def handle(chat_id):
+        if chat_id == 'slow':
+            release.wait(5)
+        done.append(chat_id)
+
+    dispatcher = LaneDispatcher(handle, key_func=lambda chat_id: chat_id, lanes=2)
+    fast = next(key for key in range(100) if dispatcher.lane_for(key) is not dispatcher.lane_for('slow'))
+    dispatcher.submit('slow')
+    dispatcher.submit(fast)
+
+    deadline = time.monotonic() + 5
+    while fast not in done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert done == [fast]
+    release.set()
+    assert dispatcher.shutdown(timeout=5)
+    assert done == [fast, 'slow']
@@ -0,0 +1,28 @@
+import logging
+import queue
+import threading
+from log_setup import _NonBlockingQueueHandler, audit_logger
+
+def make_record(name):
+    return logging.LogRecord(name, logging.INFO, __file__, 0, 'message', (), None)
+
+def test_full_queue_drops_ordinary_records():
+    handler = _NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    handler.emit(make_record('combined_server'))
+    handler.emit(make_record('combined_server'))
+    assert handler.dropped == 1
+    assert handler.queue.qsize() == 1
+
+def test_full_queue_keeps_audit_records():
+    handler = _NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    handler.emit(make_record('combined_server'))
+
+    writer = threading.Thread(target=handler.emit, args=(make_record(audit_logger.name),))
+    writer.start()
+    writer.join(0.1)
+    assert writer.is_alive()  # waiting for room rather than dropping
+
+    assert handler.queue.get().name == 'combined_server'
+    writer.join(1)
+    assert handler.queue.get(timeout=1).name == audit_logger.name
+    assert handler.dropped == 0
@@ -0,0 +1,39 @@
+from database import db
+from login_tokens import SignedLoginTokens
+
+def tokens(ttl=900):
+    return SignedLoginTokens('test-secret', ttl, db=db)
+
+def test_redeem_returns_the_user_once():
+    token = tokens().issue(1001)['token']
+    assert tokens().redeem(token) == 1001
+
+def test_tampered_token_is_rejected():
+    issuer = tokens()
+    token = issuer.issue(1002)['token']
+    rest = token.split('.', 1)[1]
+
+    assert issuer.redeem(f"1003.{rest}") is None
+    assert issuer.redeem(token[:-2] + ('AA' if not token.endswith('AA') else 'BB')) is None
+    assert SignedLoginTokens('other-secret', 900, db=db).redeem(token) is None
+    assert issuer.redeem('not-a-token') is None
+    assert issuer.stats()['bad_signature'] == 3
+    # None of the rejected attempts spent the nonce
+    assert issuer.redeem(token) == 1002
+
+def test_expired_token_is_rejected():
+    issuer = tokens(ttl=-1)
+    token = issuer.issue(1004)['token']
+    assert issuer.redeem(token) is None
+    assert issuer.stats()['expired'] == 1
+
+def test_replay_is_rejected_in_every_process():
+    first, second = tokens(), tokens()
+    token = first.issue(1005)['token']
+
+    assert first.redeem(token) == 1005
+    assert first.redeem(token) is None
+    # Another worker only shares the spent_login_nonces table
+    assert second.redeem(token) is None
+    assert first.stats()['replayed'] == 1
+    assert second.stats()['replayed'] == 1
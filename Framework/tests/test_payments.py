@@ -0,0 +1,37 @@
+import os
+import pytest
+from database import db
+from payments import process_transactions, process_each_transaction
+
+DEPOSIT = os.environ['DEPOSIT_ADDRESS']
+
+def transfer(signature, wallet, lamports):
+    return {'signature': signature, 'nativeTransfers': [{'fromUserAccount': wallet, 'toUserAccount': DEPOSIT, 'amount': lamports}]}
+
+@pytest.mark.parametrize('process', [process_transactions, process_each_transaction])
+def test_payment_converts_referral_and_notifies_both(process):
+    referrer, payer = (900, 901) if process is process_transactions else (910, 911)
+    wallet = f'PayerWa11et{payer}'
+    db.add_user_if_not_exists(referrer, 'referrer')
+    db.add_user_if_not_exists(payer, 'payer')
+    db.record_referral(referrer, payer)
+    db.add_wallet(payer, wallet)
+
+    sent = []
+    results = process([transfer(f'sig-{payer}', wallet, 1_000_000_000)], lambda chat_id, text: sent.append(chat_id))
+
+    assert [result['referrer_id'] for result in results] == [referrer]
+    assert db.get_user(payer)['is_premium']
+    assert sent == [payer, referrer]
+
+    # Helius redelivers the same signature; nothing is credited or sent twice
+    assert process([transfer(f'sig-{payer}', wallet, 1_000_000_000)], lambda chat_id, text: sent.append(chat_id)) == []
+    assert len(sent) == 2
+
+def test_one_bad_transaction_does_not_hold_back_the_others():
+    db.add_user_if_not_exists(920, 'payer')
+    db.add_wallet(920, 'PayerWa11et920')
+
+    transactions = [{'signature': 'sig-bad', 'nativeTransfers': None}, transfer('sig-920', 'PayerWa11et920', 500_000_000), 'not a transaction']
+    results = process_each_transaction(transactions, lambda chat_id, text: None)
+    assert [result['transaction_id'] for result in results] == ['sig-920']
@@ -0,0 +1,47 @@
+import time
+from broadcast import BroadcastEngine
+from notifier import Notification, NotificationQueue, RateLimiter
+
+class RateLimitedClient:
+    """Fake Bot API client that answers the first send with a flood-control 429"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        self.calls += 1
+        if self.calls == 1:
+            return {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 0.2}}
+        return {'ok': True}
+
+def test_broadcast_draws_from_the_notification_budget():
+    limiter = RateLimiter(global_rate=3, per_chat_rate=10)
+    engine = BroadcastEngine(None, rate=1000, senders=1, limiter=limiter)
+    try:
+        for _ in range(3):
+            engine._acquire()
+        # The broadcast used up the process's budget, so notifications have to wait
+        assert limiter.reserve(1, time.monotonic()) > 0
+    finally:
+        engine._pool.shutdown()
+
+def test_flood_limit_on_a_broadcast_holds_notifications():
+    limiter = RateLimiter(global_rate=100, per_chat_rate=10)
+    engine = BroadcastEngine(None, client=RateLimitedClient(), rate=1000, senders=1, limiter=limiter)
+    try:
+        started = time.monotonic()
+        assert engine._send(1, 'hello') == 'sent'
+        assert limiter.global_bucket.blocked_until >= started + 0.2
+    finally:
+        engine._pool.shutdown()
+
+def test_flood_limit_on_a_notification_holds_every_chat():
+    queue = NotificationQueue(None, client=RateLimitedClient(), global_rate=100, workers=0, requeue_on_start=False)
+    started = time.monotonic()
+    queue._deliver(0, Notification(1, 'hello'))
+
+    assert queue.limiter.global_bucket.blocked_until >= started + 0.2
+    assert queue.limiter.reserve(2, time.monotonic()) > 0
+    assert queue.stats()['queued'] == 1
+    queue._heap.clear()
+    queue.close()
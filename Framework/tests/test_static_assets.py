@@ -0,0 +1,48 @@
+import gzip
+import pytest
+from static_assets import StaticAssets, IMMUTABLE, REVALIDATE
+
+SCRIPT = b'console.log("translucent");\n' * 200
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'static' / 'js' / 'main.8f2a1c3d.js').write_bytes(SCRIPT)
+    # A prebuilt brotli variant is used as is, so the brotli package isn't needed here
+    (tmp_path / 'static' / 'js' / 'main.8f2a1c3d.js.br').write_bytes(b'br-bytes')
+    (tmp_path / 'index.html').write_bytes(b'<html></html>')
+    return StaticAssets(str(tmp_path))
+
+def test_plain_response_and_cache_headers(assets):
+    status, headers, body = assets.respond(assets.get('index.html'))
+    assert (status, body) == (200, b'<html></html>')
+    assert headers['Cache-Control'] == REVALIDATE
+    assert 'Content-Encoding' not in headers
+    assert assets.get('static/js/main.8f2a1c3d.js').cache_control == IMMUTABLE
+
+def test_encoding_negotiation(assets):
+    script = assets.get('static/js/main.8f2a1c3d.js')
+
+    status, headers, body = assets.respond(script, accept_encoding='gzip, deflate, br')
+    assert (headers['Content-Encoding'], body) == ('br', b'br-bytes')
+    assert headers['Vary'] == 'Accept-Encoding'
+
+    status, headers, body = assets.respond(script, accept_encoding='gzip, br;q=0')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == SCRIPT
+
+    status, headers, body = assets.respond(script, accept_encoding='identity')
+    assert 'Content-Encoding' not in headers
+    assert body == SCRIPT
+
+def test_etag_revalidation(assets):
+    script = assets.get('static/js/main.8f2a1c3d.js')
+    _, plain, _ = assets.respond(script)
+    _, gzipped, _ = assets.respond(script, accept_encoding='gzip')
+    assert plain['ETag'] != gzipped['ETag']
+
+    assert assets.respond(script, if_none_match=plain['ETag'])[::2] == (304, None)
+    assert assets.respond(script, accept_encoding='gzip', if_none_match=f'"other", W/{gzipped["ETag"]}')[::2] == (304, None)
+    # The gzip validator doesn't match the identity representation
+    assert assets.respond(script, if_none_match=gzipped['ETag'])[0] == 200
+    assert assets.stats()['not_modified'] == 2
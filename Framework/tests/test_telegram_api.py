@@ -0,0 +1,29 @@
+import json
+import logging
+import pytest
+from telegram_api import TelegramClient
+
+class FakeResponse:
+    def __init__(self, result):
+        self.text = json.dumps(result)
+        self._result = result
+
+    def json(self):
+        return self._result
+
+class FakeHTTP:
+    def __init__(self, result):
+        self.result = result
+
+    def post(self, url, json=None, timeout=None):
+        return FakeResponse(self.result)
+
+@pytest.mark.parametrize('error_code, level', [(403, logging.DEBUG), (429, logging.INFO), (400, logging.ERROR), (500, logging.ERROR)])
+def test_expected_errors_stay_below_error(caplog, error_code, level):
+    client = TelegramClient('0:test', http2=False)
+    client._http = FakeHTTP({'ok': False, 'error_code': error_code, 'description': 'nope'})
+
+    with caplog.at_level(logging.DEBUG, logger='telegram_api'):
+        assert client.send_message(1, 'hi')['error_code'] == error_code
+
+    assert [record.levelno for record in caplog.records if record.name == 'telegram_api' and 'API error' in record.getMessage()] == [level]
@@ -0,0 +1,36 @@
+import os
+from cache import TTLCache
+from database import Database
+
+class RacingCache(TTLCache):
+    """User cache where a payment commits between get_user's SELECT and its cache fill"""
+
+    def __init__(self):
+        super().__init__(max_size=10, ttl=60)
+        self.db = None
+        self.race = True
+
+    def set(self, key, value, ttl=None, since=None):
+        if self.race:
+            self.race = False
+            self.db.set_user_premium(key, 0.5)
+        return super().set(key, value, ttl, since)
+
+def test_read_racing_a_write_is_not_cached():
+    cache = RacingCache()
+    db = cache.db = Database(os.environ['DATABASE_PATH'], user_cache=cache, migrate=False)
+    db.add_user_if_not_exists(800, 'payer')
+
+    assert not db.get_user(800)['is_premium']
+    assert 800 not in cache
+    assert db.get_user(800)['is_premium']
+
+def test_invalidations_stay_bounded():
+    cache = TTLCache(max_size=2, ttl=60)
+    generation = cache.generation()
+    for key in ('a', 'b', 'c'):
+        cache.pop(key)
+    assert len(cache._invalidated) == 2
+    # 'a' fell out of the invalidation stamps, so it still counts as changed since generation
+    assert not cache.set('a', 1, since=generation)
+    assert cache.set('a', 1, since=cache.generation())
@@ -0,0 +1,43 @@
+import os
+import database
+from database import Database
+
+WALLET = 'Wa11etUn1inkedE1sewhere111111111111111111111'
+LINKED = 'Wa11etLinkedE1sewhere11111111111111111111111'
+
+class CountingDatabase(Database):
+    """Database that counts wallets table reads"""
+
+    def __init__(self, *args, **kwargs):
+        self.table_reads = 0
+        super().__init__(*args, **kwargs)
+
+    def get_wallet_owners(self):
+        self.table_reads += 1
+        return super().get_wallet_owners()
+
+def test_changes_from_another_process_reach_the_index():
+    path = os.environ['DATABASE_PATH']
+    first, second = Database(path, migrate=False), CountingDatabase(path, migrate=False)
+    first.add_user_if_not_exists(700, 'owner')
+    assert first.add_wallet(700, WALLET)
+    assert second.get_user_by_wallet(WALLET) == 700
+
+    # Unlinked and relinked through the first process, the second one's index follows
+    first.remove_wallet(700, WALLET)
+    assert second.get_users_by_wallets([WALLET]) == {}
+    first.add_wallet(700, LINKED)
+    assert second.get_users_by_wallets([WALLET, LINKED]) == {LINKED: 700}
+    assert second.table_reads == 1
+    assert second.wallet_index.stats()['changes_applied'] == 3
+
+def test_index_rebuilds_when_changes_were_pruned(monkeypatch):
+    path = os.environ['DATABASE_PATH']
+    first, second = Database(path, migrate=False), CountingDatabase(path, migrate=False)
+    first.add_user_if_not_exists(701, 'owner')
+
+    monkeypatch.setattr(database, 'WALLET_CHANGES_KEPT', 1)
+    first.add_wallet(701, 'Pruned1')
+    first.add_wallet(701, 'Pruned2')
+    assert second.get_users_by_wallets(['Pruned1', 'Pruned2']) == {'Pruned1': 701, 'Pruned2': 701}
+    assert second.table_reads == 2
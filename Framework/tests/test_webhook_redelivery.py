@@ -0,0 +1,66 @@
+import itertools
+import pytest
+import combined_server
+from database import get_db
+from update_dedup import UpdateDeduplicator
+
+_update_ids = itertools.count(1000)
+
+class FlakyQueue:
+    """Update queue that is full for the first `full` submissions"""
+
+    def __init__(self, full):
+        self.full = full
+        self.submitted = []
+
+    def submit(self, update, timeout=None):
+        if self.full:
+            self.full -= 1
+            return False
+        self.submitted.append(update['update_id'])
+        return True
+
+@pytest.fixture(params=['memory', 'database'])
+def deduplicator(request, monkeypatch):
+    dedup = UpdateDeduplicator(db=get_db() if request.param == 'database' else None)
+    monkeypatch.setattr(combined_server, 'update_deduplicator', dedup)
+    return dedup
+
+@pytest.fixture
+def client():
+    return combined_server.app.test_client()
+
+def make_update():
+    return {'update_id': next(_update_ids), 'message': {'message_id': 1, 'chat': {'id': 1}, 'from': {'id': 1}}}
+
+def test_redelivery_after_503_is_queued(deduplicator, client, monkeypatch):
+    queue = FlakyQueue(full=1)
+    monkeypatch.setattr(combined_server, 'WEBHOOK_ASYNC_MODE', True)
+    monkeypatch.setattr(combined_server, 'update_queue', queue)
+    update = make_update()
+
+    assert client.post('/telegram_webhook', json=update).status_code == 503
+    assert client.post('/telegram_webhook', json=update).status_code == 200
+    assert queue.submitted == [update['update_id']]
+
+    # Once accepted, further redeliveries are still dropped
+    assert client.post('/telegram_webhook', json=update).status_code == 200
+    assert queue.submitted == [update['update_id']]
+
+def test_redelivery_after_500_is_processed(deduplicator, client, monkeypatch):
+    processed = []
+    failures = [RuntimeError("handler failed")]
+
+    def process_update(update):
+        if failures:
+            raise failures.pop()
+        processed.append(update['update_id'])
+
+    monkeypatch.setattr(combined_server, 'WEBHOOK_ASYNC_MODE', False)
+    monkeypatch.setattr(combined_server, 'process_update', process_update)
+    update = make_update()
+
+    assert client.post('/telegram_webhook', json=update).status_code == 500
+    assert client.post('/telegram_webhook', json=update).status_code == 200
+    assert client.post('/telegram_webhook', json=update).status_code == 200
+    assert processed == [update['update_id']]
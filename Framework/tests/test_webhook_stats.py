@@ -0,0 +1,15 @@
+import combined_server
+
+def test_stats_need_the_token(monkeypatch):
+    client = combined_server.app.test_client()
+    monkeypatch.setattr(combined_server, 'STATS_TOKEN', '')
+    assert client.get('/webhook_stats').status_code == 404
+    assert client.get('/webhook_stats', headers={'Authorization': 'Bearer '}).status_code == 404
+
+    monkeypatch.setattr(combined_server, 'STATS_TOKEN', 'stats-secret')
+    assert client.get('/webhook_stats').status_code == 404
+    assert client.get('/webhook_stats', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+
+    response = client.get('/webhook_stats', headers={'Authorization': 'Bearer stats-secret'})
+    assert response.status_code == 200
+    assert 'callbacks' in response.get_json()
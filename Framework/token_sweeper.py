@@ -0,0 +1,95 @@
+import atexit
+import datetime
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TokenSweeper:
+    """Deletes expired and used login tokens in the background.
+
+    Every interval it empties auth_tokens and spent_login_nonces of rows that can no
+    longer be redeemed, batch_size rows per transaction so no sweep holds a lock for
+    long. At most max_batches are deleted per table and sweep; anything left over is
+    picked up by the next one.
+    """
+
+    def __init__(self, db, interval=300, batch_size=1000, max_batches=100):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'errors': 0, 'purged': {'auth_tokens': 0, 'spent_login_nonces': 0}, 'last_run': None}
+
+    def start(self):
+        """Start sweeping in a daemon thread"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name='token-sweeper', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """Stop after the batch in progress"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                logger.error(f"Error sweeping login tokens: {e}", exc_info=True)
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        """Run one sweep. Returns the rows deleted per table"""
+        started = time.monotonic()
+        purged = {
+            'auth_tokens': self._drain(lambda: self.db.clean_expired_tokens(self.batch_size)),
+            'spent_login_nonces': self._drain(lambda: self.db.purge_spent_login_nonces(datetime.datetime.now(), self.batch_size))
+        }
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            self._stats['runs'] += 1
+            for table, count in purged.items():
+                self._stats['purged'][table] += count
+            self._stats['last_run'] = {
+                'at': datetime.datetime.now().isoformat(),
+                'purged': purged,
+                'seconds': round(elapsed, 3)
+            }
+        logger.info(f"Token sweep purged {purged['auth_tokens']} auth tokens and {purged['spent_login_nonces']} spent nonces in {elapsed:.2f}s")
+        return purged
+
+    def _drain(self, delete_batch):
+        """Call delete_batch until it deletes less than a full batch"""
+        total = 0
+        for _ in range(self.max_batches):
+            if self._stop.is_set():
+                break
+            deleted = delete_batch()
+            total += deleted
+            if deleted < self.batch_size:
+                break
+        return total
+
+    def stats(self):
+        """Sweep counters"""
+        with self._lock:
+            return {
+                'runs': self._stats['runs'],
+                'errors': self._stats['errors'],
+                'purged': dict(self._stats['purged']),
+                'last_run': self._stats['last_run'],
+                'interval': self.interval,
+                'batch_size': self.batch_size
+            }
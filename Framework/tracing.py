@@ -0,0 +1,241 @@
+import atexit
+import contextvars
+import functools
+import queue
+import random
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import requests
+from config import TRACE_ENABLED, TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_EXPORTER, TRACE_COLLECTOR_URL, TRACE_SERVICE_NAME, TRACE_QUEUE_SIZE
+from log_setup import LazyJson
+from instrumentation import wrap_public_methods
+
+logger = logging.getLogger(__name__)
+
+# Finished traces are written here by the log exporter, one JSON line each
+trace_logger = logging.getLogger('tracing.spans')
+
+_current = contextvars.ContextVar('trace', default=None)
+
+def _new_id(bits):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+class Trace:
+    """The spans of one update or payment webhook, recorded in the thread that handles it.
+
+    Spans use the Zipkin v2 JSON fields, so the log exporter and the collector see the
+    same thing: ids in hex, timestamp and duration in microseconds.
+    """
+
+    def __init__(self, sampled):
+        self.trace_id = _new_id(128)
+        self.sampled = sampled
+        self.spans = []
+        self.stack = []
+
+    def open(self, name, tags):
+        span = {
+            'traceId': self.trace_id,
+            'id': _new_id(64),
+            'name': name,
+            'timestamp': int(time.time() * 1000000),
+            'localEndpoint': {'serviceName': TRACE_SERVICE_NAME}
+        }
+        if self.stack:
+            span['parentId'] = self.stack[-1]['id']
+        if tags:
+            span['tags'] = {key: str(value) for key, value in tags.items()}
+        span['_start'] = time.perf_counter()
+        self.stack.append(span)
+        return span
+
+    def close(self, span, error=None):
+        span['duration'] = max(1, int((time.perf_counter() - span.pop('_start')) * 1000000))
+        if error is not None:
+            span.setdefault('tags', {})['error'] = f'{type(error).__name__}: {error}'[:200]
+        self.stack.pop()
+        self.spans.append(span)
+        return span['duration']
+
+@contextmanager
+def start_trace(name, **tags):
+    """Trace a unit of work. Inside a trace already, this is just a span.
+
+    A fraction TRACE_SAMPLE_RATE of traces are exported. With TRACE_SLOW_MS set every
+    trace is recorded and the ones that took longer are exported as well.
+    """
+    if not TRACE_ENABLED:
+        yield None
+        return
+    if _current.get() is not None:
+        with span(name, **tags) as current:
+            yield current
+        return
+
+    sampled = random.random() < TRACE_SAMPLE_RATE
+    if not sampled and not TRACE_SLOW_MS:
+        yield None
+        return
+
+    trace = Trace(sampled)
+    token = _current.set(trace)
+    root = trace.open(name, tags)
+    error = None
+    try:
+        yield root
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        duration = trace.close(root, error)
+        _current.reset(token)
+        if trace.sampled or (TRACE_SLOW_MS and duration >= TRACE_SLOW_MS * 1000):
+            _export(trace)
+
+@contextmanager
+def span(name, **tags):
+    """Record a child span of the current trace; a no-op outside one"""
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+
+    current = trace.open(name, tags)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        trace.close(current, error)
+
+def tag(key, value):
+    """Tag the innermost open span of the current trace"""
+    trace = _current.get()
+    if trace is not None and trace.stack:
+        trace.stack[-1].setdefault('tags', {})[key] = str(value)
+
+def current_trace_id():
+    """The id of the trace being recorded, or None"""
+    trace = _current.get()
+    return trace.trace_id if trace else None
+
+def trace_methods(cls, prefix):
+    """Record a span for every public method defined on cls, named prefix + method name"""
+    wrap_public_methods(cls, lambda method, name: _traced_method(method, prefix + name), '_traced')
+
+def _traced_method(method, span_name):
+    @functools.wraps(method)
+    def traced(*args, **kwargs):
+        if _current.get() is None:
+            return method(*args, **kwargs)
+        with span(span_name):
+            return method(*args, **kwargs)
+    return traced
+
+# --- Export ---
+
+class CollectorExporter:
+    """Posts finished spans to a Zipkin-compatible collector from a background thread.
+
+    Traces are queued without blocking the request; when the queue is full they are
+    dropped and counted. Whatever is queued is sent in one POST per batch.
+    """
+
+    def __init__(self, url, max_size=1000, batch_size=100, timeout=5):
+        self.url = url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_size)
+        self.session = requests.Session()
+        self._stats = {'exported': 0, 'dropped': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name='trace-exporter', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def export(self, spans):
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self._count('dropped')
+
+    def _loop(self):
+        while True:
+            batch = list(self.queue.get())
+            while len(batch) < self.batch_size:
+                try:
+                    batch.extend(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            response = self.session.post(self.url, json=batch, timeout=self.timeout)
+            response.raise_for_status()
+            self._count('exported', len(batch))
+        except Exception as e:
+            self._count('errors')
+            logger.warning(f"Failed to export {len(batch)} spans to {self.url}: {e}")
+
+    def flush(self):
+        """Send whatever is still queued; used at exit"""
+        batch = []
+        while True:
+            try:
+                batch.extend(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._send(batch)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self.queue.qsize()
+        return stats
+
+class LogExporter:
+    """Writes each finished trace as one JSON line on the tracing.spans logger"""
+
+    def __init__(self):
+        self._stats = {'exported': 0}
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            self._stats['exported'] += len(spans)
+        trace_logger.info("trace %s %s %.1fms: %s", spans[-1]['traceId'], spans[-1]['name'], spans[-1]['duration'] / 1000, LazyJson(spans))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+exporter = None
+if TRACE_ENABLED:
+    if TRACE_EXPORTER == 'collector':
+        exporter = CollectorExporter(TRACE_COLLECTOR_URL, max_size=TRACE_QUEUE_SIZE)
+    else:
+        exporter = LogExporter()
+        trace_logger.setLevel(logging.INFO)
+
+def _export(trace):
+    # The root span closes last, so it is the final entry
+    exporter.export(trace.spans)
+
+def tracing_stats():
+    """Counters for /webhook_stats"""
+    if not exporter:
+        return None
+    stats = exporter.stats()
+    stats['exporter'] = TRACE_EXPORTER
+    stats['sample_rate'] = TRACE_SAMPLE_RATE
+    return stats
@@ -0,0 +1,77 @@
+import datetime
+import threading
+import logging
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """Drops Telegram updates whose update_id was already seen.
+
+    Recently seen ids are kept in a bounded in-process TTL cache. When a database is
+    given, ids are also recorded in the shared processed_updates table so that every
+    process behind the load balancer sees the same set.
+
+    is_duplicate reserves an id before the update is handled, so two deliveries racing
+    through different processes can't both run it. When the update is then answered
+    with an error, forget releases the id so Telegram's redelivery gets through.
+    """
+
+    def __init__(self, ttl=3600, max_size=100000, db=None, purge_every=1000):
+        self.ttl = ttl
+        self.db = db
+        self.purge_every = purge_every
+        self.recent = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {'checked': 0, 'duplicates_dropped': 0, 'released': 0}
+
+    def is_duplicate(self, update_id):
+        """Record an update_id and report whether it had already been seen"""
+        with self._lock:
+            self._stats['checked'] += 1
+            checked = self._stats['checked']
+
+        duplicate = not self.recent.add(update_id)
+        if not duplicate and self.db:
+            try:
+                duplicate = not self.db.mark_update_processed(update_id)
+            except Exception as e:
+                # Don't block updates if the shared backend is unavailable
+                logger.error(f"Error checking update {update_id} against shared backend: {e}")
+
+            if checked % self.purge_every == 0:
+                self._purge()
+
+        if duplicate:
+            with self._lock:
+                self._stats['duplicates_dropped'] += 1
+            logger.info(f"Dropping duplicate update {update_id}")
+        return duplicate
+
+    def forget(self, update_id):
+        """Release an update_id reserved by is_duplicate, so a redelivery is processed"""
+        with self._lock:
+            self._stats['released'] += 1
+        self.recent.pop(update_id)
+        if self.db:
+            try:
+                self.db.forget_processed_update(update_id)
+            except Exception as e:
+                logger.error(f"Error releasing update {update_id} in shared backend: {e}")
+
+    def _purge(self):
+        """Delete shared records that have outlived the ttl"""
+        try:
+            cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.ttl)
+            purged = self.db.purge_processed_updates(cutoff)
+            logger.info(f"Purged {purged} processed update records")
+        except Exception as e:
+            logger.error(f"Error purging processed updates: {e}")
+
+    def stats(self):
+        """Duplicate counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['backend'] = 'database' if self.db else 'memory'
+        stats['cached_ids'] = len(self.recent)
+        return stats
@@ -0,0 +1,181 @@
+import os
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class UpdateQueue:
+    """Bounded in-process work queue drained by a fixed pool of worker threads"""
+
+    def __init__(self, handler, workers=4, max_size=1000, name='updates'):
+        self.handler = handler
+        self.name = name
+        self.max_size = max_size
+        self.worker_count = workers
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._accepting = True
+        self._stats = {
+            'submitted': 0,
+            'processed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'in_flight': 0,
+            'max_depth': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0
+        }
+        self._workers = []
+        self._pid = None
+
+    def _start(self):
+        """Start the worker threads (again after a fork, since threads don't survive it)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._workers = []
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+        logger.info(f"Started {self.worker_count} {self.name} workers (queue size {self.max_size})")
+
+    def submit(self, item, timeout=0):
+        """Queue an item, waiting up to timeout seconds for space. Returns False if it was rejected"""
+        if not self._accepting:
+            self._count('rejected')
+            return False
+
+        if self._pid != os.getpid():
+            self._start()
+
+        try:
+            self._queue.put((time.monotonic(), item), block=timeout > 0, timeout=timeout or None)
+        except queue.Full:
+            self._count('rejected')
+            logger.warning(f"{self.name} queue full ({self.max_size}), rejecting item")
+            return False
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+        return True
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run(self):
+        """Worker loop"""
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                self._queue.task_done()
+                return
+
+            queued_at, item = entry
+            waited = time.monotonic() - queued_at
+            with self._lock:
+                self._stats['in_flight'] += 1
+                self._stats['total_wait'] += waited
+                self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+
+            try:
+                self.handler(item)
+                outcome = 'processed'
+            except Exception as e:
+                logger.error(f"Error processing {self.name} item: {e}", exc_info=True)
+                outcome = 'failed'
+            finally:
+                with self._lock:
+                    self._stats['in_flight'] -= 1
+                    self._stats[outcome] += 1
+                self._queue.task_done()
+
+    def stats(self):
+        """Snapshot of queue depth and throughput counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats['processed'] + stats['failed']
+        stats['depth'] = self._queue.qsize()
+        stats['capacity'] = self.max_size
+        stats['workers'] = len(self._workers)
+        stats['avg_wait'] = stats.pop('total_wait') / done if done else 0.0
+        return stats
+
+    def shutdown(self, timeout=30):
+        """Stop accepting work, drain queued items and stop the workers"""
+        if not self._accepting:
+            return True
+        self._accepting = False
+        if self._pid != os.getpid():
+            return True
+        logger.info(f"Draining {self._queue.qsize()} queued {self.name} items")
+
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        drained = not self._queue.unfinished_tasks
+        if not drained:
+            logger.warning(f"{self.name} queue not drained after {timeout}s, {self._queue.qsize()} items left")
+
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                break
+        return drained
+
+class LaneDispatcher:
+    """Routes items to single-worker lanes by key, so items sharing a key run in order
+    while different keys run concurrently"""
+
+    def __init__(self, handler, key_func, lanes=8, max_size=1000, name='updates'):
+        self.key_func = key_func
+        self.name = name
+        self._accepting = True
+        lane_size = max(1, max_size // lanes)
+        self.lanes = [
+            UpdateQueue(handler, workers=1, max_size=lane_size, name=f"{name}-lane-{i}")
+            for i in range(lanes)
+        ]
+
+    def lane_for(self, item):
+        """Pick the lane an item belongs to"""
+        return self.lanes[hash(self.key_func(item)) % len(self.lanes)]
+
+    def submit(self, item, timeout=0):
+        """Queue an item on its lane. Returns False if it was rejected"""
+        if not self._accepting:
+            return False
+        return self.lane_for(item).submit(item, timeout)
+
+    def stats(self):
+        """Totals across all lanes plus per-lane depth and counters"""
+        lanes = [lane.stats() for lane in self.lanes]
+        totals = {}
+        for key in ('submitted', 'processed', 'failed', 'rejected', 'in_flight', 'depth', 'capacity'):
+            totals[key] = sum(lane[key] for lane in lanes)
+        totals['max_depth'] = max(lane['max_depth'] for lane in lanes)
+        totals['max_wait'] = max(lane['max_wait'] for lane in lanes)
+        totals['lanes'] = [
+            {'depth': lane['depth'], 'max_depth': lane['max_depth'], 'processed': lane['processed'], 'rejected': lane['rejected']}
+            for lane in lanes
+        ]
+        return totals
+
+    def shutdown(self, timeout=30):
+        """Stop accepting work and drain every lane within a shared deadline"""
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        drained = True
+        for lane in self.lanes:
+            drained = lane.shutdown(max(0, deadline - time.monotonic())) and drained
+        return drained
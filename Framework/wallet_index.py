@@ -0,0 +1,102 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class WalletIndex:
+    """In-memory solana_address -> telegram_id index used to match incoming payments.
+
+    The wallets table has no unique constraint on the address, so every owner is kept
+    in registration order and the earliest one wins, matching get_user_by_wallet.
+
+    Every link and unlink also appends a numbered row to wallet_changes (see
+    Database.add_wallet). sync() reads the current change number, a single-row read,
+    and applies any rows this process hasn't seen yet, so after a sync both hits and
+    misses are as current as the wallets table. If the rows it needs were already
+    pruned, the index is rebuilt from the table.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._owners = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        # One sync at a time, so changes are applied in order
+        self._sync_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'changes_applied': 0, 'rebuilds': 0}
+
+    def build(self):
+        """Load the whole index from the wallets table"""
+        with self._sync_lock:
+            return self._build()
+
+    def _build(self):
+        # Read the change number first: anything committed after it is applied again
+        # by the next sync, which is harmless since adds and removes are idempotent
+        version = self.db.get_wallet_change_version()
+        owners = {}
+        for address, telegram_id in self.db.get_wallet_owners():
+            owners.setdefault(address, []).append(telegram_id)
+        with self._lock:
+            self._owners = owners
+            self._version = version
+            self._stats['rebuilds'] += 1
+        logger.info(f"Wallet index built with {len(owners)} addresses at change {version}")
+        return len(owners)
+
+    def sync(self):
+        """Apply wallet changes committed by any process since the last sync"""
+        with self._sync_lock:
+            version = self.db.get_wallet_change_version()
+            if version == self._version:
+                return 0
+
+            changes = self.db.get_wallet_changes(self._version, version)
+            # Change numbers have no gaps, so any missing row was pruned
+            if len(changes) != version - self._version:
+                logger.warning(f"Wallet changes after {self._version} were pruned, rebuilding the index")
+                self._build()
+                return 0
+
+            with self._lock:
+                for address, telegram_id, linked in changes:
+                    _apply(self._owners, address, telegram_id, linked)
+                self._version = version
+                self._stats['changes_applied'] += len(changes)
+            return len(changes)
+
+    def lookup(self, address):
+        """Get the owner of a wallet, or None if it isn't indexed"""
+        with self._lock:
+            owners = self._owners.get(address)
+            self._stats['hits' if owners else 'misses'] += 1
+            return owners[0] if owners else None
+
+    def lookup_many(self, addresses):
+        """Get owners for several wallets at once. Unknown addresses are left out"""
+        with self._lock:
+            found = {address: self._owners[address][0] for address in set(addresses) if address in self._owners}
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(set(addresses)) - len(found)
+            return found
+
+    def stats(self):
+        """Size, hit/miss and sync counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['addresses'] = len(self._owners)
+            stats['version'] = self._version
+        return stats
+
+def _apply(owners, address, telegram_id, linked):
+    """Apply one link (linked=True) or unlink to an address -> owners mapping"""
+    if linked:
+        current = owners.setdefault(address, [])
+        if telegram_id not in current:
+            current.append(telegram_id)
+    else:
+        current = owners.get(address)
+        if current and telegram_id in current:
+            current.remove(telegram_id)
+            if not current:
+                del owners[address]
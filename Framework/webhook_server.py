@@ -1,18 +1,29 @@
 from flask import Flask, request, jsonify
-import requests
 import logging
-import json
-from config import BOT_TOKEN, REQUIRED_PAYMENT, COMMISSION_PERCENTAGE, DEPOSIT_ADDRESS
-from database import Database
+from config import DEPOSIT_ADDRESS, PAYMENT_BATCH_MODE, NOTIFY_QUEUE_ENABLED, NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_RATE, NOTIFY_WORKERS, NOTIFY_MAX_ATTEMPTS, NOTIFY_RETRY_BASE_DELAY, NOTIFY_RETRY_MAX_DELAY
+from database import db, migrate
+from telegram_api import get_client
+from notifier import NotificationQueue
+from log_setup import configure_logging, log_payload
+from payments import process_transactions, process_each_transaction
 
 app = Flask(__name__)
-db = Database('translucent_bot.db')
+
+# Rate-limited outbound queue for payment and referral notifications
+notifier = None
+if NOTIFY_QUEUE_ENABLED:
+    notifier = NotificationQueue(
+        db,
+        global_rate=NOTIFY_GLOBAL_RATE,
+        per_chat_rate=NOTIFY_PER_CHAT_RATE,
+        workers=NOTIFY_WORKERS,
+        max_attempts=NOTIFY_MAX_ATTEMPTS,
+        base_delay=NOTIFY_RETRY_BASE_DELAY,
+        max_delay=NOTIFY_RETRY_MAX_DELAY
+    )
 
 # Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 @app.route('/payment_webhook', methods=['POST'])
@@ -20,129 +31,33 @@ def payment_webhook():
     """Handle payment webhook from Solana payment processor"""
     try:
         data = request.json
-        logger.info(f"Received webhook data: {json.dumps(data, indent=2)}")
+        log_payload(logger, "Received webhook data", data)
         
-        # Check if data is a list (multiple transactions)
-        if isinstance(data, list):
-            logger.info(f"Processing {len(data)} transactions")
-            for transaction in data:
-                process_transaction(transaction)
+        transactions = data if isinstance(data, list) else [data]
+        if PAYMENT_BATCH_MODE:
+            logger.info("Processing %d transactions as one batch", len(transactions))
+            process_transactions(transactions, send_telegram_message)
         else:
-            # Single transaction
-            logger.info("Processing single transaction")
-            process_transaction(data)
+            logger.info("Processing %d transactions", len(transactions))
+            process_each_transaction(transactions, send_telegram_message)
             
         return jsonify({'status': 'success'}), 200
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def process_transaction(transaction):
-    """Process a single transaction"""
-    try:
-        # Log the entire transaction for debugging
-        logger.info(f"Processing transaction: {json.dumps(transaction, indent=2)}")
-        
-        # Extract transaction details
-        if 'signature' not in transaction:
-            logger.error("Transaction missing signature")
-            return
-            
-        transaction_id = transaction['signature']
-        logger.info(f"Transaction ID: {transaction_id}")
-        
-        # Check for native transfers
-        if 'nativeTransfers' not in transaction or not transaction['nativeTransfers']:
-            logger.info(f"No native transfers in transaction {transaction_id}")
-            return
-            
-        # Log our deposit address for comparison
-        logger.info(f"Our deposit address: {DEPOSIT_ADDRESS}")
-        
-        # Look for transfers to our deposit address
-        for transfer in transaction['nativeTransfers']:
-            to_address = transfer.get('toUserAccount')
-            from_address = transfer.get('fromUserAccount')
-            amount_lamports = transfer.get('amount', 0)
-            
-            logger.info(f"Transfer: {amount_lamports} lamports from {from_address} to {to_address}")
-            
-            # Convert lamports to SOL (1 SOL = 1,000,000,000 lamports)
-            amount_sol = amount_lamports / 1_000_000_000
-            
-            # Check if this is a payment to our deposit address
-            if to_address == DEPOSIT_ADDRESS:
-                logger.info(f"✅ Payment detected: {amount_sol} SOL from {from_address} to {to_address}")
-                
-                # Find the user who owns this wallet
-                user_id = db.get_user_by_wallet(from_address)
-                logger.info(f"Looking up user for wallet {from_address}: user_id = {user_id}")
-                
-                if not user_id:
-                    logger.warning(f"Wallet {from_address} not associated with any user")
-                    continue
-                
-                # Record the payment
-                success = db.add_payment(user_id, transaction_id, amount_sol)
-                logger.info(f"Payment recorded: {success}")
-                
-                # Get user's total paid amount
-                user = db.get_user(user_id)
-                paid_amount = user['paid_amount'] if user else 0
-                logger.info(f"User {user_id} total paid amount: {paid_amount}")
-                
-                # Check if payment is sufficient for premium access
-                if paid_amount >= REQUIRED_PAYMENT:
-                    logger.info(f"User {user_id} has paid enough for premium access")
-                    # Set user to premium
-                    db.set_premium_status(user_id, True)
-                    
-                    # Process referral if exists
-                    referrer_id = db.convert_referral(user_id, amount_sol, COMMISSION_PERCENTAGE)
-                    
-                    # Send notification to user
-                    send_telegram_message(user_id, 
-                        "🎉 <b>Payment Confirmed!</b> 🎉\n\n"
-                        "You now have full access to all premium features."
-                    )
-                    
-                    # Send notification to referrer if exists
-                    if referrer_id:
-                        referral_stats = db.get_referral_stats(referrer_id)
-                        send_telegram_message(referrer_id,
-                            "🎉 <b>Referral Converted!</b> 🎉\n\n"
-                            f"You earned {amount_sol * (COMMISSION_PERCENTAGE/100):.3f} SOL in commission.\n\n"
-                            f"Total commission earned: {referral_stats['total_commission']:.3f} SOL"
-                        )
-                else:
-                    # Payment is partial, send notification about remaining amount
-                    remaining = REQUIRED_PAYMENT - paid_amount
-                    send_telegram_message(user_id,
-                        "💰 <b>Partial Payment Received</b> 💰\n\n"
-                        f"• Amount received: {amount_sol:.3f} SOL\n"
-                        f"• Total paid so far: {paid_amount:.3f} SOL\n"
-                        f"• Remaining amount: {remaining:.3f} SOL\n\n"
-                        "Please complete the payment to gain full access."
-                    )
-            else:
-                logger.info(f"❌ Not a payment to our deposit address: {to_address} != {DEPOSIT_ADDRESS}")
-    except Exception as e:
-        logger.error(f"Error processing transaction: {e}", exc_info=True)
-
 def send_telegram_message(chat_id, text):
     """Send a message to a user via Telegram API"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    logger.info(f"Sending Telegram message to {chat_id}: {text}")
-    response = requests.post(url, data=payload)
-    if response.status_code != 200:
-        logger.error(f"Failed to send Telegram message: {response.text}")
-    else:
-        logger.info(f"Telegram message sent successfully: {response.json()}")
+    if notifier:
+        # Delivered by the rate-limited queue, which retries and dead-letters on failure
+        logger.debug("Queueing Telegram message to %s", chat_id)
+        notifier.send(chat_id, text)
+        return
+    
+    logger.debug("Sending Telegram message to %s", chat_id)
+    result = get_client().send_message(chat_id, text)
+    if not result.get('ok'):
+        logger.warning("Telegram message to %s failed: %s", chat_id, result)
 
 # Add a simple route to check if the server is running
 @app.route('/', methods=['GET'])
@@ -159,5 +74,6 @@ def test_payment():
     })
 
 if __name__ == '__main__':
+    migrate()
     logger.info(f"Starting payment webhook server with deposit address: {DEPOSIT_ADDRESS}")
     app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file